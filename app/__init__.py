@@ -7,8 +7,9 @@ from dotenv import load_dotenv
 from flask_cors import CORS
 import logging
 import os
+from app.db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 logging.basicConfig(
 		level=logging.INFO,
@@ -20,11 +21,11 @@ def create_app():
 	load_dotenv()
 
 	app = Flask(__name__)
-	CORS(app, supports_credentials=True)  # Allow credentials and all origins
+	CORS(app, supports_credentials=True, expose_headers=["X-Next-Cursor", "ETag"])  # Allow credentials and all origins
 	
 	from app.resources.chat import ChatAPI
 	from app.resources.prompt import PromptResource
-	from app.resources.patients import PatientsResource
+	from app.resources.patients import PatientsResource, SimilarPatientsResource
 	from app.resources.chat_history import ChatHistoryResource
 	from app.resources.doctor_resource import DoctorResource
 	from app.resources.ai_resource import AIResource
@@ -33,6 +34,7 @@ def create_app():
 	api.add_resource(ChatAPI, "/chat/<int:patient_id>")
 	api.add_resource(PromptResource, '/prompt/<int:user_id>')
 	api.add_resource(PatientsResource, '/patients')
+	api.add_resource(SimilarPatientsResource, '/patients/<int:patient_id>/similar')
 	api.add_resource(ChatHistoryResource, '/chat/<string:user_id>/history')
 	
 	# Add new doctor endpoints
@@ -62,14 +64,52 @@ def create_app():
 		# os.environ("GOOGLE_APPLICATION_CREDENTIALS") = "./viki-419417-677fe76ddb4a.json"
 
 	logging.info(app.config.get("SQLALCHEMY_DATABASE_URI"))
+	from app.database import build_engine_options, instrument_engine
+	app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", build_engine_options(app.config))
+
+	# Read replicas are registered as binds and only used through replica_reads()
+	replica_keys = [f"replica_{i}" for i in range(len(app.config["DB_REPLICA_URIS"]))]
+	binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+	for key, uri in zip(replica_keys, app.config["DB_REPLICA_URIS"]):
+		binds[key] = {"url": uri, **build_engine_options(app.config, pool_name=key)}
+
 	# Initialize extensions
 	db.init_app(app)
 	migrate.init_app(app, db)
+
+	from app.db_routing import replica_router
+	replica_router.configure(
+		replica_keys,
+		app.config["DB_REPLICA_MAX_LAG_SECONDS"],
+		app.config["DB_REPLICA_HEALTH_INTERVAL"]
+	)
+	with app.app_context():
+		instrument_engine(db.engine, app.config)
+		for key in replica_keys:
+			instrument_engine(db.engines[key], app.config, pool_name=key)
+			replica_router.watch(key, db.engines[key])
 	
 	from app.oauth import init_oauth
 	from app.models.patient import Patient
 	from app.models.doctor import Doctor
+	from app.models.ai_result import AIResult
+	from app.identity_cache import identity_cache
+	from app.result_cache import result_cache
+	from app.semantic_cache import semantic_cache, load_faq
+	from app.db_routing import replica_reads
 	init_oauth(app)
+	identity_cache.configure(app.config["USER_CACHE_TTL"], app.config["USER_CACHE_MAX_SIZE"])
+	result_cache.configure(app.config["AI_RESULT_CACHE_SIZE"])
+	semantic_cache.configure(
+		app.config["SEMANTIC_CACHE_ENABLED"],
+		app.config["SEMANTIC_CACHE_THRESHOLD"],
+		app.config["SEMANTIC_CACHE_MAX_ENTRIES"],
+		app.config["SEMANTIC_CACHE_TTL"],
+		load_faq(app.config["SEMANTIC_CACHE_FAQ_PATH"]) if app.config["SEMANTIC_CACHE_ENABLED"] else []
+	)
+	# Build the generation configs once, before the first request needs them
+	from app.ai_services.profiles import compile_profiles
+	compile_profiles()
 	
 	login_manager = LoginManager()
 	login_manager.init_app(app)
@@ -80,14 +120,38 @@ def create_app():
 			user_type = session.get("role")  # Retrieve user type from session
 
 			if user_type == "patient":
-					return Patient.query.get(int(user_id))
+					model = Patient
 			elif user_type == "doctor":
-					return Doctor.query.get(int(user_id))
-			
-			return None
+					model = Doctor
+			else:
+					return None
+
+			# Serve repeat requests from the per-process identity cache
+			user = identity_cache.get(user_type, user_id)
+			if user is not None:
+					return user
+
+			with replica_reads():
+					user = model.query.get(int(user_id))
+			if user is None:
+					# A user who just signed up may not have reached the replica yet
+					user = model.query.get(int(user_id))
+			if user is None:
+					return None
+			return identity_cache.put(user_type, user)
+
+	# Every request gets a time budget that downstream calls must fit in
+	from app.deadline import start_request_deadline
+	app.before_request(start_request_deadline)
 
 	# Register blueprints
 	from app.auth import auth
+	from app.metrics import metrics
 	app.register_blueprint(auth)
+	app.register_blueprint(metrics)
+
+	# flask patient-index backfill
+	from app.patient_index import patient_index_cli
+	app.cli.add_command(patient_index_cli)
 	
 	return app
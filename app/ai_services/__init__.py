@@ -1,13 +1,32 @@
+from flask import current_app
 from .base import AIService
 from .gemini_service import GeminiAIService
 from .medical_lm_service import MedicalLMService
+from .resilience import ResilientAIService
+from .router import RoutedAIService, routing_policies
+from .limiter import RateLimitedAIService, AdmissionRejected, ai_priority, INTERACTIVE, STANDARD, BACKGROUND
 
-# Factory function to get the appropriate AI service
-def get_ai_service(service_type="gemini") -> AIService:
-    """Get an AI service implementation by type."""
+def create_ai_service(service_type="gemini") -> AIService:
+    """Create an AI service implementation by type, admitted through its rate limiter."""
     if service_type == "gemini":
-        return GeminiAIService()
+        service = GeminiAIService()
     elif service_type == "medical_lm":
-        return MedicalLMService()
+        service = MedicalLMService()
     else:
         raise ValueError(f"Unknown AI service type: {service_type}")
+    return RateLimitedAIService(service_type, service, current_app.config.get("AI_ADMISSION_TIMEOUT", 10))
+
+# Factory function to get the appropriate AI service
+def get_ai_service(service_type="gemini", task=None) -> AIService:
+    """
+    Get an AI service wrapped with retries, hedging and fallback.
+
+    When a routing policy exists for the task, the model is picked per call
+    by the router; otherwise service_type is used.
+    """
+    if service_type not in ("gemini", "medical_lm"):
+        raise ValueError(f"Unknown AI service type: {service_type}")
+    policy = routing_policies().get(task) if task else None
+    if policy:
+        return RoutedAIService(task, policy, create_ai_service)
+    return ResilientAIService(service_type, create_ai_service)
@@ -8,7 +8,9 @@ class AIService(ABC):
     def generate_response(self, messages: List[Dict[str, Any]], 
                           system_instruction: Optional[str] = None,
                           response_mime_type: Optional[str] = None,
-                          response_schema: Optional[Dict[str, Any]] = None) -> str:
+                          response_schema: Optional[Dict[str, Any]] = None,
+                          max_output_tokens: Optional[int] = None,
+                          profile: Optional[str] = None) -> str:
         """
         Generate a complete response from the AI model.
         
@@ -17,6 +19,9 @@ class AIService(ABC):
             system_instruction: Optional system instruction for the AI
             response_mime_type: Optional MIME type for the response format (e.g., "application/json")
             response_schema: Optional JSON schema for structured output
+            max_output_tokens: Optional cap on the response length, overriding the model's configured default
+            profile: Optional name of a registered generation profile, used instead of
+                response_mime_type and response_schema
             
         Returns:
             str: The generated response
@@ -27,7 +32,9 @@ class AIService(ABC):
     def generate_stream(self, messages: List[Dict[str, Any]], 
                         system_instruction: Optional[str] = None,
                         response_mime_type: Optional[str] = None,
-                        response_schema: Optional[Dict[str, Any]] = None) -> Generator[str, None, None]:
+                        response_schema: Optional[Dict[str, Any]] = None,
+                        max_output_tokens: Optional[int] = None,
+                        profile: Optional[str] = None) -> Generator[str, None, None]:
         """
         Stream the response from the AI model.
         
@@ -36,6 +43,9 @@ class AIService(ABC):
             system_instruction: Optional system instruction for the AI
             response_mime_type: Optional MIME type for the response format (e.g., "application/json")
             response_schema: Optional JSON schema for structured output
+            max_output_tokens: Optional cap on the response length, overriding the model's configured default
+            profile: Optional name of a registered generation profile, used instead of
+                response_mime_type and response_schema
             
         Returns:
             Generator yielding response chunks
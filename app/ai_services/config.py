@@ -1,9 +1,26 @@
+import os
+
+# Optional endpoint override and static token for all Vertex AI clients, e.g.
+# to run against a local stand-in for the genai endpoint
+VERTEX_BASE_URL = os.getenv("VERTEX_BASE_URL")
+VERTEX_ACCESS_TOKEN = os.getenv("VERTEX_ACCESS_TOKEN")
+
 # AI Service configurations
 AI_SERVICE_CONFIG = {
     "gemini": {
         "project": "viki-419417",
-        "location": "us-central1",
+        # Calls go to the region with the best recent latency and error rate
+        "locations": ["us-central1", "us-east4", "us-west1"],
+        "base_url": VERTEX_BASE_URL,
+        "access_token": VERTEX_ACCESS_TOKEN,
+        "region_failover_attempts": 2,
+        "quota_cooldown_seconds": 60,
         "model_name": "gemini-2.0-flash-001",
+        # Per-process admission limits; 0 disables a limit
+        "max_concurrency": 16,
+        "requests_per_minute": 300,
+        "tokens_per_minute": 400000,
+        "max_input_tokens": 1000000,
         "temperature": 1.0,
         "top_p": 0.95,
         "max_output_tokens": 1024,
@@ -16,8 +33,16 @@ AI_SERVICE_CONFIG = {
     },
     "medical_lm": {
         "project": "viki-419417",
-        "location": "us-central1",
+        "locations": ["us-central1"],
+        "base_url": VERTEX_BASE_URL,
+        "access_token": VERTEX_ACCESS_TOKEN,
+        "region_failover_attempts": 2,
+        "quota_cooldown_seconds": 60,
         "model_name": "medlm-large-1.5@001",
+        "max_concurrency": 4,
+        "requests_per_minute": 60,
+        "tokens_per_minute": 100000,
+        "max_input_tokens": 32000,
         "temperature": 0.2,  # Lower temperature for more precise medical responses
         "top_p": 0.95,
         "max_output_tokens": 1024,
@@ -29,3 +54,48 @@ AI_SERVICE_CONFIG = {
         ]
     }
 }
+
+# Text embeddings for the semantic chat cache and similar-patient search,
+# served through the region pool of "service"
+EMBEDDING_CONFIG = {
+    "service": "gemini",
+    "model_name": "text-embedding-005",
+    "dimensions": 256
+}
+
+# Model routing per task type. Candidates are tried in order ("preferred") or
+# by lowest observed p95 latency ("fastest"); models that are too small for the
+# prompt, have an open circuit breaker, or exceed max_error_rate or
+# max_p95_seconds are moved to the end. Overridable per task with the
+# AI_ROUTING_POLICIES setting.
+AI_ROUTING_POLICIES = {
+    "chat": {
+        "candidates": ["gemini"],
+        "strategy": "preferred",
+        "max_output_tokens": 1024
+    },
+    "soap": {
+        "candidates": ["medical_lm", "gemini"],
+        "strategy": "preferred",
+        "max_output_tokens": 2048,
+        "max_error_rate": 0.5
+    },
+    "dvx": {
+        "candidates": ["medical_lm", "gemini"],
+        "strategy": "preferred",
+        "max_output_tokens": 2048,
+        "max_error_rate": 0.5
+    },
+    "extraction": {
+        "candidates": ["gemini", "medical_lm"],
+        "strategy": "fastest",
+        "max_output_tokens": 256,
+        "max_error_rate": 0.2
+    },
+    "summary": {
+        "candidates": ["gemini", "medical_lm"],
+        "strategy": "fastest",
+        "max_output_tokens": 1024,
+        "max_error_rate": 0.2
+    }
+}
@@ -0,0 +1,119 @@
+import hashlib
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import numpy as np
+from flask import current_app
+from google.genai import types
+
+from .config import EMBEDDING_CONFIG
+from .regions import get_region_pool
+from .. import deadline
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length, so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Embedder(ABC):
+    """Base abstract class for embedders: maps texts to unit length float32 vectors of a fixed dimension."""
+
+    name = "base"
+    dimensions = 0
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Returns an array of shape (len(texts), dimensions)."""
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """
+    Offline, deterministic stand-in for a model embedder.
+
+    Word unigrams and bigrams are hashed into signed buckets, so texts that
+    share most of their words end up close. It needs no network or model and
+    gives the same vectors in every process, which makes it suitable for
+    development, tests and as a fallback.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def _features(self, text: str):
+        words = _TOKEN.findall(text.lower())
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return normalize(vectors)
+
+
+class VertexEmbedder(Embedder):
+    """Embeddings from a Vertex AI text embedding model, through the service's warm region pool."""
+
+    name = "vertex"
+
+    def __init__(self, dimensions: int, model_name: str, service_type: str, task_type: Optional[str] = None):
+        self.dimensions = dimensions
+        self.model_name = model_name
+        self.task_type = task_type
+        self.regions = get_region_pool(service_type)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        params = {"output_dimensionality": self.dimensions}
+        if self.task_type:
+            params["task_type"] = self.task_type
+        remaining = deadline.timeout(None)
+        if remaining is not None:
+            params["http_options"] = types.HttpOptions(timeout=max(int(remaining * 1000), 1))
+        with deadline.deadline_errors():
+            response = self.regions.call(
+                lambda client: client.models.embed_content(
+                    model=self.model_name,
+                    contents=texts,
+                    config=types.EmbedContentConfig(**params)
+                )
+            )
+        return normalize(np.array([embedding.values for embedding in response.embeddings], dtype=np.float32))
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(task_type: Optional[str] = None) -> Embedder:
+    """
+    The process-wide embedder selected by the EMBEDDING_BACKEND setting
+    ("vertex" or "hashing"), with EMBEDDING_DIMENSIONS dimensions.
+    """
+    backend = current_app.config.get("EMBEDDING_BACKEND", "hashing")
+    dimensions = current_app.config.get("EMBEDDING_DIMENSIONS", EMBEDDING_CONFIG["dimensions"])
+    key = (backend, dimensions, task_type)
+    with _embedders_lock:
+        embedder = _embedders.get(key)
+        if embedder is None:
+            if backend == "vertex":
+                embedder = VertexEmbedder(
+                    dimensions, EMBEDDING_CONFIG["model_name"], EMBEDDING_CONFIG["service"], task_type
+                )
+            elif backend == "hashing":
+                embedder = HashingEmbedder(dimensions)
+            else:
+                raise ValueError(f"Unknown embedding backend: {backend}")
+            embedder = _embedders[key] = embedder
+        return embedder
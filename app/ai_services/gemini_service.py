@@ -1,11 +1,13 @@
 import logging
 import json
 from typing import List, Dict, Any, Generator, Optional
-from google import genai
 from google.genai import types
 
 from .base import AIService
 from .config import AI_SERVICE_CONFIG
+from .regions import get_region_pool
+from .profiles import generate_config
+from .. import deadline
 
 class GeminiAIService(AIService):
     """Implementation of AIService for Google's Gemini models."""
@@ -13,11 +15,8 @@ class GeminiAIService(AIService):
     def __init__(self):
         """Initialize the Gemini AI service."""
         config = AI_SERVICE_CONFIG.get("gemini", {})
-        self.client = genai.Client(
-            vertexai=True,
-            project=config.get("project"),
-            location=config.get("location"),
-        )
+        # Clients are kept per region and shared across requests
+        self.regions = get_region_pool("gemini")
         self.model_name = config.get("model_name")
         self.config = config
         
@@ -40,57 +39,44 @@ class GeminiAIService(AIService):
     
     def _create_generate_config(self, system_instruction: Optional[str] = None,
                                response_mime_type: Optional[str] = None,
-                               response_schema: Optional[Dict[str, Any]] = None) -> types.GenerateContentConfig:
-        """Create a configuration object for content generation."""
-        safety_settings = [
-            types.SafetySetting(category=setting["category"], threshold=setting["threshold"])
-            for setting in self.config.get("safety_settings", [])
-        ]
-        
-        # Base configuration parameters
-        config_params = {
-            "temperature": self.config.get("temperature", 1.0),
-            "top_p": self.config.get("top_p", 0.95),
-            "max_output_tokens": self.config.get("max_output_tokens", 1024),
-            "response_modalities": ["TEXT"],
-            "safety_settings": safety_settings,
-        }
-        
-        # Add system instruction if provided
-        if system_instruction:
-            config_params["system_instruction"] = system_instruction
-        
-        # Add response_mime_type if provided
-        if response_mime_type:
-            config_params["response_mime_type"] = response_mime_type
-        else:
-            config_params["response_mime_type"] = "text/plain"
-        
-        # Add response_schema if provided - directly use the schema parameter
-        if response_schema:
-            config_params["response_schema"] = response_schema
-        
-        # Create and return the config object
-        return types.GenerateContentConfig(**config_params)
+                               response_schema: Optional[Dict[str, Any]] = None,
+                               max_output_tokens: Optional[int] = None,
+                               profile: Optional[str] = None) -> types.GenerateContentConfig:
+        """Create a configuration object for content generation, from a precompiled profile if given."""
+        return generate_config(
+            "gemini",
+            profile,
+            system_instruction,
+            response_mime_type,
+            response_schema,
+            max_output_tokens
+        )
     
     def generate_response(self, messages: List[Dict[str, Any]], 
                           system_instruction: Optional[str] = None,
                           response_mime_type: Optional[str] = None,
-                          response_schema: Optional[Dict[str, Any]] = None) -> str:
+                          response_schema: Optional[Dict[str, Any]] = None,
+                          max_output_tokens: Optional[int] = None,
+                          profile: Optional[str] = None) -> str:
         """Generate a complete response from the Gemini model."""
         try:
             contents = self._convert_messages_to_contents(messages)
             generate_config = self._create_generate_config(
                 system_instruction,
                 response_mime_type, 
-                response_schema
+                response_schema,
+                max_output_tokens,
+                profile
             )
             
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents,
-                config=generate_config
-            )
+            with deadline.deadline_errors():
+                response = self.regions.call(
+                    lambda client: client.models.generate_content(
+                        model=self.model_name,
+                        contents=contents,
+                        config=generate_config
+                    )
+                )
             
             return response.text
         except Exception as e:
@@ -100,25 +86,35 @@ class GeminiAIService(AIService):
     def generate_stream(self, messages: List[Dict[str, Any]], 
                         system_instruction: Optional[str] = None,
                         response_mime_type: Optional[str] = None,
-                        response_schema: Optional[Dict[str, Any]] = None) -> Generator[str, None, None]:
+                        response_schema: Optional[Dict[str, Any]] = None,
+                        max_output_tokens: Optional[int] = None,
+                        profile: Optional[str] = None) -> Generator[str, None, None]:
         """Stream the response from the Gemini model."""
         try:
             contents = self._convert_messages_to_contents(messages)
             generate_config = self._create_generate_config(
                 system_instruction,
                 response_mime_type, 
-                response_schema
+                response_schema,
+                max_output_tokens,
+                profile
             )
             
-            stream = self.client.models.generate_content_stream(
-                model=self.model_name,
-                contents=contents,
-                config=generate_config
+            stream = self.regions.stream(
+                lambda client: client.models.generate_content_stream(
+                    model=self.model_name,
+                    contents=contents,
+                    config=generate_config
+                )
             )
             
-            for chunk in stream:
-                if chunk.text:
-                    yield chunk.text
+            try:
+                with deadline.deadline_errors():
+                    for chunk in stream:
+                        if chunk.text:
+                            yield chunk.text
+            finally:
+                stream.close()
                     
         except Exception as e:
             logging.error(f"Error streaming response from Gemini: {str(e)}")
@@ -0,0 +1,253 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Generator, Optional
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from .base import AIService
+from .config import AI_SERVICE_CONFIG
+from .. import deadline
+from ..metrics import counter, gauge, histogram
+
+# Priority classes, most urgent first. Lower classes may only use part of each
+# model's capacity, so the rest stays available for interactive traffic.
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+BACKGROUND = "background"
+
+PRIORITY_RANKS = {INTERACTIVE: 0, STANDARD: 1, BACKGROUND: 2}
+PRIORITY_SHARES = {INTERACTIVE: 1.0, STANDARD: 0.8, BACKGROUND: 0.5}
+
+_priority = ContextVar("ai_priority", default=STANDARD)
+
+QUEUE_SECONDS = histogram(
+    "ai_admission_queue_seconds",
+    "Time model calls waited for admission by the rate limiter",
+    ("service", "priority")
+)
+ADMISSION_REJECTED = counter(
+    "ai_admission_rejected_total",
+    "Model calls that were not admitted before their queue timeout or deadline",
+    ("service", "priority")
+)
+IN_FLIGHT = gauge(
+    "ai_requests_in_flight",
+    "Model calls currently holding a concurrency slot",
+    ("service",),
+    multiprocess_mode="livesum"
+)
+
+
+class AdmissionRejected(ServiceUnavailable):
+    """Raised when a model call could not be admitted in time; rendered as a 503."""
+
+    description = "The AI service is busy, please try again shortly."
+
+
+@contextmanager
+def ai_priority(priority: str):
+    """Run model calls made in this block under the given priority class."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]], system_instruction: Optional[str]) -> int:
+    """Rough prompt size in tokens, at about four characters per token."""
+    chars = sum(len(message.get("content", "")) for message in messages) + len(system_instruction or "")
+    return chars // 4
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], system_instruction: Optional[str], max_output_tokens: int) -> int:
+    """Rough token cost of a call: the prompt plus the output allowance."""
+    return estimate_prompt_tokens(messages, system_instruction) + max_output_tokens
+
+
+class TokenBucket:
+    """Bucket refilled continuously at per_minute / 60 units per second, holding at most per_minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, share: float) -> float:
+        """Seconds until amount can be taken while keeping (1 - share) of capacity in reserve."""
+        reserve = self.capacity * (1 - share)
+        missing = amount + reserve - self.level
+        return max(missing / self.rate, 0.0) if self.rate else float("inf")
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class ModelLimiter:
+    """
+    Admission control for one model: a concurrency cap plus request and token
+    per-minute buckets. Waiting calls are admitted in priority order.
+    """
+
+    def __init__(self, service_type: str, max_concurrency: int = 0,
+                 requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.service_type = service_type
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _wait_time(self, priority: str, tokens: int, now: float) -> Optional[float]:
+        """Seconds until the call could be admitted, 0 if it can be now, None if it needs a free slot."""
+        share = PRIORITY_SHARES.get(priority, 1.0)
+        if self.max_concurrency and self.in_flight >= max(int(self.max_concurrency * share), 1):
+            return None
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(min(amount, bucket.capacity * share), share))
+        return wait
+
+    def acquire(self, priority: str, tokens: int, timeout: float):
+        """
+        Wait for a slot and budget for a call, for at most timeout seconds.
+
+        Raises:
+            AdmissionRejected: If the call was not admitted within timeout
+            DeadlineExceeded: If the request's deadline passed while waiting
+        """
+        started = time.monotonic()
+        give_up = started + timeout
+        deadline_at = deadline.deadline_at()
+        if deadline_at is not None:
+            give_up = min(give_up, deadline_at)
+
+        waiter = (PRIORITY_RANKS.get(priority, 1), next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(priority, tokens, now) if self._waiters[0] == waiter else None
+                    if wait == 0:
+                        break
+                    if now >= give_up:
+                        ADMISSION_REJECTED.inc(service=self.service_type, priority=priority)
+                        logging.warning(f"Rejected {priority} {self.service_type} call after {now - started:.2f}s in queue")
+                        if deadline.expired():
+                            raise deadline.DeadlineExceeded()
+                        raise AdmissionRejected()
+                    self._cond.wait(give_up - now if wait is None else min(wait, give_up - now))
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                # The next waiter in line may be admissible now
+                self._cond.notify_all()
+
+            share = PRIORITY_SHARES.get(priority, 1.0)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(min(tokens, self.tokens.capacity * share))
+            self.in_flight += 1
+
+        QUEUE_SECONDS.observe(time.monotonic() - started, service=self.service_type, priority=priority)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority: str, tokens: int, timeout: float):
+        self.acquire(priority, tokens, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service_type: str) -> ModelLimiter:
+    """The process-wide limiter for a service, built from its AI_SERVICE_CONFIG limits."""
+    with _limiters_lock:
+        limiter = _limiters.get(service_type)
+        if limiter is None:
+            config = AI_SERVICE_CONFIG.get(service_type, {})
+            limiter = _limiters[service_type] = ModelLimiter(
+                service_type,
+                max_concurrency=config.get("max_concurrency", 0),
+                requests_per_minute=config.get("requests_per_minute", 0),
+                tokens_per_minute=config.get("tokens_per_minute", 0)
+            )
+        return limiter
+
+
+def _in_flight():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [({"service": limiter.service_type}, limiter.in_flight) for limiter in limiters]
+
+
+IN_FLIGHT.set_function(_in_flight)
+
+
+class RateLimitedAIService(AIService):
+    """AIService wrapper that admits each call through the service's ModelLimiter."""
+
+    def __init__(self, service_type: str, service: AIService, timeout: float):
+        self.service_type = service_type
+        self.service = service
+        self.limiter = get_limiter(service_type)
+        self.timeout = timeout
+        self.max_output_tokens = AI_SERVICE_CONFIG.get(service_type, {}).get("max_output_tokens", 1024)
+
+    def generate_response(self, messages: List[Dict[str, Any]],
+                          system_instruction: Optional[str] = None,
+                          response_mime_type: Optional[str] = None,
+                          response_schema: Optional[Dict[str, Any]] = None,
+                          max_output_tokens: Optional[int] = None,
+                          profile: Optional[str] = None) -> str:
+        tokens = estimate_tokens(messages, system_instruction, max_output_tokens or self.max_output_tokens)
+        with self.limiter.admit(current_priority(), tokens, self.timeout):
+            return self.service.generate_response(
+                messages, system_instruction, response_mime_type, response_schema, max_output_tokens, profile
+            )
+
+    def generate_stream(self, messages: List[Dict[str, Any]],
+                        system_instruction: Optional[str] = None,
+                        response_mime_type: Optional[str] = None,
+                        response_schema: Optional[Dict[str, Any]] = None,
+                        max_output_tokens: Optional[int] = None,
+                        profile: Optional[str] = None) -> Generator[str, None, None]:
+        tokens = estimate_tokens(messages, system_instruction, max_output_tokens or self.max_output_tokens)
+        # The concurrency slot is held until the stream is exhausted or closed
+        with self.limiter.admit(current_priority(), tokens, self.timeout):
+            stream = self.service.generate_stream(
+                messages, system_instruction, response_mime_type, response_schema, max_output_tokens, profile
+            )
+            try:
+                yield from stream
+            finally:
+                stream.close()
@@ -1,12 +1,14 @@
 import logging
 import json
 from typing import List, Dict, Any, Generator, Optional
-from google import genai
 from google.genai import types
 from flask import current_app
 
 from .base import AIService
 from .config import AI_SERVICE_CONFIG
+from .regions import get_region_pool
+from .profiles import generate_config, get_profile
+from .. import deadline
 from ..utils.mock_data import get_mock_medical_response, get_mock_structured_response
 
 class MedicalLMService(AIService):
@@ -20,11 +22,8 @@ class MedicalLMService(AIService):
         self.use_mock = current_app.config.get("FLASK_ENV") == "development" and current_app.config.get("USE_MOCK_AI", True)
         
         if not self.use_mock:
-            self.client = genai.Client(
-                vertexai=True,
-                project=config.get("project"),
-                location=config.get("location"),
-            )
+            # Clients are kept per region and shared across requests
+            self.regions = get_region_pool("medical_lm")
         else:
             logging.info("Using mock AI responses for Medical LM service")
             
@@ -50,46 +49,31 @@ class MedicalLMService(AIService):
     
     def _create_generate_config(self, system_instruction: Optional[str] = None,
                                response_mime_type: Optional[str] = None,
-                               response_schema: Optional[Dict[str, Any]] = None) -> types.GenerateContentConfig:
-        """Create a configuration object for content generation."""
-        safety_settings = [
-            types.SafetySetting(category=setting["category"], threshold=setting["threshold"])
-            for setting in self.config.get("safety_settings", [])
-        ]
-        
-        # Base configuration parameters
-        config_params = {
-            "temperature": self.config.get("temperature", 0.2),  # Lower temperature for medical precision
-            "top_p": self.config.get("top_p", 0.95),
-            "max_output_tokens": self.config.get("max_output_tokens", 1024),
-            "response_modalities": ["TEXT"],
-            "safety_settings": safety_settings,
-        }
-        
-        # Add system instruction if provided
-        if system_instruction:
-            config_params["system_instruction"] = system_instruction
-        
-        # Add response_mime_type if provided
-        if response_mime_type:
-            config_params["response_mime_type"] = response_mime_type
-        else:
-            config_params["response_mime_type"] = "text/plain"
-
-        # Add response_schema if provided
-        if response_schema:
-            config_params["response_schema"] = response_schema
-        
-        return types.GenerateContentConfig(**config_params)
+                               response_schema: Optional[Dict[str, Any]] = None,
+                               max_output_tokens: Optional[int] = None,
+                               profile: Optional[str] = None) -> types.GenerateContentConfig:
+        """Create a configuration object for content generation, from a precompiled profile if given."""
+        return generate_config(
+            "medical_lm",
+            profile,
+            system_instruction,
+            response_mime_type,
+            response_schema,
+            max_output_tokens
+        )
     
     def generate_response(self, messages: List[Dict[str, Any]], 
                           system_instruction: Optional[str] = None,
                           response_mime_type: Optional[str] = None,
-                          response_schema: Optional[Dict[str, Any]] = None) -> str:
+                          response_schema: Optional[Dict[str, Any]] = None,
+                          max_output_tokens: Optional[int] = None,
+                          profile: Optional[str] = None) -> str:
         """Generate a complete response from the Medical LM model."""
         try:
             # If using mock responses in local/development environment
             if self.use_mock:
+                if profile:
+                    response_schema = get_profile(profile).response_schema
                 # Check if we have a schema (structured response requested)
                 if response_schema:
                     return get_mock_structured_response(response_schema)
@@ -112,14 +96,19 @@ class MedicalLMService(AIService):
             generate_config = self._create_generate_config(
                 system_instruction,
                 response_mime_type, 
-                response_schema
+                response_schema,
+                max_output_tokens,
+                profile
             )
             
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents,
-                config=generate_config
-            )
+            with deadline.deadline_errors():
+                response = self.regions.call(
+                    lambda client: client.models.generate_content(
+                        model=self.model_name,
+                        contents=contents,
+                        config=generate_config
+                    )
+                )
             
             return response.text
         except Exception as e:
@@ -129,11 +118,15 @@ class MedicalLMService(AIService):
     def generate_stream(self, messages: List[Dict[str, Any]], 
                         system_instruction: Optional[str] = None,
                         response_mime_type: Optional[str] = None,
-                        response_schema: Optional[Dict[str, Any]] = None) -> Generator[str, None, None]:
+                        response_schema: Optional[Dict[str, Any]] = None,
+                        max_output_tokens: Optional[int] = None,
+                        profile: Optional[str] = None) -> Generator[str, None, None]:
         """Stream the response from the Medical LM model."""
         try:
             # If using mock responses in local/development environment
             if self.use_mock:
+                if profile:
+                    response_schema = get_profile(profile).response_schema
                 # Get full mock response
                 message_content = "\n".join([msg.get("content", "") for msg in messages])
                 is_soap_request = "soap" in message_content.lower() or (system_instruction and "soap" in system_instruction.lower())
@@ -155,18 +148,26 @@ class MedicalLMService(AIService):
             generate_config = self._create_generate_config(
                 system_instruction,
                 response_mime_type, 
-                response_schema
+                response_schema,
+                max_output_tokens,
+                profile
             )
             
-            stream = self.client.models.generate_content_stream(
-                model=self.model_name,
-                contents=contents,
-                config=generate_config
+            stream = self.regions.stream(
+                lambda client: client.models.generate_content_stream(
+                    model=self.model_name,
+                    contents=contents,
+                    config=generate_config
+                )
             )
             
-            for chunk in stream:
-                if chunk.text:
-                    yield chunk.text
+            try:
+                with deadline.deadline_errors():
+                    for chunk in stream:
+                        if chunk.text:
+                            yield chunk.text
+            finally:
+                stream.close()
                     
         except Exception as e:
             logging.error(f"Error streaming response from Medical LM: {str(e)}")
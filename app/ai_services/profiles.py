@@ -0,0 +1,144 @@
+import threading
+from typing import Any, Dict, Optional
+
+from google.genai import types
+
+from .config import AI_SERVICE_CONFIG
+from .schemas import SOAP_SCHEMA, DVX_SCHEMA, METADATA_SCHEMA, model_schema
+from .. import deadline
+from ..metrics import counter
+
+GENERATIONS = counter(
+    "ai_generations_total",
+    "Generation configs handed to the models, by service and profile tag",
+    ("service", "profile")
+)
+
+AD_HOC = "ad-hoc"
+
+
+class GenerationProfile:
+    """
+    A named output format: MIME type, optional response schema and sampling overrides.
+
+    The version is part of the profile's tag, so bump it whenever the schema
+    or sampling changes and cached results keyed by the tag stop matching.
+    """
+
+    def __init__(self, name: str, version: int, response_mime_type: str = "text/plain",
+                 response_schema: Optional[Dict[str, Any]] = None, temperature: Optional[float] = None,
+                 top_p: Optional[float] = None, max_output_tokens: Optional[int] = None):
+        self.name = name
+        self.version = version
+        self.response_mime_type = response_mime_type
+        self.response_schema = response_schema
+        self.temperature = temperature
+        self.top_p = top_p
+        self.max_output_tokens = max_output_tokens
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+
+_profiles = {}
+_compiled = {}
+_lock = threading.Lock()
+
+
+def register_profile(profile: GenerationProfile):
+    with _lock:
+        _profiles[profile.name] = profile
+        for key in [key for key in _compiled if key[1] == profile.name]:
+            del _compiled[key]
+
+
+def get_profile(name: str) -> GenerationProfile:
+    with _lock:
+        profile = _profiles.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown generation profile: {name}")
+    return profile
+
+
+def build_config(service_type: str, profile: GenerationProfile) -> types.GenerateContentConfig:
+    """Build the GenerateContentConfig for a profile on a service, from the service's AI_SERVICE_CONFIG."""
+    config = AI_SERVICE_CONFIG.get(service_type, {})
+    params = {
+        "temperature": profile.temperature if profile.temperature is not None else config.get("temperature"),
+        "top_p": profile.top_p if profile.top_p is not None else config.get("top_p", 0.95),
+        "max_output_tokens": profile.max_output_tokens or config.get("max_output_tokens", 1024),
+        "response_modalities": ["TEXT"],
+        "safety_settings": [
+            types.SafetySetting(category=setting["category"], threshold=setting["threshold"])
+            for setting in config.get("safety_settings", [])
+        ],
+        "response_mime_type": profile.response_mime_type or "text/plain",
+    }
+    if profile.response_schema:
+        params["response_schema"] = model_schema(profile.response_schema)
+    return types.GenerateContentConfig(**params)
+
+
+def compiled_config(service_type: str, profile: GenerationProfile) -> types.GenerateContentConfig:
+    """The registered profile's config for a service, built on first use and then shared."""
+    key = (service_type, profile.name)
+    with _lock:
+        config = _compiled.get(key)
+    if config is None:
+        config = build_config(service_type, profile)
+        with _lock:
+            config = _compiled.setdefault(key, config)
+    return config
+
+
+def compile_profiles():
+    """Build every registered profile for every service, so requests never build one."""
+    with _lock:
+        profiles = list(_profiles.values())
+    for service_type in AI_SERVICE_CONFIG:
+        for profile in profiles:
+            compiled_config(service_type, profile)
+
+
+def generate_config(service_type: str, profile: Optional[str] = None,
+                    system_instruction: Optional[str] = None,
+                    response_mime_type: Optional[str] = None,
+                    response_schema: Optional[Dict[str, Any]] = None,
+                    max_output_tokens: Optional[int] = None) -> types.GenerateContentConfig:
+    """
+    The GenerateContentConfig for one call.
+
+    With a profile name the precompiled config is copied with only the
+    per-call settings changed; otherwise an ad hoc config is built from
+    response_mime_type and response_schema.
+    """
+    if profile:
+        generation_profile = get_profile(profile)
+        base = compiled_config(service_type, generation_profile)
+        tag = generation_profile.tag
+    else:
+        base = build_config(service_type, GenerationProfile(AD_HOC, 0, response_mime_type, response_schema))
+        tag = AD_HOC
+    GENERATIONS.inc(service=service_type, profile=tag)
+
+    updates = {}
+    if system_instruction:
+        updates["system_instruction"] = system_instruction
+    if max_output_tokens:
+        updates["max_output_tokens"] = max_output_tokens
+    # Bound the call by the remaining request budget
+    remaining = deadline.timeout(None)
+    if remaining is not None:
+        updates["http_options"] = types.HttpOptions(timeout=max(int(remaining * 1000), 1))
+    return base.model_copy(update=updates) if updates else base
+
+
+for _profile in (
+    GenerationProfile("chat", 1),
+    GenerationProfile("soap", 1, "application/json", SOAP_SCHEMA),
+    GenerationProfile("dvx", 1, "application/json", DVX_SCHEMA),
+    GenerationProfile("patient_metadata", 1, "application/json", METADATA_SCHEMA),
+    GenerationProfile("summary", 1, temperature=0.2, max_output_tokens=1024),
+):
+    register_profile(_profile)
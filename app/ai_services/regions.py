@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types
+from google.oauth2.credentials import Credentials
+
+from .config import AI_SERVICE_CONFIG
+from .resilience import is_retryable
+from .. import deadline
+from ..metrics import counter, gauge
+
+REGION_REQUESTS = counter(
+    "ai_region_requests_total",
+    "Model calls per Vertex AI region",
+    ("service", "location", "outcome")
+)
+REGION_LATENCY = gauge(
+    "ai_region_latency_ewma_seconds",
+    "Exponentially weighted moving average of model call latency per region",
+    ("service", "location")
+)
+REGION_ERROR_RATE = gauge(
+    "ai_region_error_rate_ewma",
+    "Exponentially weighted moving average of the failure rate per region",
+    ("service", "location")
+)
+
+
+class RegionStats:
+    """EWMA latency and error rate of one region, plus a quota cooldown after a 429."""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.quota_exhausted_until = 0.0
+
+    def observe(self, seconds: Optional[float]):
+        if seconds is not None:
+            self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+        self.error_rate *= 1 - self.alpha
+
+    def observe_failure(self, quota_cooldown: float = 0.0):
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        if quota_cooldown:
+            self.quota_exhausted_until = time.monotonic() + quota_cooldown
+
+    def score(self, error_penalty: float) -> float:
+        """Expected cost in seconds: latency plus a penalty proportional to the error rate."""
+        return (self.latency or 0.0) + self.error_rate * error_penalty
+
+
+class RegionPool:
+    """
+    Warm genai clients for one model across its Vertex AI locations.
+
+    Calls go to the region with the lowest EWMA latency plus error penalty.
+    Regions that returned 429 are skipped for quota_cooldown_seconds, and a
+    call that fails with a retryable error moves on to the next region, up
+    to region_failover_attempts regions per call. Regions without history
+    keep their configured order, so the first location is the default.
+
+    Streams fail over the same way until their first chunk arrives; after
+    that output has been sent and a failure is only reported to the pool.
+    """
+
+    def __init__(self, service_type: str, config: Dict[str, Any]):
+        self.service_type = service_type
+        self.project = config.get("project")
+        self.locations = config.get("locations") or [config.get("location")]
+        self.base_url = config.get("base_url")
+        self.access_token = config.get("access_token")
+        self.error_penalty = config.get("region_error_penalty_seconds", 10.0)
+        self.quota_cooldown = config.get("quota_cooldown_seconds", 60.0)
+        self.max_attempts = config.get("region_failover_attempts", 2)
+        alpha = config.get("region_ewma_alpha", 0.2)
+        self.stats = {location: RegionStats(alpha) for location in self.locations}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, location: str) -> genai.Client:
+        with self._lock:
+            client = self._clients.get(location)
+            if client is None:
+                options = {}
+                if self.base_url:
+                    # A regional endpoint override, e.g. a local stand-in for tests
+                    options["http_options"] = types.HttpOptions(base_url=self.base_url)
+                if self.access_token:
+                    options["credentials"] = Credentials(token=self.access_token)
+                client = self._clients[location] = genai.Client(
+                    vertexai=True,
+                    project=self.project,
+                    location=location,
+                    **options
+                )
+            return client
+
+    def ranked(self) -> List[str]:
+        """Locations best first; regions in quota cooldown go last, soonest available first."""
+        now = time.monotonic()
+        with self._lock:
+            available = [location for location in self.locations if self.stats[location].quota_exhausted_until <= now]
+            cooling = [location for location in self.locations if location not in available]
+            available.sort(key=lambda location: self.stats[location].score(self.error_penalty))
+            cooling.sort(key=lambda location: self.stats[location].quota_exhausted_until)
+        return available + cooling
+
+    def best(self) -> str:
+        return self.ranked()[0]
+
+    def observe(self, location: str, seconds: Optional[float]):
+        with self._lock:
+            self.stats[location].observe(seconds)
+        REGION_REQUESTS.inc(service=self.service_type, location=location, outcome="success")
+
+    def observe_failure(self, location: str, error: Exception):
+        quota = isinstance(error, genai_errors.APIError) and error.code == 429
+        with self._lock:
+            self.stats[location].observe_failure(self.quota_cooldown if quota else 0.0)
+        REGION_REQUESTS.inc(service=self.service_type, location=location, outcome="quota" if quota else "error")
+
+    def call(self, fn: Callable[[genai.Client], Any]) -> Any:
+        """Run fn(client) against the best region, failing over to the next on retryable errors."""
+        return self._call(fn)[1]
+
+    def stream(self, fn: Callable[[genai.Client], Iterable]) -> Generator[Any, None, None]:
+        """
+        Iterate over fn(client), e.g. a generate_content_stream, from the best
+        region, failing over to the next one if the stream fails before its
+        first chunk.
+        """
+        def open_stream(client):
+            stream = iter(fn(client))
+            try:
+                return stream, [next(stream)]
+            except StopIteration:
+                return stream, []
+            except Exception:
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+                raise
+
+        # Time to first chunk is not comparable with full response latency
+        location, (stream, head) = self._call(open_stream, track_latency=False)
+        try:
+            yield from head
+            yield from stream
+        except Exception as e:
+            if is_retryable(e):
+                self.observe_failure(location, e)
+            raise
+        finally:
+            # Release the upstream HTTP stream if the consumer stops early
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+
+    def _call(self, fn: Callable[[genai.Client], Any], track_latency: bool = True) -> Tuple[str, Any]:
+        ranked = self.ranked()[:max(self.max_attempts, 1)]
+        for position, location in enumerate(ranked):
+            started = time.monotonic()
+            try:
+                result = fn(self.client(location))
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.observe_failure(location, e)
+                if position + 1 == len(ranked) or deadline.expired():
+                    raise
+                logging.warning(f"{self.service_type} call failed in {location}, failing over to {ranked[position + 1]}: {str(e)}")
+                continue
+            self.observe(location, time.monotonic() - started if track_latency else None)
+            return location, result
+
+    def samples(self, attribute: str):
+        with self._lock:
+            return [
+                ({"service": self.service_type, "location": location}, getattr(stats, attribute))
+                for location, stats in self.stats.items()
+                if getattr(stats, attribute) is not None
+            ]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_region_pool(service_type: str) -> RegionPool:
+    """The process-wide region pool for a service, so clients stay warm across requests."""
+    with _pools_lock:
+        pool = _pools.get(service_type)
+        if pool is None:
+            pool = _pools[service_type] = RegionPool(service_type, AI_SERVICE_CONFIG.get(service_type, {}))
+        return pool
+
+
+def _pool_samples(attribute):
+    def samples():
+        with _pools_lock:
+            pools = list(_pools.values())
+        return [sample for pool in pools for sample in pool.samples(attribute)]
+    return samples
+
+
+REGION_LATENCY.set_function(_pool_samples("latency"))
+REGION_ERROR_RATE.set_function(_pool_samples("error_rate"))
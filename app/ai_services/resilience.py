@@ -0,0 +1,306 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Generator, Optional, Callable
+
+import httpx
+from flask import current_app, copy_current_request_context, g, has_request_context
+from google.genai import errors as genai_errors
+
+from .base import AIService
+from .limiter import AdmissionRejected
+from .. import deadline
+from ..circuit_breaker import get_breaker, CircuitOpenError
+from ..metrics import counter, histogram
+
+AI_ATTEMPTS = counter(
+    "ai_attempts_total",
+    "Model calls made by the AI service layer, including retries, hedges and fallbacks",
+    ("service", "kind", "outcome")
+)
+AI_ATTEMPT_SECONDS = histogram(
+    "ai_attempt_duration_seconds",
+    "Duration of individual model calls",
+    ("service", "outcome")
+)
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Hedged requests run here; a losing attempt is left to finish in the background
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ai-hedge")
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed model call is worth repeating: quota, overload and transport errors."""
+    if isinstance(error, (deadline.DeadlineExceeded, AdmissionRejected, CircuitOpenError)):
+        return False
+    if isinstance(error, genai_errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def is_model_failure(error: Exception) -> bool:
+    """Errors that count against a model's circuit breaker: overload, outages and timeouts."""
+    if isinstance(error, deadline.DeadlineExceeded):
+        # The request's own budget ran out; only a failure of the call itself counts
+        return error.__cause__ is not None and is_model_failure(error.__cause__)
+    return is_retryable(error)
+
+
+def is_unavailable(error: Exception) -> bool:
+    """Whether a call failed because no model could serve it, rather than because of the request."""
+    return is_retryable(error) or isinstance(error, (AdmissionRejected, CircuitOpenError))
+
+
+class ServiceStats:
+    """Rolling windows of successful call latencies and of call outcomes for one service."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._outcomes.append(True)
+
+    def observe_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+
+    def error_rate(self, min_samples: int = 10) -> Optional[float]:
+        """Share of recent calls that failed, or None until there are enough calls."""
+        with self._lock:
+            outcomes = list(self._outcomes)
+        if len(outcomes) < min_samples:
+            return None
+        return outcomes.count(False) / len(outcomes)
+
+    def quantile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        """The q-quantile of recent latencies, or None until there are enough samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def service_stats(service_type: str) -> ServiceStats:
+    with _stats_lock:
+        stats = _stats.get(service_type)
+        if stats is None:
+            stats = _stats[service_type] = ServiceStats()
+        return stats
+
+
+class ResilientAIService(AIService):
+    """
+    AIService wrapper adding retries, hedged requests and cross-model fallback.
+
+    Retryable errors (429, 5xx, transport failures) are retried with jittered
+    exponential backoff within the request deadline. A non-streaming call that
+    takes longer than the service's recent p95 latency can be hedged with a
+    second identical call, and the first result wins. When the primary service
+    keeps failing, or its circuit breaker is open, the call moves to the
+    fallback services, by default the one from AI_FALLBACKS.
+    Streams are only retried or moved before their first chunk is produced.
+    """
+
+    def __init__(self, service_type: str, factory: Callable[[str], AIService],
+                 fallbacks: Optional[List[str]] = None):
+        config = current_app.config
+        self.service_type = service_type
+        self.factory = factory
+        self.max_attempts = max(int(config.get("AI_RETRY_MAX_ATTEMPTS", 3)), 1)
+        self.base_delay = config.get("AI_RETRY_BASE_DELAY", 0.5)
+        self.max_delay = config.get("AI_RETRY_MAX_DELAY", 8.0)
+        self.hedge_enabled = config.get("AI_HEDGE_ENABLED", False)
+        self.hedge_quantile = config.get("AI_HEDGE_QUANTILE", 0.95)
+        self.hedge_min_delay = config.get("AI_HEDGE_MIN_DELAY", 1.0)
+        if fallbacks is None:
+            fallback_type = config.get("AI_FALLBACKS", {}).get(service_type)
+            fallbacks = [fallback_type] if fallback_type else []
+        self.fallbacks = fallbacks
+        self._services = {}
+
+    def service(self, service_type: str) -> AIService:
+        if service_type not in self._services:
+            self._services[service_type] = self.factory(service_type)
+        return self._services[service_type]
+
+    def chain(self) -> List[str]:
+        chain = [self.service_type]
+        for fallback_type in self.fallbacks:
+            if fallback_type not in chain:
+                chain.append(fallback_type)
+        return chain
+
+    def backoff(self, attempt: int) -> Optional[float]:
+        """
+        Full-jitter delay before retry number `attempt`, or None if it would not fit in the deadline.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        left = deadline.remaining()
+        if left is not None and left <= delay:
+            return None
+        return delay
+
+    def call(self, service_type: str, kind: str, fn: Callable[[], Any], track_latency: bool = True) -> Any:
+        """Run one attempt against a service, recording its outcome and duration."""
+        started = time.monotonic()
+        try:
+            with get_breaker(f"ai:{service_type}").guard(is_model_failure):
+                result = fn()
+        except CircuitOpenError:
+            AI_ATTEMPTS.inc(service=service_type, kind=kind, outcome="circuit_open")
+            raise
+        except Exception as e:
+            outcome = "retryable_error" if is_retryable(e) else "error"
+            if is_model_failure(e):
+                service_stats(service_type).observe_failure()
+            AI_ATTEMPTS.inc(service=service_type, kind=kind, outcome=outcome)
+            AI_ATTEMPT_SECONDS.observe(time.monotonic() - started, service=service_type, outcome=outcome)
+            raise
+        elapsed = time.monotonic() - started
+        AI_ATTEMPTS.inc(service=service_type, kind=kind, outcome="success")
+        AI_ATTEMPT_SECONDS.observe(elapsed, service=service_type, outcome="success")
+        if track_latency:
+            service_stats(service_type).observe(elapsed)
+        return result
+
+    def hedge_delay(self, service_type: str) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        p95 = service_stats(service_type).quantile(self.hedge_quantile)
+        if p95 is None:
+            return None
+        return max(p95, self.hedge_min_delay)
+
+    def call_hedged(self, service_type: str, kind: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run an attempt, sending a second identical one if the first is slower than usual.
+
+        Returns the first successful result; raises only if every attempt sent fails.
+
+        Raises:
+            DeadlineExceeded: If the request's budget runs out before any attempt succeeds
+        """
+        delay = self.hedge_delay(service_type)
+        if delay is None:
+            return self.call(service_type, kind, fn)
+
+        # copy_current_request_context pushes a fresh app context in the worker,
+        # so g (the request deadline, replica routing) is carried over explicitly
+        request_globals = dict(vars(g)) if has_request_context() else {}
+
+        def attempt(attempt_kind):
+            def run():
+                vars(g).update(request_globals)
+                return self.call(service_type, attempt_kind, fn)
+            if has_request_context():
+                run = copy_current_request_context(run)
+            # Carry context variables such as the limiter priority into the worker
+            return _hedge_executor.submit(contextvars.copy_context().run, run)
+
+        pending = {attempt(kind)}
+        done, pending = wait(pending, timeout=deadline.timeout(delay))
+        if not done:
+            if deadline.expired():
+                raise deadline.DeadlineExceeded()
+            logging.info(f"Hedging {service_type} call after {delay:.2f}s")
+            pending.add(attempt("hedge"))
+
+        error = None
+        while pending or done:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=deadline.timeout(None), return_when=FIRST_COMPLETED)
+            if not done:
+                # The attempts still running are left to finish in the background
+                raise deadline.DeadlineExceeded()
+        raise error
+
+    def run(self, fn: Callable[[AIService], Any], hedge: bool) -> Any:
+        """Call fn(service) through the retry, hedging and fallback policy."""
+        last_error = None
+        for position, service_type in enumerate(self.chain()):
+            service = self.service(service_type)
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    kind = "retry"
+                else:
+                    kind = "fallback" if position else "primary"
+                try:
+                    if hedge:
+                        return self.call_hedged(service_type, kind, lambda: fn(service))
+                    # Time to first chunk is not comparable with full response latency
+                    return self.call(service_type, kind, lambda: fn(service), track_latency=False)
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable(e):
+                        break
+                    if attempt + 1 < self.max_attempts:
+                        delay = self.backoff(attempt)
+                        if delay is None:
+                            break
+                        logging.warning(f"Retrying {service_type} in {delay:.2f}s after: {str(e)}")
+                        time.sleep(delay)
+            if isinstance(last_error, deadline.DeadlineExceeded) or deadline.expired():
+                break
+            if position + 1 < len(self.chain()):
+                logging.warning(f"Falling back from {service_type} after: {str(last_error)}")
+        raise last_error
+
+    def generate_response(self, messages: List[Dict[str, Any]],
+                          system_instruction: Optional[str] = None,
+                          response_mime_type: Optional[str] = None,
+                          response_schema: Optional[Dict[str, Any]] = None,
+                          max_output_tokens: Optional[int] = None,
+                          profile: Optional[str] = None) -> str:
+        return self.run(
+            lambda service: service.generate_response(
+                messages, system_instruction, response_mime_type, response_schema, max_output_tokens, profile
+            ),
+            hedge=True
+        )
+
+    def generate_stream(self, messages: List[Dict[str, Any]],
+                        system_instruction: Optional[str] = None,
+                        response_mime_type: Optional[str] = None,
+                        response_schema: Optional[Dict[str, Any]] = None,
+                        max_output_tokens: Optional[int] = None,
+                        profile: Optional[str] = None) -> Generator[str, None, None]:
+        def open_stream(service):
+            # Pull the first chunk so that failures before any output can be retried
+            stream = service.generate_stream(
+                messages, system_instruction, response_mime_type, response_schema, max_output_tokens, profile
+            )
+            try:
+                first = next(stream)
+            except StopIteration:
+                return stream, None
+            except Exception:
+                stream.close()
+                raise
+            return stream, first
+
+        stream, first = self.run(open_stream, hedge=False)
+        try:
+            if first is not None:
+                yield first
+            yield from stream
+        finally:
+            stream.close()
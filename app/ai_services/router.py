@@ -0,0 +1,112 @@
+import logging
+from typing import List, Dict, Any, Generator, Optional, Callable, Tuple
+
+from flask import current_app
+
+from .base import AIService
+from .config import AI_SERVICE_CONFIG, AI_ROUTING_POLICIES
+from .limiter import estimate_prompt_tokens
+from .resilience import ResilientAIService, service_stats
+from ..circuit_breaker import get_breaker
+from ..metrics import counter
+
+ROUTED_REQUESTS = counter(
+    "ai_routed_requests_total",
+    "Model calls by task type and the model the router picked first",
+    ("task", "service")
+)
+
+PREFERRED = "preferred"
+FASTEST = "fastest"
+
+
+def routing_policies() -> Dict[str, Dict[str, Any]]:
+    """AI_ROUTING_POLICIES with the per-task overrides from the app config applied."""
+    policies = {task: dict(policy) for task, policy in AI_ROUTING_POLICIES.items()}
+    for task, override in current_app.config.get("AI_ROUTING_POLICIES", {}).items():
+        policies.setdefault(task, {}).update(override)
+    return policies
+
+
+def is_healthy(service_type: str, policy: Dict[str, Any]) -> bool:
+    """Whether a model's recent behaviour is within the policy's error rate and latency limits."""
+    if get_breaker(f"ai:{service_type}").is_open():
+        return False
+    stats = service_stats(service_type)
+    max_error_rate = policy.get("max_error_rate")
+    error_rate = stats.error_rate()
+    if max_error_rate is not None and error_rate is not None and error_rate > max_error_rate:
+        return False
+    max_p95 = policy.get("max_p95_seconds")
+    p95 = stats.quantile(0.95)
+    if max_p95 is not None and p95 is not None and p95 > max_p95:
+        return False
+    return True
+
+
+def rank_candidates(policy: Dict[str, Any], prompt_tokens: int) -> List[str]:
+    """
+    Order a policy's candidate models for a call, best first.
+
+    Models whose context is too small for the prompt are dropped (unless none
+    fits) and unhealthy models are moved behind the healthy ones. With the
+    "fastest" strategy healthy models are ordered by p95 latency; models with
+    no latency history yet sort first so that they get measured.
+    """
+    candidates = list(policy.get("candidates", []))
+    fitting = [
+        service_type for service_type in candidates
+        if prompt_tokens <= AI_SERVICE_CONFIG.get(service_type, {}).get("max_input_tokens", float("inf"))
+    ]
+    candidates = fitting or candidates
+
+    healthy = [service_type for service_type in candidates if is_healthy(service_type, policy)]
+    if policy.get("strategy", PREFERRED) == FASTEST:
+        healthy.sort(key=lambda service_type: service_stats(service_type).quantile(0.95) or 0.0)
+    return healthy + [service_type for service_type in candidates if service_type not in healthy]
+
+
+class RoutedAIService(AIService):
+    """
+    AIService that picks the model and max_output_tokens per call from the task's routing policy.
+
+    The call goes to the best ranked model, with the other candidates as its
+    fallbacks, through ResilientAIService.
+    """
+
+    def __init__(self, task: str, policy: Dict[str, Any], factory: Callable[[str], AIService]):
+        self.task = task
+        self.policy = policy
+        self.factory = factory
+
+    def route(self, messages: List[Dict[str, Any]], system_instruction: Optional[str],
+              max_output_tokens: Optional[int]) -> Tuple[AIService, Optional[int]]:
+        ranked = rank_candidates(self.policy, estimate_prompt_tokens(messages, system_instruction))
+        if not ranked:
+            raise ValueError(f"No models configured for task {self.task}")
+        ROUTED_REQUESTS.inc(task=self.task, service=ranked[0])
+        logging.info(f"Routing {self.task} call to {ranked[0]} (candidates: {ranked})")
+        service = ResilientAIService(ranked[0], self.factory, fallbacks=ranked[1:])
+        return service, max_output_tokens or self.policy.get("max_output_tokens")
+
+    def generate_response(self, messages: List[Dict[str, Any]],
+                          system_instruction: Optional[str] = None,
+                          response_mime_type: Optional[str] = None,
+                          response_schema: Optional[Dict[str, Any]] = None,
+                          max_output_tokens: Optional[int] = None,
+                          profile: Optional[str] = None) -> str:
+        service, max_output_tokens = self.route(messages, system_instruction, max_output_tokens)
+        return service.generate_response(
+            messages, system_instruction, response_mime_type, response_schema, max_output_tokens, profile
+        )
+
+    def generate_stream(self, messages: List[Dict[str, Any]],
+                        system_instruction: Optional[str] = None,
+                        response_mime_type: Optional[str] = None,
+                        response_schema: Optional[Dict[str, Any]] = None,
+                        max_output_tokens: Optional[int] = None,
+                        profile: Optional[str] = None) -> Generator[str, None, None]:
+        service, max_output_tokens = self.route(messages, system_instruction, max_output_tokens)
+        yield from service.generate_stream(
+            messages, system_instruction, response_mime_type, response_schema, max_output_tokens, profile
+        )
@@ -0,0 +1,103 @@
+# Structured output schemas used by the generation profiles
+
+# Schema keys used only to validate model output locally (see
+# structured_output.compile_schema); they are not sent to the models.
+# units: suffixes accepted after a number, e.g. "18 years" for an age
+LOCAL_SCHEMA_KEYS = ("units",)
+
+
+def model_schema(schema):
+    """A schema without the keys only local validation uses, as sent to the models."""
+    if isinstance(schema, dict):
+        return {key: model_schema(value) for key, value in schema.items() if key not in LOCAL_SCHEMA_KEYS}
+    if isinstance(schema, list):
+        return [model_schema(value) for value in schema]
+    return schema
+
+
+# SOAP notes: Subjective, Objective, Assessment and Plan
+SOAP_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "subjective": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"}
+        },
+        "objective": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"}
+        },
+        "assessment": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"}
+        },
+        "plan": {
+            "type": "ARRAY",
+            "items": {"type": "STRING"}
+        }
+    },
+    "required": ["subjective", "objective", "assessment", "plan"]
+}
+
+# Differential diagnosis: possible conditions with risk, confidence and next steps
+DVX_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "required": [
+            "condition",
+            "risk",
+            "confidence",
+            "steps"
+        ],
+        "properties": {
+            "condition": {
+                "type": "STRING"
+            },
+            "risk": {
+                "type": "STRING",
+                "enum": [
+                    "Low",
+                    "Moderate",
+                    "Critical"
+                ]
+            },
+            "confidence": {
+                "type": "INTEGER",
+                "minimum": 0,
+                "maximum": 100
+            },
+            "steps": {
+                "type": "STRING"
+            }
+        }
+    }
+}
+
+# Metadata shown in the doctor's patient list
+METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Risk": {
+            "type": "string",
+            "enum": ["High", "Medium", "Low"],
+            "description": "The level of risk associated with the condition."
+        },
+        "Condition": {
+            "type": "string",
+            "description": "The medical condition diagnosed."
+        },
+        "Age": {
+            "type": "integer",
+            "format": "int32",
+            "description": "The age of the patient.",
+            "units": ["years", "year", "yrs", "y", "years old"]
+        },
+        "LastVisit": {
+            "type": "string",
+            "format": "date",
+            "description": "The date of the patient's last medical visit in YYYY-MM-DD format."
+        }
+    },
+    "required": ["Risk", "Condition"]
+}
@@ -0,0 +1,360 @@
+import json
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .profiles import get_profile
+from ..metrics import counter
+
+STRUCTURED_OUTPUT = counter(
+    "ai_structured_output_total",
+    "Structured model outputs by profile and how they were made valid",
+    ("profile", "outcome")
+)
+
+VALID = "valid"
+REPAIRED = "repaired"
+REGENERATED = "regenerated"
+FAILED = "failed"
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)\s*(?:```|$)", re.S)
+# A number, optionally followed by a suffix: "120", "75%", "18 years". The suffix
+# must be a percent sign or one of the units the field's schema lists.
+_NUMBER = re.compile(r"^(-?\d+(?:\.\d+)?)\s*(\S.*)?$")
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_MAX_CUTS = 50
+
+
+class StructuredOutputError(ValueError):
+    """Raised when model output cannot be turned into a value matching its schema."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def _scan(text: str) -> Tuple[List[str], bool, List[int]]:
+    """Closers for the containers still open at the end of text, whether a string is open, and offsets of commas outside strings."""
+    closers = []
+    commas = []
+    in_string = False
+    escape = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if closers:
+                closers.pop()
+        elif char == ",":
+            commas.append(index)
+    return closers, in_string, commas
+
+
+def _close(text: str) -> str:
+    closers, _, _ = _scan(text)
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    return text + "".join(reversed(closers))
+
+
+def parse_json(text: str) -> Tuple[Any, bool]:
+    """
+    Parse JSON from model output, repairing common damage.
+
+    Strips code fences and surrounding prose. Output that was cut off is
+    closed after its last complete member: the text is cut back to the
+    previous comma or to the opening of the outermost value, never closing
+    a string or number that may be incomplete, and open arrays and objects
+    are closed. A member dropped this way is missing from the result, so a
+    required one fails validation and is regenerated.
+
+    Returns:
+        (value, repaired): repaired is False if the text parsed as it was
+
+    Raises:
+        StructuredOutputError: If no JSON value can be recovered
+    """
+    if text is None:
+        raise StructuredOutputError("Empty model output")
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        raise StructuredOutputError("No JSON found in model output")
+    text = text[min(starts):]
+
+    try:
+        # Valid JSON followed by trailing prose
+        return json.JSONDecoder().raw_decode(text)[0], True
+    except json.JSONDecodeError:
+        pass
+
+    # Truncated output: close it after the last complete member, cutting back
+    # one member at a time until it parses
+    _, in_string, commas = _scan(text)
+    candidates = [text[:index] for index in reversed(commas[-_MAX_CUTS:])] + [text[:1]]
+    if not in_string and text.rstrip()[-1:] in ('"', "}", "]"):
+        # Ends with a complete string, array or object
+        candidates.insert(0, text)
+    for candidate in candidates:
+        try:
+            return json.loads(_close(candidate)), True
+        except json.JSONDecodeError:
+            continue
+    raise StructuredOutputError("Model output is not valid JSON")
+
+
+def _coerce_number(value, units=()):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = _NUMBER.match(value.strip())
+        if match:
+            suffix = match.group(2)
+            if suffix is None or suffix == "%" or suffix.lower() in units:
+                return float(match.group(1))
+    return None
+
+
+def _coerce_integer(value, units=()):
+    value = _coerce_number(value, units)
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    return value
+
+
+def compile_schema(schema: Dict[str, Any]) -> Callable[[Any, str, List[Tuple[str, str]]], Any]:
+    """
+    Compile a response schema into a validator.
+
+    The validator is called as validator(value, path, errors) and returns the
+    value coerced to the schema where that is unambiguous: enum values matched
+    case-insensitively, numbers parsed from strings that hold only a number
+    with an optional percent sign or one of the schema's "units" and clamped
+    to their bounds, single strings wrapped into string arrays. Problems it cannot
+    fix are appended to errors as (path, message). An invalid optional property
+    is dropped instead of reported.
+    """
+    schema_type = str(schema.get("type", "")).upper()
+
+    if schema_type == "OBJECT":
+        properties = {name: compile_schema(sub) for name, sub in schema.get("properties", {}).items()}
+        required = set(schema.get("required", []))
+
+        def validate_object(value, path, errors):
+            if not isinstance(value, dict):
+                errors.append((path, "expected an object"))
+                return value
+            result = dict(value)
+            for name, validator in properties.items():
+                child_path = f"{path}.{name}" if path else name
+                if name not in value or value[name] is None:
+                    if name in required:
+                        errors.append((child_path, "missing"))
+                    result.pop(name, None)
+                    continue
+                child_errors = []
+                coerced = validator(value[name], child_path, child_errors)
+                if child_errors and name not in required:
+                    result.pop(name)
+                    continue
+                errors.extend(child_errors)
+                result[name] = coerced
+            return result
+        return validate_object
+
+    if schema_type == "ARRAY":
+        item_validator = compile_schema(schema.get("items", {}))
+        item_type = str(schema.get("items", {}).get("type", "")).upper()
+
+        def validate_array(value, path, errors):
+            if isinstance(value, str) and item_type == "STRING":
+                value = [value]
+            if not isinstance(value, list):
+                errors.append((path, "expected an array"))
+                return value
+            return [item_validator(item, f"{path}[{index}]", errors) for index, item in enumerate(value)]
+        return validate_array
+
+    if schema_type == "STRING":
+        enum = schema.get("enum")
+        lowered = {option.lower(): option for option in enum} if enum else None
+        is_date = schema.get("format") == "date"
+
+        def validate_string(value, path, errors):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            if not isinstance(value, str):
+                errors.append((path, "expected a string"))
+                return value
+            value = value.strip()
+            if lowered is not None:
+                match = lowered.get(value.lower())
+                if match is None:
+                    errors.append((path, f"expected one of {', '.join(enum)}"))
+                    return value
+                return match
+            if is_date and not _DATE.match(value):
+                errors.append((path, "expected a YYYY-MM-DD date"))
+            return value
+        return validate_string
+
+    if schema_type in ("INTEGER", "NUMBER"):
+        coerce = _coerce_integer if schema_type == "INTEGER" else _coerce_number
+        units = tuple(unit.lower() for unit in schema.get("units", ()))
+        expected = f"expected {schema_type.lower()}" + (f" in {units[0]}" if units else "")
+        minimum = schema.get("minimum")
+        maximum = schema.get("maximum")
+
+        def validate_number(value, path, errors):
+            coerced = coerce(value, units)
+            if coerced is None:
+                errors.append((path, expected))
+                return value
+            if minimum is not None:
+                coerced = max(coerced, minimum)
+            if maximum is not None:
+                coerced = min(coerced, maximum)
+            return coerced
+        return validate_number
+
+    if schema_type == "BOOLEAN":
+        def validate_boolean(value, path, errors):
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                return value.strip().lower() == "true"
+            errors.append((path, "expected a boolean"))
+            return value
+        return validate_boolean
+
+    return lambda value, path, errors: value
+
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+
+def get_validator(profile_name: str):
+    """The compiled validator for a profile's response schema, built once per profile version."""
+    profile = get_profile(profile_name)
+    with _validators_lock:
+        validator = _validators.get(profile.tag)
+        if validator is None:
+            validator = _validators[profile.tag] = compile_schema(profile.response_schema or {})
+        return validator
+
+
+def _invalid_part(schema: Dict[str, Any], value: Any, errors: List[Tuple[str, str]]):
+    """
+    The smallest part of a result to regenerate: the invalid top-level properties
+    of an object, or the invalid items of an array.
+
+    Returns:
+        (part_schema, keys): keys are property names or item indexes, or None for the whole value
+    """
+    schema_type = str(schema.get("type", "")).upper()
+    if schema_type == "OBJECT" and isinstance(value, dict):
+        keys = sorted({re.split(r"[.\[]", path, maxsplit=1)[0] for path, _ in errors if path})
+        if keys:
+            properties = schema.get("properties", {})
+            return {
+                "type": schema.get("type"),
+                "properties": {key: properties[key] for key in keys if key in properties},
+                "required": [key for key in keys if key in properties]
+            }, keys
+    if schema_type == "ARRAY" and isinstance(value, list):
+        indexes = sorted({int(match.group(1)) for path, _ in errors for match in [re.match(r"^\[(\d+)\]", path)] if match})
+        if indexes:
+            return schema, indexes
+    return schema, None
+
+
+def structured_output(profile_name: str, text: str,
+                      regenerate: Optional[Callable[[str, Dict[str, Any]], str]] = None) -> Any:
+    """
+    Turn model output into a value that matches the profile's schema.
+
+    Output is first repaired and coerced locally. Only if required parts are
+    still invalid, and regenerate is given, the model is asked once for just
+    those parts, which are merged back into the result.
+
+    Args:
+        profile_name: Generation profile the output was produced with
+        text: Raw model output
+        regenerate: Optional callable(instructions, part_schema) returning new model output
+
+    Raises:
+        StructuredOutputError: If the output cannot be made valid
+    """
+    profile = get_profile(profile_name)
+    schema = profile.response_schema or {}
+    validator = get_validator(profile_name)
+
+    value, repaired = parse_json(text)
+    errors = []
+    value = validator(value, "", errors)
+    if not errors:
+        STRUCTURED_OUTPUT.inc(profile=profile.tag, outcome=REPAIRED if repaired else VALID)
+        return value
+
+    part_schema, keys = _invalid_part(schema, value, errors)
+    if regenerate is None:
+        STRUCTURED_OUTPUT.inc(profile=profile.tag, outcome=FAILED)
+        raise StructuredOutputError(f"Model output does not match the {profile.tag} schema", errors)
+
+    problems = "; ".join(f"{path or 'result'}: {message}" for path, message in errors)
+    logging.info(f"Regenerating invalid parts of {profile.tag} output: {problems}")
+    if keys is None:
+        instructions = f"Your previous answer was invalid ({problems}). Answer again in the required format."
+    elif isinstance(keys[0], int):
+        invalid_items = [value[index] for index in keys]
+        instructions = (
+            f"These items of your previous answer were invalid ({problems}):\n"
+            f"{json.dumps(invalid_items, ensure_ascii=False)}\n"
+            f"Return only corrected versions of these {len(keys)} items, as a JSON array in the same order."
+        )
+    else:
+        instructions = (
+            f"Some fields of your previous answer were invalid ({problems}). "
+            f"Return a JSON object with only these fields, corrected: {', '.join(keys)}."
+        )
+
+    try:
+        part, _ = parse_json(regenerate(instructions, part_schema))
+    except StructuredOutputError:
+        STRUCTURED_OUTPUT.inc(profile=profile.tag, outcome=FAILED)
+        raise
+    if keys is None:
+        value = part
+    elif isinstance(keys[0], int) and isinstance(part, list):
+        for index, item in zip(keys, part):
+            value[index] = item
+    elif isinstance(part, dict):
+        value.update({key: part[key] for key in keys if key in part})
+
+    errors = []
+    value = validator(value, "", errors)
+    if errors:
+        STRUCTURED_OUTPUT.inc(profile=profile.tag, outcome=FAILED)
+        raise StructuredOutputError(f"Model output does not match the {profile.tag} schema", errors)
+    STRUCTURED_OUTPUT.inc(profile=profile.tag, outcome=REGENERATED)
+    return value
@@ -1,14 +1,17 @@
 from flask import Blueprint, redirect, url_for, session, jsonify, request
-from app import db
 from app.models.patient import Patient
 from app.models.doctor import Doctor
 from urllib.parse import urlencode
 from flask_login import login_user, logout_user, login_required, current_user
 from app.oauth import google
+from app.identity_cache import identity_cache
+from app.models.sso import upsert_sso_user
 import secrets
 
 auth = Blueprint("auth", __name__)
 
+USER_MODELS = {"patient": Patient, "doctor": Doctor}
+
 @auth.route("/")
 def home():
 	# user = Patient.query.filter_by(sso_user_id="773").first()
@@ -66,37 +69,15 @@ def authorize():
 		email = user_info.get("email")
 		name = user_info.get("name")
 
-		if role == "patient":
-			user = Patient.query.filter_by(sso_user_id=google_id).first()
-
-			if not user:
-				existing_user = Patient.query.filter_by(email=email).first()
-
-				if existing_user:
-					existing_user.sso_provider = "Google"
-					existing_user.sso_user_id = google_id
-					db.session.commit()
-					user = existing_user
-				else:
-					user = Patient(email=email, full_name=name, sso_provider="Google", sso_user_id=google_id)
-					db.session.add(user)
-					db.session.commit()
-		elif role == "doctor":
-			user = Doctor.query.filter_by(sso_user_id=google_id).first()
-
-			if not user:
-				existing_user = Doctor.query.filter_by(email=email).first()
-
-				if existing_user:
-					existing_user.sso_provider = "Google"
-					existing_user.sso_user_id = google_id
-					db.session.commit()
-					user = existing_user
-				else:
-					user = Doctor(email=email, full_name=name, sso_provider="Google", sso_user_id=google_id)
-					db.session.add(user)
-					db.session.commit()
+		model = USER_MODELS.get(role)
+		if model is None:
+			return "Error: Invalid role.", 400
+
+		# One round trip: insert the user, or link the existing account with this email
+		user = upsert_sso_user(model, email=email, full_name=name, sso_provider="Google", sso_user_id=google_id)
 
+		# Drop any cached identity so the updated profile is picked up
+		identity_cache.invalidate(role, user.get_id())
 		login_user(user)
 	
 	cb = session["cb"]
@@ -105,5 +86,6 @@ def authorize():
 @auth.route("/logout")
 @login_required
 def logout():
+	identity_cache.invalidate(session.get("role"), current_user.get_id())
 	logout_user()
 	return jsonify({"logged_out": True}), 200
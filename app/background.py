@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app.ai_services import ai_priority, BACKGROUND
+from app.metrics import counter
+
+BACKGROUND_TASKS = counter(
+    "background_tasks_total",
+    "Follow-up work submitted after a history change, by task and outcome",
+    ("task", "outcome")
+)
+
+
+class BackgroundRunner:
+    """
+    Runs follow-up work of a request (summaries, metadata, index updates) on
+    a bounded pool of threads, so a burst of turns cannot start a thread each.
+
+    Work is coalesced per (task, key), where the key is usually the patient:
+    while a task is queued or running for a key, further submissions only
+    replace the arguments it runs with next, so a patient gets at most one
+    queued rerun with the latest history however many turns arrive. When
+    max_pending keys are busy new work is dropped; the next change of that
+    patient's history catches up on it.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background")
+        self._lock = threading.Lock()
+        self._active = set()
+        self._latest = {}
+
+    def submit(self, app, task, key, fn, *args):
+        item = (task, str(key))
+        with self._lock:
+            if item in self._active:
+                self._latest[item] = (fn, args)
+                BACKGROUND_TASKS.inc(task=task, outcome="coalesced")
+                return
+            if len(self._active) >= self.max_pending:
+                BACKGROUND_TASKS.inc(task=task, outcome="dropped")
+                logging.warning(f"Background queue full, dropping {task} for {key}")
+                return
+            self._active.add(item)
+        self._executor.submit(self._run, app, item, fn, args)
+
+    def _run(self, app, item, fn, args):
+        task, key = item
+        while True:
+            with app.app_context(), ai_priority(BACKGROUND):
+                try:
+                    fn(*args)
+                    BACKGROUND_TASKS.inc(task=task, outcome="success")
+                except Exception as e:
+                    BACKGROUND_TASKS.inc(task=task, outcome="error")
+                    logging.error(f"Error running {task} for {key} in the background: {str(e)}")
+            with self._lock:
+                latest = self._latest.pop(item, None)
+                if latest is None:
+                    self._active.discard(item)
+                    return
+            fn, args = latest
+
+
+_runner = None
+_runner_pid = None
+_runner_lock = threading.Lock()
+
+
+def get_background_runner():
+    """The runner of this process; a forked worker gets its own, as threads do not survive a fork."""
+    global _runner, _runner_pid
+    with _runner_lock:
+        if _runner is None or _runner_pid != os.getpid():
+            _runner = BackgroundRunner(
+                current_app.config.get("BACKGROUND_WORKERS", 4),
+                current_app.config.get("BACKGROUND_MAX_PENDING", 256)
+            )
+            _runner_pid = os.getpid()
+        return _runner
+
+
+def run_in_background(task, key, fn, *args):
+    """
+    Run fn(*args) after the response, in the application context at
+    background model priority, coalesced with other runs of task for key.
+    """
+    get_background_runner().submit(current_app._get_current_object(), task, key, fn, *args)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+from google.api_core.exceptions import PreconditionFailed
+from app.utils.pagination import encode_cursor
+
+CURSOR_TAIL_BYTES = 64
+
+
+class HistoryFormatError(ValueError):
+    """Raised when a stored chat history is not in a format the server can manage."""
+
+
+def history_cursor(generation, offset, tail):
+    """
+    Build a delta sync cursor pointing at a byte offset of a history version.
+
+    The cursor records a hash of the bytes just before the offset, so a later
+    read can tell whether the history was appended to or rewritten.
+
+    Args:
+        generation: GCS generation of the history blob
+        offset: Byte offset the next delta starts at
+        tail: The bytes of the history ending at offset
+    """
+    return encode_cursor({
+        'g': generation,
+        'o': offset,
+        't': hashlib.sha1(tail[-CURSOR_TAIL_BYTES:]).hexdigest()
+    })
+
+
+def message_cursor(generation, messages):
+    """
+    Build a delta sync cursor pointing after the messages of a JSON array history.
+
+    A JSON array history is rewritten whole whenever it changes, so no byte
+    offset survives a change; the cursor counts messages instead and records
+    a hash of them to tell an append from a rewrite.
+    """
+    return encode_cursor({
+        'g': generation,
+        'm': len(messages),
+        'h': messages_hash(messages)
+    })
+
+
+def messages_hash(messages):
+    return hashlib.sha1(format_messages(messages).encode("utf-8")).hexdigest()
+
+
+def sync_cursor(generation, data):
+    """
+    The delta sync cursor for the end of a stored history: a message cursor
+    for a JSON array of messages, a byte cursor for anything else.
+    """
+    if is_json_array(data):
+        try:
+            messages, is_jsonl = parse_messages(data.decode("utf-8"))
+            if not is_jsonl:
+                return message_cursor(generation, messages)
+        except (HistoryFormatError, UnicodeDecodeError):
+            pass
+    return history_cursor(generation, len(data), data)
+
+
+def parse_messages(text):
+    """
+    Parse a stored history into a list of {'type', 'content'} messages.
+
+    Returns:
+        (messages, is_jsonl): is_jsonl is False for a legacy JSON array history
+
+    Raises:
+        HistoryFormatError: If the history is neither JSON Lines nor a JSON array of messages
+    """
+    if not text or not text.strip():
+        return [], True
+
+    try:
+        messages = [json.loads(line) for line in text.splitlines() if line.strip()]
+        if all(is_message(message) for message in messages):
+            return messages, True
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        messages = json.loads(text)
+        if isinstance(messages, list) and all(is_message(message) for message in messages):
+            return messages, False
+    except json.JSONDecodeError:
+        pass
+
+    raise HistoryFormatError("Chat history is not a list of messages")
+
+
+def is_message(value):
+    return isinstance(value, dict) and value.get("type") in ("user", "assistant") and isinstance(value.get("content"), str)
+
+
+def format_messages(messages):
+    """Serialize messages as JSON Lines, one message per line."""
+    return "".join(json.dumps({"type": m["type"], "content": m["content"]}, ensure_ascii=False) + "\n" for m in messages)
+
+
+def is_json_array(data):
+    """Whether stored history bytes are a legacy client-managed JSON array rather than JSON Lines."""
+    return data.lstrip().startswith(b"[")
+
+
+class ChatHistoryStore:
+    """
+    Server-managed chat history stored as JSON Lines at {user_id}/chat_history.
+
+    New turns are appended server side with GCS compose, so the growing
+    transcript is never re-uploaded, and the append is conditional on the
+    generation that was read so concurrent turns are not lost.
+
+    A legacy history saved by a client as a JSON array stays a JSON array,
+    since clients read it back in that format: it is parsed in memory and
+    rewritten whole, conditionally, when turns are added.
+    """
+
+    MAX_LOAD_ATTEMPTS = 3
+    MAX_APPEND_ATTEMPTS = 3
+
+    def __init__(self, gcs_service):
+        self.gcs_service = gcs_service
+
+    def blob_path(self, user_id):
+        return f"{user_id}/chat_history"
+
+    def load(self, user_id):
+        """
+        Load a user's history.
+
+        Returns:
+            (messages, generation, data): generation is 0 and data empty if there is no history yet
+        """
+        blob_path = self.blob_path(user_id)
+        for attempt in range(self.MAX_LOAD_ATTEMPTS):
+            info = self.gcs_service.get_info(blob_path)
+            if info is None:
+                return [], 0, b""
+            text = self.gcs_service.download_text(blob_path, info["generation"])
+            if text is not None:
+                messages, _ = parse_messages(text)
+                return messages, info["generation"], text.encode("utf-8")
+            # Replaced between the metadata read and the download
+        raise RuntimeError(f"Chat history for {user_id} kept changing while it was read")
+
+    def append(self, user_id, new_messages, generation, data):
+        """
+        Append messages to a history previously read with load().
+
+        If the history changed since it was read, it is reloaded and the
+        messages are appended after whatever was added in the meantime.
+
+        Returns:
+            (generation, data) of the history after the append
+        """
+        blob_path = self.blob_path(user_id)
+        for attempt in range(self.MAX_APPEND_ATTEMPTS):
+            try:
+                if is_json_array(data):
+                    messages, _ = parse_messages(data.decode("utf-8"))
+                    text = json.dumps(messages + new_messages, ensure_ascii=False)
+                    new_generation = self.gcs_service.replace_text(text, blob_path, generation)
+                    return new_generation, text.encode("utf-8")
+                appended = format_messages(new_messages).encode("utf-8")
+                if data and not data.endswith(b"\n"):
+                    appended = b"\n" + appended
+                new_generation = self.gcs_service.append_text(appended.decode("utf-8"), blob_path, generation)
+                return new_generation, data + appended
+            except PreconditionFailed:
+                logging.info(f"Chat history for {user_id} changed during append, retrying")
+                _, generation, data = self.load(user_id)
+        raise RuntimeError(f"Could not append to chat history for {user_id}")
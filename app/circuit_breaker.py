@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+from werkzeug.exceptions import ServiceUnavailable
+from app.metrics import counter, gauge
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state per dependency: 0 closed, 1 half open, 2 open",
+    ("name",),
+    multiprocess_mode="max"
+)
+CIRCUIT_REJECTED = counter(
+    "circuit_breaker_rejected_total",
+    "Calls failed fast because the dependency's circuit breaker was open",
+    ("name",)
+)
+CIRCUIT_TRANSITIONS = counter(
+    "circuit_breaker_transitions_total",
+    "Circuit breaker state changes",
+    ("name", "state")
+)
+
+
+class CircuitOpenError(ServiceUnavailable):
+    """Raised instead of calling a dependency whose circuit breaker is open; rendered as a 503."""
+
+    def __init__(self, name):
+        super().__init__(f"{name} is temporarily unavailable.")
+        self.dependency = name
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one dependency.
+
+    After failure_threshold failures in a row the breaker opens and calls fail
+    fast with CircuitOpenError. Once reset_timeout seconds have passed it lets
+    up to half_open_max_calls probe calls through: a successful probe closes
+    it again and a failed probe reopens it.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            logging.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            CIRCUIT_TRANSITIONS.inc(name=self.name, state=state)
+        self.state = state
+
+    def allow(self):
+        """Whether a call may go ahead now. Callers that get True must report its outcome."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(HALF_OPEN)
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_max_calls:
+                    return False
+                self.probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._transition(OPEN)
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    @contextmanager
+    def guard(self, is_failure):
+        """
+        Run the block if the breaker allows it, recording the outcome.
+
+        Args:
+            is_failure: Predicate telling dependency failures apart from errors
+                that say nothing about its health, such as a missing object
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+        """
+        if not self.allow():
+            CIRCUIT_REJECTED.inc(name=self.name)
+            raise CircuitOpenError(self.name)
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """The process-wide breaker for a dependency, created from the CIRCUIT_* settings on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            config = current_app.config if has_app_context() else {}
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=config.get("CIRCUIT_FAILURE_THRESHOLD", 5),
+                reset_timeout=config.get("CIRCUIT_RESET_TIMEOUT", 30.0),
+                half_open_max_calls=config.get("CIRCUIT_HALF_OPEN_MAX_CALLS", 1)
+            )
+        return breaker
+
+
+def _states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [({"name": breaker.name}, STATE_VALUES[breaker.state]) for breaker in breakers]
+
+
+CIRCUIT_STATE.set_function(_states)
@@ -1,4 +1,6 @@
 import os
+import json
+import tempfile
 
 class Config:
 	SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "supersecret") 
@@ -26,7 +28,126 @@ class Config:
 	# SQLALCHEMY_DATABASE_URI = f"mssql+pyodbc://{DB_USER}:{DB_PASSWORD}@{DB_SERVER}/{DB_NAME}?driver=ODBC+Driver+17+for+SQL+Server"
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+	# Engine pool sizing. Keep (DB_POOL_SIZE + DB_MAX_OVERFLOW) * gunicorn workers
+	# below the Postgres connection limit.
+	DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+	DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+	DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+	DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+	DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+	DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))
+	DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 30000))
+	# Set when connecting through PgBouncer in transaction pooling mode
+	DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "False").lower() == "true"
+
+	# Optional read replicas (comma separated SQLAlchemy URIs) for read-only endpoints
+	DB_REPLICA_URIS = [uri.strip() for uri in os.getenv("DB_REPLICA_URIS", "").split(",") if uri.strip()]
+	DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", 5))
+	DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", 10))
+
 	# Google OAuth
 	GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 	GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 	GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+	# Discovery document and JWKS cache shared by the workers on a host
+	OAUTH_METADATA_CACHE_PATH = os.getenv("OAUTH_METADATA_CACHE_PATH", os.path.join(tempfile.gettempdir(), "vikimt-google-oidc.json"))
+	OAUTH_METADATA_CACHE_TTL = int(os.getenv("OAUTH_METADATA_CACHE_TTL", 3600))
+
+	# /metrics requires "Authorization: Bearer <METRICS_TOKEN>" when set, and
+	# otherwise only answers scrapes from the same host. Callback gauges are
+	# refreshed this often in every worker when PROMETHEUS_MULTIPROC_DIR is set.
+	METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+	METRICS_REFRESH_INTERVAL = float(os.getenv("METRICS_REFRESH_INTERVAL", 15))
+
+	# Patient listing pagination
+	PATIENTS_PAGE_SIZE = int(os.getenv("PATIENTS_PAGE_SIZE", 20))
+	PATIENTS_MAX_PAGE_SIZE = int(os.getenv("PATIENTS_MAX_PAGE_SIZE", 100))
+
+	# Flask-Login identity cache (per process)
+	USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 30))
+	USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", 10000))
+
+	# Most recent stored messages sent as model context in server-managed chat
+	CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", 50))
+
+	# Rolling conversation summaries: the newest messages always go to the
+	# models verbatim, older ones are folded into the patient's stored summary
+	# once at least SUMMARY_MIN_NEW_MESSAGES of them have accumulated
+	SUMMARY_KEEP_RECENT_MESSAGES = int(os.getenv("SUMMARY_KEEP_RECENT_MESSAGES", 20))
+	SUMMARY_MIN_NEW_MESSAGES = int(os.getenv("SUMMARY_MIN_NEW_MESSAGES", 20))
+
+	# Skip metadata extraction when the new patient turns have no clinical content
+	METADATA_SKIP_NONCLINICAL = os.getenv("METADATA_SKIP_NONCLINICAL", "True").lower() == "true"
+
+	# Request time budgets in seconds, by endpoint. GCS calls, DB statements and
+	# model calls get whatever is left of the budget as their timeout. Keep
+	# GUNICORN_TIMEOUT (gunicorn.conf.py) above the largest budget.
+	REQUEST_DEADLINE_DEFAULT = float(os.getenv("REQUEST_DEADLINE_DEFAULT", 30))
+	REQUEST_DEADLINES = {
+		endpoint.strip(): float(seconds)
+		for endpoint, seconds in (
+			item.split("=") for item in os.getenv(
+				"REQUEST_DEADLINES", "chatapi=120,soap=90,dvx=90,chathistoryresource=60"
+			).split(",") if "=" in item
+		)
+	}
+
+	# Model call resilience: retries with jittered backoff on 429/5xx, optional
+	# hedging after the service's p95 latency, and fallback between services
+	AI_RETRY_MAX_ATTEMPTS = int(os.getenv("AI_RETRY_MAX_ATTEMPTS", 3))
+	AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", 0.5))
+	AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", 8))
+	AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "False").lower() == "true"
+	AI_HEDGE_QUANTILE = float(os.getenv("AI_HEDGE_QUANTILE", 0.95))
+	AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", 1.0))
+	# Circuit breakers per AI service and per GCS bucket: open after this many
+	# consecutive failures, then allow a probe call after the reset timeout
+	CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+	CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+	CIRCUIT_HALF_OPEN_MAX_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_MAX_CALLS", 1))
+	# Last SOAP/DVX results kept per process, served while the models are down
+	AI_RESULT_CACHE_SIZE = int(os.getenv("AI_RESULT_CACHE_SIZE", 1000))
+
+	# Text embeddings: "vertex" for the Vertex AI embedding model, "hashing"
+	# for the offline deterministic stand-in
+	EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "vertex")
+	EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 256))
+
+	# Semantic chat cache (per process, opt-in): a standalone patient question
+	# at least SEMANTIC_CACHE_THRESHOLD cosine-similar to an entry of the vetted
+	# FAQ in SEMANTIC_CACHE_FAQ_PATH (a JSON list of questions whose answer does
+	# not depend on the patient) gets the answer last generated for that entry
+	# under the same system instruction, without a model call; questions with
+	# numbers, negations or medications are never cached
+	SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "False").lower() == "true"
+	SEMANTIC_CACHE_FAQ_PATH = os.getenv("SEMANTIC_CACHE_FAQ_PATH")
+	SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+	SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+	SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+
+	# Similar-patient search: memory-mapped embedding index. Every instance
+	# serving /patients/<id>/similar must mount the same volume here (see the
+	# Dockerfile); fill it with `flask patient-index backfill`
+	PATIENT_INDEX_DIR = os.getenv("PATIENT_INDEX_DIR", "instance/patient_index")
+	PATIENT_INDEX_BATCH_ROWS = int(os.getenv("PATIENT_INDEX_BATCH_ROWS", 65536))
+	PATIENT_INDEX_MAX_CHARS = int(os.getenv("PATIENT_INDEX_MAX_CHARS", 8000))
+	SIMILAR_PATIENTS_DEFAULT = int(os.getenv("SIMILAR_PATIENTS_DEFAULT", 10))
+	SIMILAR_PATIENTS_MAX = int(os.getenv("SIMILAR_PATIENTS_MAX", 100))
+
+	# Follow-up work after a history change (summaries, metadata, similar-patient
+	# index): threads per process, and patients that may have work queued
+	BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", 4))
+	BACKGROUND_MAX_PENDING = int(os.getenv("BACKGROUND_MAX_PENDING", 256))
+
+	# Per-task overrides of the model routing policies in app/ai_services/config.py,
+	# as JSON, e.g. {"extraction": {"candidates": ["medical_lm"]}}
+	AI_ROUTING_POLICIES = json.loads(os.getenv("AI_ROUTING_POLICIES", "{}"))
+
+	# Seconds a model call may queue for the per-model limits in AI_SERVICE_CONFIG
+	AI_ADMISSION_TIMEOUT = float(os.getenv("AI_ADMISSION_TIMEOUT", 10))
+	AI_FALLBACKS = {
+		service.strip(): fallback.strip()
+		for service, fallback in (
+			item.split("=") for item in os.getenv("AI_FALLBACKS", "medical_lm=gemini").split(",") if "=" in item
+		)
+	}
@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime, timezone
+from flask import current_app
+from google.api_core.exceptions import PreconditionFailed
+from app.ai_services import get_ai_service
+from app.background import run_in_background
+from app.chat_history_store import parse_messages, HistoryFormatError
+from app.gcs_service import GCSService
+from app.metrics import counter
+from app.watermarked_state import WatermarkedState
+
+SUMMARY_PROFILE = "summary"
+
+SYSTEM_INSTRUCTION = (
+    "You maintain a running clinical summary of a patient's conversation with a health assistant. "
+    "Update the current summary with the new conversation turns. Keep symptoms with their onset and "
+    "duration, medications, allergies, medical history, measurements, dates and the patient's age; "
+    "leave out small talk. Answer with the updated summary only, as plain text."
+)
+
+SUMMARY_PROMPTS = counter(
+    "conversation_summary_prompts_total",
+    "Model prompts built from a patient's history, by whether a stored summary replaced the older turns",
+    ("source",)
+)
+SUMMARY_UPDATES = counter(
+    "conversation_summary_updates_total",
+    "Attempts to advance a patient's conversation summary, by outcome",
+    ("outcome",)
+)
+
+def format_turns(messages):
+    """Messages as a plain transcript, one "Patient:"/"Assistant:" line per turn."""
+    return "\n".join(
+        f"{'Patient' if message['type'] == 'user' else 'Assistant'}: {message['content']}"
+        for message in messages
+    )
+
+
+class ConversationSummary(WatermarkedState):
+    """
+    Versioned rolling summary of a patient's chat history, stored as JSON at
+    {patient_id}/chat_summary.json next to the history.
+
+    The summary covers the first `watermark` messages of the history and is
+    only used while that watermark still applies.
+    """
+
+    def __init__(self, gcs_service):
+        super().__init__(gcs_service, "chat_summary.json", SUMMARY_PROFILE)
+
+    def usable(self, summary, messages):
+        """Whether summary still describes the start of messages."""
+        return self.watermark(summary, messages) > 0
+
+
+def model_context(gcs_service, patient_id, history_text):
+    """
+    The patient's conversation as it should be sent to a model: the stored
+    summary followed by only the turns after its watermark, or the full
+    history if there is no usable summary yet.
+    """
+    store = ConversationSummary(gcs_service)
+    try:
+        messages, _ = parse_messages(history_text)
+        summary, _ = store.load(patient_id)
+    except HistoryFormatError:
+        SUMMARY_PROMPTS.inc(source="full")
+        return history_text
+    except Exception as e:
+        logging.warning(f"Could not load conversation summary for {patient_id}, sending the full history: {str(e)}")
+        SUMMARY_PROMPTS.inc(source="full")
+        return history_text
+
+    if not store.usable(summary, messages):
+        SUMMARY_PROMPTS.inc(source="full")
+        return history_text
+
+    SUMMARY_PROMPTS.inc(source="summary")
+    recent = messages[summary["watermark"]:]
+    return (
+        f"Summary of the earlier conversation:\n{summary['summary']}\n\n"
+        f"Conversation since the summary:\n{format_turns(recent) if recent else '(no new messages)'}"
+    )
+
+
+def advance_summary(gcs_service, ai_service, patient_id, history_text, keep_recent, min_new):
+    """
+    Fold the turns between the stored watermark and the last keep_recent
+    messages into the summary, once at least min_new of them have piled up.
+
+    Only the previous summary and the new turns are sent to the model. A
+    summary that no longer matches the history is rebuilt from the start.
+
+    Returns:
+        The new summary, or None if it was not advanced
+    """
+    try:
+        messages, _ = parse_messages(history_text)
+    except HistoryFormatError:
+        return None
+
+    store = ConversationSummary(gcs_service)
+    summary, generation = store.load(patient_id)
+    if not store.usable(summary, messages):
+        # Rebuild from the start, keeping the version count going
+        summary = {"summary": "", "watermark": 0, "version": (summary or {}).get("version", 0)}
+
+    watermark = summary["watermark"]
+    target = len(messages) - max(keep_recent, 0)
+    if target - watermark < max(min_new, 1):
+        SUMMARY_UPDATES.inc(outcome="skipped")
+        return None
+
+    prompt = (
+        f"Current summary:\n{summary['summary'] or '(none yet)'}\n\n"
+        f"New conversation turns:\n{format_turns(messages[watermark:target])}"
+    )
+    text = ai_service.generate_response(
+        [{"type": "user", "content": prompt}],
+        SYSTEM_INSTRUCTION,
+        profile=SUMMARY_PROFILE
+    )
+    if not text or not text.strip():
+        SUMMARY_UPDATES.inc(outcome="failed")
+        return None
+
+    new_summary = {
+        **store.stamp(messages[:target]),
+        "version": summary.get("version", 0) + 1,
+        "summary": text.strip(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    try:
+        store.save(patient_id, new_summary, generation)
+    except PreconditionFailed:
+        # Advanced concurrently by another worker
+        SUMMARY_UPDATES.inc(outcome="conflict")
+        return None
+    SUMMARY_UPDATES.inc(outcome="advanced")
+    logging.info(f"Advanced conversation summary for {patient_id} to message {target} (version {new_summary['version']})")
+    return new_summary
+
+
+def advance_summary_in_background(patient_id, history_text):
+    """Advance a patient's summary after a history change, without delaying the response."""
+    keep_recent = current_app.config.get("SUMMARY_KEEP_RECENT_MESSAGES", 20)
+    min_new = current_app.config.get("SUMMARY_MIN_NEW_MESSAGES", 20)
+
+    def run(history_text):
+        try:
+            advance_summary(
+                GCSService("patientstorage"),
+                get_ai_service(task=SUMMARY_PROFILE),
+                patient_id,
+                history_text,
+                keep_recent,
+                min_new
+            )
+        except Exception:
+            SUMMARY_UPDATES.inc(outcome="failed")
+            raise
+
+    run_in_background("conversation_summary", patient_id, run, history_text)
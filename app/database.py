@@ -1,4 +1,117 @@
-from app import db
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+from app import db, deadline
+from app.metrics import gauge, histogram
+
+POOL_CHECKOUT_WAIT = histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the SQLAlchemy pool",
+    ("pool",)
+)
+POOL_CONNECTIONS = gauge(
+    "db_pool_connections",
+    "SQLAlchemy pool connections by state",
+    ("pool", "state"),
+    multiprocess_mode="livesum"
+)
+
+_instrumented_pools = {}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, pool=self.logging_name or "primary")
+
+
+def _pool_utilisation():
+    samples = []
+    for name, (engine, capacity) in list(_instrumented_pools.items()):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        samples.append(({"pool": name, "state": "checked_out"}, pool.checkedout()))
+        samples.append(({"pool": name, "state": "idle"}, pool.checkedin()))
+        samples.append(({"pool": name, "state": "overflow"}, max(pool.overflow(), 0)))
+        samples.append(({"pool": name, "state": "capacity"}, capacity))
+    return samples
+
+
+POOL_CONNECTIONS.set_function(_pool_utilisation)
+
+
+def build_engine_options(config, pool_name="primary"):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings in the app config.
+
+    In PgBouncer mode (transaction pooling) connections are not pooled locally
+    and startup parameters are not sent, since PgBouncer rejects them; the
+    statement timeout is applied per transaction instead, see instrument_engine.
+    """
+    connect_args = {}
+    if config.get("DB_CONNECT_TIMEOUT"):
+        connect_args["connect_timeout"] = config["DB_CONNECT_TIMEOUT"]
+
+    if config.get("DB_PGBOUNCER"):
+        return {
+            "poolclass": NullPool,
+            "pool_logging_name": pool_name,
+            "connect_args": connect_args,
+        }
+
+    statement_timeout = config.get("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout:
+        connect_args["options"] = f"-c statement_timeout={int(statement_timeout)}"
+
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_logging_name": pool_name,
+        "pool_size": config.get("DB_POOL_SIZE", 5),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+        "connect_args": connect_args,
+    }
+
+
+def instrument_engine(engine, config, pool_name="primary"):
+    """Register an engine for pool metrics and apply per-transaction settings."""
+    capacity = config.get("DB_POOL_SIZE", 5) + config.get("DB_MAX_OVERFLOW", 10)
+    _instrumented_pools[pool_name] = (engine, capacity)
+
+    statement_timeout = int(config.get("DB_STATEMENT_TIMEOUT_MS") or 0)
+    pgbouncer = config.get("DB_PGBOUNCER")
+
+    @event.listens_for(engine, "begin")
+    def set_statement_timeout(conn):
+        if conn.dialect.name != "postgresql":
+            return
+        # Outside PgBouncer mode the configured timeout is already a startup option
+        timeout_ms = statement_timeout if pgbouncer else 0
+        left = deadline.remaining()
+        if left is not None:
+            if left <= 0:
+                raise deadline.DeadlineExceeded()
+            # Bound the transaction by the request's remaining budget when that is tighter
+            budget_ms = max(int(left * 1000), 1)
+            if not statement_timeout or budget_ms < statement_timeout:
+                timeout_ms = budget_ms
+        if timeout_ms:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+    @event.listens_for(engine, "handle_error")
+    def report_deadline(context):
+        # A statement cancelled because the request ran out of time is a 504, not a 500
+        if deadline.expired():
+            raise deadline.DeadlineExceeded() from context.original_exception
+
 
 def init_db():
     from app.models.patient import Patient
@@ -0,0 +1,132 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from app.metrics import counter, gauge
+
+ROUTED_READS = counter(
+    "db_routed_reads_total",
+    "Read statements issued inside a replica_reads() scope, by target",
+    ("target",)
+)
+REPLICA_LAG = gauge(
+    "db_replica_lag_seconds",
+    "Replication lag measured by the last health probe",
+    ("replica",),
+    multiprocess_mode="max"
+)
+
+# Zero when the replica has replayed everything it received, so an idle
+# primary does not make a caught-up replica look stale.
+LAG_QUERY = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    """
+    Tracks read replica health and picks a replica for read-only statements.
+
+    Replicas are Flask-SQLAlchemy binds. Each one is probed for replication lag at
+    most once per health_interval; replicas that are unreachable or lag more than
+    max_lag seconds are skipped, and when none qualify reads go to the primary.
+    """
+
+    def __init__(self):
+        self.bind_keys = []
+        self.max_lag = 5.0
+        self.health_interval = 10.0
+        self._state = {}
+        # Re-entrant: a failed probe connection triggers mark_unhealthy from handle_error
+        self._lock = threading.RLock()
+
+    def configure(self, bind_keys, max_lag, health_interval):
+        self.bind_keys = list(bind_keys)
+        self.max_lag = max_lag
+        self.health_interval = health_interval
+        self._state = {key: {"healthy": False, "checked_at": None} for key in self.bind_keys}
+
+    def watch(self, bind_key, engine):
+        """Mark a replica unhealthy as soon as one of its connections fails."""
+        @event.listens_for(engine, "handle_error")
+        def on_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_unhealthy(bind_key)
+
+    def mark_unhealthy(self, bind_key):
+        with self._lock:
+            self._state[bind_key] = {"healthy": False, "checked_at": time.monotonic()}
+        logging.warning(f"Read replica {bind_key} marked unhealthy")
+
+    def choose(self, engines):
+        """Return a healthy replica engine, or None to use the primary."""
+        candidates = list(self.bind_keys)
+        random.shuffle(candidates)
+        for bind_key in candidates:
+            engine = engines.get(bind_key)
+            if engine is not None and self._is_usable(bind_key, engine):
+                return engine
+        return None
+
+    def _is_usable(self, bind_key, engine):
+        state = self._state.get(bind_key, {})
+        checked_at = state.get("checked_at")
+        if checked_at is not None and time.monotonic() - checked_at < self.health_interval:
+            return state["healthy"]
+
+        # Only one thread probes at a time; others use the last known state
+        if not self._lock.acquire(blocking=False):
+            return state.get("healthy", False)
+        try:
+            healthy = False
+            try:
+                with engine.connect() as conn:
+                    lag = float(conn.exec_driver_sql(LAG_QUERY).scalar() or 0)
+                REPLICA_LAG.set(lag, replica=bind_key)
+                healthy = lag <= self.max_lag
+                if not healthy:
+                    logging.warning(f"Read replica {bind_key} is {lag:.1f}s behind, using primary")
+            except Exception as e:
+                logging.warning(f"Read replica {bind_key} health check failed: {str(e)}")
+            self._state[bind_key] = {"healthy": healthy, "checked_at": time.monotonic()}
+            return healthy
+        finally:
+            self._lock.release()
+
+
+replica_router = ReplicaRouter()
+
+
+@contextmanager
+def replica_reads():
+    """Send read-only statements issued inside this block to a read replica when one is usable."""
+    previous = g.get("_use_replica", False)
+    g._use_replica = True
+    try:
+        yield
+    finally:
+        g._use_replica = previous
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that routes SELECTs inside replica_reads() to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and replica_router.bind_keys
+            and has_app_context()
+            and g.get("_use_replica", False)
+            and getattr(clause, "is_select", False)
+        ):
+            engine = replica_router.choose(self._db.engines)
+            ROUTED_READS.inc(target="replica" if engine is not None else "primary")
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
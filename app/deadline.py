@@ -0,0 +1,65 @@
+import time
+from contextlib import contextmanager
+from flask import g, request, current_app, has_request_context
+from werkzeug.exceptions import GatewayTimeout
+
+
+class DeadlineExceeded(GatewayTimeout):
+    """Raised when the request's time budget is used up; rendered as a 504."""
+
+    description = "The request did not complete within its time budget."
+
+
+def start_request_deadline():
+    """before_request hook: set the request deadline from REQUEST_DEADLINES for the endpoint."""
+    budgets = current_app.config.get("REQUEST_DEADLINES", {})
+    seconds = budgets.get(request.endpoint, current_app.config.get("REQUEST_DEADLINE_DEFAULT", 30))
+    g.deadline = time.monotonic() + seconds
+
+
+def deadline_at():
+    """The current request's deadline as a time.monotonic() value, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get("deadline")
+
+
+def remaining():
+    """Seconds left in the current request's budget, or None if there is no deadline."""
+    deadline = deadline_at()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def timeout(default):
+    """
+    Timeout in seconds for a downstream call: the remaining budget, capped at default.
+
+    Raises:
+        DeadlineExceeded: If the budget is already used up, so the call is not attempted
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(left, default) if default else left
+
+
+@contextmanager
+def deadline_errors():
+    """Report a downstream failure as DeadlineExceeded when it happened because the budget ran out."""
+    try:
+        yield
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if expired():
+            raise DeadlineExceeded() from e
+        raise
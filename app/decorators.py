@@ -1,6 +1,7 @@
 from functools import wraps
 from flask import session
 from flask_login import current_user, login_required
+from app.db_routing import replica_reads
 
 def doctor_required(f):
     @wraps(f)
@@ -10,3 +11,11 @@ def doctor_required(f):
             return {"error": "Doctor access required"}, 403
         return f(*args, **kwargs)
     return decorated_function
+
+def read_only(f):
+    """Route the queries of a read-only handler to a read replica when one is usable."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with replica_reads():
+            return f(*args, **kwargs)
+    return decorated_function
@@ -1,29 +1,149 @@
 from google.cloud import storage
+from google.api_core.exceptions import NotFound, ServerError, TooManyRequests
+from functools import wraps
+from app import deadline
+from app.circuit_breaker import get_breaker
+import requests
+import uuid
+
+# Per-call timeout in seconds when there is no request deadline (the client library default)
+DEFAULT_TIMEOUT = 60
+
+def is_storage_failure(error):
+	"""Errors that mean the bucket is unhealthy, as opposed to e.g. a missing object or a lost race."""
+	if isinstance(error, deadline.DeadlineExceeded):
+		# The request's own budget ran out; only a failure of the call itself counts
+		return error.__cause__ is not None and is_storage_failure(error.__cause__)
+	# ServerError includes google.api_core.exceptions.DeadlineExceeded
+	return isinstance(error, (ServerError, TooManyRequests, requests.exceptions.ConnectionError,
+		requests.exceptions.Timeout))
+
+def bounded(f):
+	"""
+	Fail fast while the bucket's circuit breaker is open, and report calls that
+	failed because the request deadline ran out as DeadlineExceeded.
+	"""
+	@wraps(f)
+	def wrapper(self, *args, **kwargs):
+		with self.breaker.guard(is_storage_failure), deadline.deadline_errors():
+			return f(self, *args, **kwargs)
+	return wrapper
 
 class GCSService:
 	def __init__(self, bucket_name):
 		self.client = storage.Client()
 		self.bucket = self.client.bucket(bucket_name)
+		self.breaker = get_breaker(f"gcs:{bucket_name}")
+
+	def _timeout(self):
+		"""Timeout for the next call: the remaining request budget, capped at DEFAULT_TIMEOUT."""
+		return deadline.timeout(DEFAULT_TIMEOUT)
+
+	@bounded
+	def upload_text(self, text_content, destination_blob_name, if_generation_match=None):
+		"""
+		Uploads a text string as a file to the bucket.
 
-	def upload_text(self, text_content, destination_blob_name):
-		"""Uploads a text string as a file to the bucket."""
+		If if_generation_match is given the upload only succeeds if the blob is still
+		at that generation (0 means it must not exist yet); otherwise
+		google.api_core.exceptions.PreconditionFailed is raised.
+		"""
 		blob = self.bucket.blob(destination_blob_name)
-		blob.upload_from_string(text_content, content_type="text/plain")
+		blob.upload_from_string(text_content, content_type="text/plain", if_generation_match=if_generation_match, timeout=self._timeout())
 		return f"Text uploaded to {destination_blob_name}."
 
-	def download_text(self, source_blob_name):
-		"""Downloads a text file from the bucket and returns its content."""		
+	@bounded
+	def replace_text(self, text_content, destination_blob_name, if_generation_match):
+		"""
+		Replaces a blob's content if it is still at generation if_generation_match,
+		otherwise google.api_core.exceptions.PreconditionFailed is raised.
+
+		Returns:
+			The new generation of the blob
+		"""
+		blob = self.bucket.blob(destination_blob_name)
+		blob.upload_from_string(text_content, content_type="text/plain", if_generation_match=if_generation_match, timeout=self._timeout())
+		return blob.generation
+
+	@bounded
+	def append_text(self, text_content, destination_blob_name, if_generation_match):
+		"""
+		Appends text to a blob server side, without re-uploading the existing content.
+
+		The text is uploaded as a temporary part and composed onto the end of the
+		blob. The blob must be at generation if_generation_match (0 creates it),
+		otherwise google.api_core.exceptions.PreconditionFailed is raised.
+
+		Returns:
+			The new generation of the blob
+		"""
+		blob = self.bucket.blob(destination_blob_name)
+		if if_generation_match == 0:
+			blob.upload_from_string(text_content, content_type="text/plain", if_generation_match=0, timeout=self._timeout())
+			return blob.generation
+
+		part = self.bucket.blob(f"{destination_blob_name}.append-{uuid.uuid4().hex}")
+		part.upload_from_string(text_content, content_type="text/plain", timeout=self._timeout())
+		try:
+			blob.content_type = "text/plain"
+			blob.compose([self.bucket.blob(destination_blob_name), part], if_generation_match=if_generation_match, timeout=self._timeout())
+		finally:
+			part.delete(timeout=DEFAULT_TIMEOUT)
+		return blob.generation
+
+	@bounded
+	def download_text(self, source_blob_name, generation=None):
+		"""
+		Downloads a text file from the bucket and returns its content.
+
+		If a generation is given, that exact version is downloaded and None is
+		returned if it no longer exists.
+		"""
+		if generation is not None:
+			blob = self.bucket.blob(source_blob_name, generation=generation)
+			try:
+				return blob.download_as_text(timeout=self._timeout())
+			except NotFound:
+				return None
 		blob = self.bucket.blob(source_blob_name)
-		if not blob.exists():
+		if not blob.exists(timeout=self._timeout()):
+			return None
+		return blob.download_as_text(timeout=self._timeout())
+
+	def get_generation(self, source_blob_name):
+		"""Returns the current generation of a blob from its metadata, or None if it does not exist."""
+		info = self.get_info(source_blob_name)
+		return info["generation"] if info else None
+
+	@bounded
+	def get_info(self, source_blob_name):
+		"""Returns the generation and size in bytes of a blob, or None if it does not exist."""
+		blob = self.bucket.get_blob(source_blob_name, timeout=self._timeout())
+		if blob is None:
+			return None
+		return {"generation": blob.generation, "size": blob.size}
+
+	@bounded
+	def download_range(self, source_blob_name, start, end=None, generation=None):
+		"""
+		Downloads bytes [start, end] (end inclusive, defaults to the end of the blob).
+
+		Returns None if the blob, or the requested generation of it, does not exist.
+		"""
+		blob = self.bucket.blob(source_blob_name, generation=generation)
+		try:
+			return blob.download_as_bytes(start=start, end=end, timeout=self._timeout())
+		except NotFound:
 			return None
-		return blob.download_as_text()
 
+	@bounded
 	def list_files(self):
 		"""Lists all files in the bucket."""
-		return [blob.name for blob in self.bucket.list_blobs()]
+		return [blob.name for blob in self.bucket.list_blobs(timeout=self._timeout())]
 
+	@bounded
 	def delete_file(self, blob_name):
 		"""Deletes a file from the bucket."""
 		blob = self.bucket.blob(blob_name)
-		blob.delete()
+		blob.delete(timeout=self._timeout())
 		return f"Blob {blob_name} deleted."
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+
+
+class CachedUser(UserMixin):
+    """
+    Lightweight, detached stand-in for a Patient or Doctor row.
+
+    Exposes the same ID attribute as the model it was built from
+    (patient_id or doctor_id), so code checking hasattr(current_user, 'doctor_id')
+    keeps working.
+    """
+
+    def __init__(self, role, user_id, email=None, full_name=None):
+        self.role = role
+        self.email = email
+        self.full_name = full_name
+        self._user_id = user_id
+        setattr(self, f"{role}_id", user_id)
+
+    def get_id(self):
+        return self._user_id
+
+    @classmethod
+    def from_model(cls, role, user):
+        return cls(role, user.get_id(), email=user.email, full_name=user.full_name)
+
+
+class IdentityCache:
+    """Per-process TTL and size bounded cache of logged in users, keyed by (role, user ID)."""
+
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, ttl, max_size):
+        with self._lock:
+            self.ttl = ttl
+            self.max_size = max_size
+            self._entries.clear()
+
+    def get(self, role, user_id):
+        """Return the cached user, or None if missing or expired."""
+        key = (role, str(user_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def put(self, role, user):
+        """Cache a Patient or Doctor model as a CachedUser and return the cached object."""
+        cached = CachedUser.from_model(role, user)
+        if self.ttl <= 0 or self.max_size <= 0:
+            return cached
+        key = (role, str(cached.get_id()))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, cached)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, role, user_id):
+        with self._lock:
+            self._entries.pop((role, str(user_id)), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+identity_cache = IdentityCache()
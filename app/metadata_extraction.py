@@ -0,0 +1,192 @@
+import json
+import logging
+import re
+from flask import current_app
+from google.api_core.exceptions import PreconditionFailed
+from app.models.patient import Patient
+from app.ai_services.schemas import METADATA_SCHEMA
+from app.ai_services.structured_output import structured_output, StructuredOutputError
+from app.chat_history_store import parse_messages, HistoryFormatError
+from app.conversation_summary import model_context, format_turns
+from app.metrics import counter
+from app.watermarked_state import WatermarkedState
+
+SYSTEM_INSTRUCTION = (
+    "You are a medical analysis AI. Analyze the patient conversation with chatbot and extract key information. "
+    "Include the patient's risk level (High/Medium/Low), medical condition, age (if mentioned), "
+    "and last visit date in YYYY-MM-DD format (if mentioned)."
+)
+
+METADATA_EXTRACTIONS = counter(
+    "metadata_extractions_total",
+    "Metadata extraction runs after a history change, by what was sent to the model",
+    ("outcome",)
+)
+
+# Patient turns without any of these are small talk as far as the metadata is concerned
+CLINICAL_TERMS = re.compile(
+    r"\d|"
+    r"\b(pain|ache|hurt|sore|fever|cough|nause|vomit|diarr|dizz|faint|breath|chest|blood|bleed|rash|swell|"
+    r"itch|tired|fatigue|weak|numb|headache|migraine|sleep|insomnia|anxi|depress|stress|symptom|"
+    r"sick|ill|infect|allerg|asthma|diabet|pressure|heart|cancer|tumou?r|pregnan|injur|broke|fractur|"
+    r"medic|drug|pill|dose|mg|prescri|treat|therap|surgery|operation|hospital|clinic|doctor|"
+    r"diagnos|condition|disease|disorder|test|scan|x-?ray|result|visit|appointment|"
+    r"age|old|born|birthday|years?|months?|weeks?|days?|yesterday|today|ago|since)",
+    re.IGNORECASE
+)
+
+
+def has_clinical_content(messages):
+    """Cheap local check whether new turns could change Risk, Condition, Age or LastVisit."""
+    return any(
+        message["type"] == "user" and CLINICAL_TERMS.search(message["content"])
+        for message in messages
+    )
+
+
+class ExtractionState(WatermarkedState):
+    """
+    How far a patient's history has been analysed for metadata, stored as
+    JSON at {patient_id}/metadata_extraction.json. A rewritten history or a
+    new metadata profile version triggers a full extraction again.
+    """
+
+    def __init__(self, gcs_service):
+        super().__init__(gcs_service, "metadata_extraction.json", "patient_metadata")
+
+    def mark_analysed(self, patient_id, messages, generation):
+        """Record that messages were analysed, unless another run recorded progress first."""
+        try:
+            self.save(patient_id, self.stamp(messages), generation)
+        except PreconditionFailed:
+            logging.info(f"Metadata extraction state for {patient_id} changed concurrently")
+
+
+def current_metadata(patient_id):
+    """The patient's stored values for the extracted metadata fields."""
+    patient = Patient.query.get(patient_id)
+    metadata = patient.patient_metadata if patient is not None else None
+    if not isinstance(metadata, dict):
+        return {}
+    return {key: metadata[key] for key in METADATA_SCHEMA["properties"] if metadata.get(key) is not None}
+
+
+def extract_patient_metadata(ai_service, patient_id, chat_content):
+    """
+    Extract Risk, Condition, Age and LastVisit from a patient's chat history
+    and merge them into the patient's metadata.
+
+    Args:
+        ai_service (AIService): The AI service used for the extraction
+        patient_id (str): The ID of the patient
+        chat_content (str): The chat history content
+    """
+    # Format message for the AI service
+    prompt = (
+        f"Analyze this patient conversation and extract key medical information:\n\n"
+        f"{chat_content}"
+    )
+    run_extraction(ai_service, patient_id, prompt)
+
+
+def extract_metadata_incrementally(ai_service, gcs_service, patient_id, history_text):
+    """
+    Update a patient's metadata after their history changed, analysing only
+    what is new since the last extraction.
+
+    New turns without clinical content are skipped without a model call and
+    stay unanalysed, so they are sent along with the next turns that do have
+    clinical content. Otherwise only the new turns are sent, together with the current
+    metadata. The full (summarized) history is analysed when there is no
+    usable extraction state, e.g. for a patient's first history or after the
+    history was rewritten.
+
+    Args:
+        ai_service (AIService): The AI service used for the extraction
+        gcs_service (GCSService): The patient storage holding the history
+        patient_id (str): The ID of the patient
+        history_text (str): The chat history content after the change
+    """
+    try:
+        messages, _ = parse_messages(history_text)
+    except HistoryFormatError:
+        # Not a list of messages; nothing to track offsets in
+        METADATA_EXTRACTIONS.inc(outcome="full")
+        extract_patient_metadata(ai_service, patient_id, history_text)
+        return
+
+    state_store = ExtractionState(gcs_service)
+    state, generation = state_store.load(patient_id)
+    watermark = state_store.watermark(state, messages)
+    new_messages = messages[watermark:]
+    if not new_messages:
+        METADATA_EXTRACTIONS.inc(outcome="unchanged")
+        return
+
+    metadata = current_metadata(patient_id) if watermark else {}
+    skip_small_talk = current_app.config.get("METADATA_SKIP_NONCLINICAL", True)
+    if watermark and skip_small_talk and not has_clinical_content(new_messages):
+        # The watermark stays put: a missed term must not hide these turns for good
+        METADATA_EXTRACTIONS.inc(outcome="skipped")
+        return
+
+    if watermark and metadata:
+        METADATA_EXTRACTIONS.inc(outcome="incremental")
+        prompt = (
+            f"Current metadata for this patient:\n{json.dumps(metadata, ensure_ascii=False)}\n\n"
+            f"New turns of the patient's conversation:\n{format_turns(new_messages)}\n\n"
+            f"Return the complete metadata, updated with anything the new turns change."
+        )
+        updated = run_extraction(ai_service, patient_id, prompt)
+    else:
+        METADATA_EXTRACTIONS.inc(outcome="full")
+        prompt = (
+            f"Analyze this patient conversation and extract key medical information:\n\n"
+            f"{model_context(gcs_service, patient_id, history_text)}"
+        )
+        updated = run_extraction(ai_service, patient_id, prompt)
+
+    if updated is not None:
+        state_store.mark_analysed(patient_id, messages, generation)
+
+
+def run_extraction(ai_service, patient_id, prompt):
+    """
+    Ask the model for the metadata and merge a valid answer into the patient's metadata.
+
+    Returns:
+        The metadata the model returned, or None if no valid metadata could be obtained
+    """
+    messages = [{"type": "user", "content": prompt}]
+
+    # Call the AI service with the metadata profile (METADATA_SCHEMA)
+    ai_response = ai_service.generate_response(
+        messages,
+        SYSTEM_INSTRUCTION,
+        profile="patient_metadata"
+    )
+
+    # Repair and validate the response, regenerating only invalid required fields
+    try:
+        parsed_response = structured_output(
+            "patient_metadata",
+            ai_response,
+            regenerate=lambda instructions, schema: ai_service.generate_response(
+                messages + [
+                    {"type": "assistant", "content": ai_response},
+                    {"type": "user", "content": instructions}
+                ],
+                SYSTEM_INSTRUCTION,
+                response_mime_type="application/json",
+                response_schema=schema
+            )
+        )
+    except StructuredOutputError as e:
+        logging.error(f"Could not get valid metadata from AI response: {str(e)} {e.errors}")
+        return None
+
+    # Merge the AI analysis into the patient metadata in a single statement
+    merged = Patient.merge_metadata(patient_id, parsed_response)
+    if merged is not None:
+        logging.info(f"Updated metadata for patient {patient_id}")
+    return parsed_response
@@ -0,0 +1,175 @@
+import hmac
+import ipaddress
+import logging
+import os
+import threading
+import time
+from flask import Blueprint, Response, current_app, request
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, REGISTRY as DEFAULT_REGISTRY, generate_latest
+from prometheus_client import Counter as PrometheusCounter, Gauge as PrometheusGauge, Histogram as PrometheusHistogram
+from prometheus_client import multiprocess
+
+metrics = Blueprint("metrics", __name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Under gunicorn every worker writes its samples to this directory and a
+# scrape of any worker reports the aggregate of all of them
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+class _Metric:
+    """A prometheus_client metric called with labels as keyword arguments."""
+
+    def __init__(self, metric, label_names):
+        self.metric = metric
+        self.label_names = tuple(label_names)
+
+    def _child(self, labels):
+        if not self.label_names:
+            return self.metric
+        return self.metric.labels(*(str(labels.get(name, "")) for name in self.label_names))
+
+
+class Counter(_Metric):
+    def inc(self, amount=1, **labels):
+        self._child(labels).inc(amount)
+
+
+class Gauge(_Metric):
+    def __init__(self, metric, label_names):
+        super().__init__(metric, label_names)
+        self._callbacks = []
+
+    def set(self, value, **labels):
+        self._child(labels).set(value)
+
+    def inc(self, amount=1, **labels):
+        self._child(labels).inc(amount)
+
+    def dec(self, amount=1, **labels):
+        self._child(labels).dec(amount)
+
+    def set_function(self, callback):
+        """
+        Register a callback that reports process state, e.g. breaker states.
+
+        The callback returns a list of (labels dict, value) pairs. It is
+        evaluated before every scrape and, in multiprocess mode, periodically
+        in every worker, so that the aggregate includes workers that were
+        not scraped.
+        """
+        self._callbacks.append(callback)
+
+    def refresh(self):
+        for callback in list(self._callbacks):
+            for labels, value in callback():
+                self.set(value, **labels)
+
+
+class Histogram(_Metric):
+    def observe(self, value, **labels):
+        self._child(labels).observe(value)
+
+
+class Registry:
+    """The application's metrics, registered once by name with prometheus_client."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, factory, name, documentation, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(factory(name, documentation, tuple(label_names), **kwargs), label_names)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {type(metric).__name__}")
+            return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._get_or_create(Counter, PrometheusCounter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names=(), multiprocess_mode="all"):
+        """
+        multiprocess_mode says how workers' values are combined: "all" keeps one
+        series per worker (pid label), "livesum" adds up live workers, "max" takes the largest.
+        """
+        return self._get_or_create(Gauge, PrometheusGauge, name, documentation, label_names,
+                                   multiprocess_mode=multiprocess_mode)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, PrometheusHistogram, name, documentation, label_names, buckets=buckets)
+
+    def refresh(self):
+        """Evaluate the callbacks of all callback gauges."""
+        with self._lock:
+            gauges = [metric for metric in self._metrics.values() if isinstance(metric, Gauge)]
+        for gauge in gauges:
+            gauge.refresh()
+
+    def render(self):
+        self.refresh()
+        if MULTIPROCESS:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = DEFAULT_REGISTRY
+        return generate_latest(registry)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def _start_refresher(interval):
+    """Refresh this worker's callback gauges in the background, once per process."""
+    global _refresher_pid
+    with _refresher_lock:
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                REGISTRY.refresh()
+            except Exception as e:
+                logging.warning(f"Could not refresh metrics: {str(e)}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+@metrics.before_app_request
+def start_refresher():
+    if MULTIPROCESS:
+        _start_refresher(current_app.config.get("METRICS_REFRESH_INTERVAL", 15))
+
+
+def scrape_allowed():
+    """
+    With METRICS_TOKEN set a scrape must send it as a bearer token; without
+    one only scrapers on the same host (loopback) are answered.
+    """
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    try:
+        return ipaddress.ip_address(request.remote_addr or "").is_loopback
+    except ValueError:
+        return False
+
+
+@metrics.route("/metrics")
+def export_metrics():
+    """Expose the metrics of all workers in the Prometheus text format."""
+    if not scrape_allowed():
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,71 @@
+from app import db
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
+
+class AIResult(db.Model):
+	"""
+	A generated SOAP note or differential diagnosis, kept for reads and audits.
+
+	Each row records who asked for it (doctor_id), which output format produced
+	it (profile, e.g. "soap@v1") and which chat history it was generated from
+	(history_hash), so results are never overwritten, only superseded.
+	"""
+	__tablename__ = "ai_result"
+	__table_args__ = (
+		# Supports reading the latest result of a kind for a patient, by default
+		# the one generated for the requesting doctor
+		db.Index("ix_ai_result_patient_latest", "patient_id", "method_type", "profile", "doctor_id", "created_at"),
+	)
+
+	result_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+	patient_id = db.Column(db.Integer, db.ForeignKey("patient.patient_id", ondelete="CASCADE"), nullable=False)
+	doctor_id = db.Column(db.Integer, db.ForeignKey("doctor.doctor_id", ondelete="SET NULL"), nullable=True)
+	method_type = db.Column(db.String(20), nullable=False)
+	profile = db.Column(db.String(50), nullable=False)
+	history_hash = db.Column(db.String(64), nullable=False)
+	content = db.Column(JSONB, nullable=False)
+	created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+	@classmethod
+	def record(cls, patient_id, doctor_id, method_type, profile, history_hash, content):
+		"""Store a newly generated result and return it."""
+		result = cls(
+			patient_id=patient_id,
+			doctor_id=doctor_id,
+			method_type=method_type,
+			profile=profile,
+			history_hash=history_hash,
+			content=content
+		)
+		db.session.add(result)
+		db.session.commit()
+		return result
+
+	@classmethod
+	def latest(cls, patient_id, method_type, profile, doctor_id=None):
+		"""
+		The most recent result of a kind for a patient in the given output format.
+
+		Args:
+			patient_id: The ID of the patient
+			method_type: "soap" or "dvx"
+			profile: Generation profile tag the result must have been produced with
+			doctor_id: Only consider results generated for this doctor
+
+		Returns:
+			The AIResult, or None if there is none
+		"""
+		query = cls.query.filter_by(patient_id=patient_id, method_type=method_type, profile=profile)
+		if doctor_id is not None:
+			query = query.filter_by(doctor_id=doctor_id)
+		return query.order_by(cls.created_at.desc(), cls.result_id.desc()).first()
+
+	def to_dict(self):
+		"""Convert the result to a dictionary for API responses"""
+		return {
+			'content': self.content,
+			'doctor_id': self.doctor_id,
+			'profile': self.profile,
+			'history_hash': self.history_hash,
+			'generated_at': self.created_at.isoformat() if self.created_at else None
+		}
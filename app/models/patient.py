@@ -1,18 +1,122 @@
 from app import db
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import case, cast, func, literal, text, bindparam, Numeric
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql.expression import Grouping
 
 class Patient(UserMixin, db.Model):
 	__tablename__ = "patient"
+	__table_args__ = (
+		# Supports keyset pagination of the patient listing by (updated_at, patient_id)
+		db.Index("ix_patient_updated_at_patient_id", "updated_at", "patient_id"),
+		# Supports containment filters on AI extracted metadata, e.g. {"Risk": "High"}
+		db.Index("ix_patient_metadata_gin", "patient_metadata",
+			postgresql_using="gin", postgresql_ops={"patient_metadata": "jsonb_path_ops"}),
+	)
 
 	patient_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 	email = db.Column(db.String(255), unique=True, nullable=False)
 	full_name = db.Column(db.String(255), nullable=True)
 	sso_provider = db.Column(db.String(50), nullable=True)
 	sso_user_id = db.Column(db.String(255), unique=True, nullable=True)
-	patient_metadata = db.Column(db.JSON, nullable=True)
+	patient_metadata = db.Column(JSONB, nullable=True)
 	created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 	updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 	
 	def get_id(self):
-		return self.patient_id
\ No newline at end of file
+		return self.patient_id
+
+	@classmethod
+	def merge_metadata(cls, patient_id, metadata):
+		"""
+		Merge a metadata patch into a patient's metadata in a single UPDATE ... RETURNING.
+
+		The merge happens in Postgres with the JSONB || operator, so concurrent
+		writers never overwrite each other's keys with a stale copy of the document.
+
+		Args:
+			patient_id: The ID of the patient
+			metadata (dict): Keys to add or replace in patient_metadata
+
+		Returns:
+			The merged metadata, or None if the patient does not exist
+		"""
+		patch = literal(metadata, JSONB)
+		stmt = (
+			db.update(cls)
+			.where(cls.patient_id == patient_id)
+			.values(
+				patient_metadata=case(
+					(func.jsonb_typeof(cls.patient_metadata) == "object", cls.patient_metadata.op("||")(patch)),
+					else_=patch
+				),
+				updated_at=datetime.utcnow()
+			)
+			.returning(cls.patient_metadata)
+		)
+		merged = db.session.execute(stmt).scalar_one_or_none()
+		db.session.commit()
+		return merged
+
+	@classmethod
+	def bulk_merge_metadata(cls, patches):
+		"""
+		Merge metadata patches for many patients in one statement, e.g. for backfills.
+
+		Args:
+			patches (dict): Mapping of patient ID to the metadata patch for that patient
+
+		Returns:
+			dict: Mapping of patient ID to merged metadata for every patient that was updated
+		"""
+		if not patches:
+			return {}
+		stmt = text(
+			"UPDATE patient SET "
+			"patient_metadata = CASE WHEN jsonb_typeof(patient.patient_metadata) = 'object' "
+			"THEN patient.patient_metadata || patches.value ELSE patches.value END, "
+			"updated_at = :updated_at "
+			"FROM jsonb_each(:patches) AS patches "
+			"WHERE patient.patient_id = patches.key::integer "
+			"RETURNING patient.patient_id, patient.patient_metadata"
+		).bindparams(
+			bindparam("patches", type_=JSONB),
+			bindparam("updated_at")
+		)
+		rows = db.session.execute(stmt, {
+			"patches": {str(patient_id): patch for patient_id, patch in patches.items()},
+			"updated_at": datetime.utcnow()
+		}).all()
+		db.session.commit()
+		return {row.patient_id: row.patient_metadata for row in rows}
+
+# Sort keys of the patient listing on AI extracted metadata. Each is indexed
+# together with patient_id for keyset pagination; Postgres only uses an
+# expression index for a query that spells the expression the same way, so
+# the listing must sort on these exact expressions.
+
+# Ranked so that sorting by risk puts High first when descending.
+# Patients without an extracted risk rank below Low.
+RISK_RANK = case(
+	{"High": 3, "Medium": 2, "Low": 1},
+	value=Patient.patient_metadata["Risk"].astext,
+	else_=0
+)
+
+# Only numeric ages are compared; anything else the model produced sorts as missing.
+AGE = case(
+	(func.jsonb_typeof(Patient.patient_metadata.op("->")("Age")) == "number",
+	 cast(Patient.patient_metadata["Age"].astext, Numeric)),
+	else_=None
+)
+AGE_SORT = func.coalesce(AGE, -1)
+
+# LastVisit is stored as YYYY-MM-DD so lexical order is date order
+LAST_VISIT = Patient.patient_metadata["LastVisit"].astext
+LAST_VISIT_SORT = func.coalesce(LAST_VISIT, "")
+
+# A CASE is not a function call, so it must be parenthesized to be indexed
+db.Index("ix_patient_risk_rank_patient_id", Grouping(RISK_RANK), Patient.patient_id)
+db.Index("ix_patient_age_patient_id", AGE_SORT, Patient.patient_id)
+db.Index("ix_patient_last_visit_patient_id", LAST_VISIT_SORT, Patient.patient_id)
\ No newline at end of file
@@ -0,0 +1,64 @@
+from datetime import datetime
+from sqlalchemy import and_, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+
+def upsert_sso_user(model, email, full_name, sso_provider, sso_user_id):
+	"""
+	Create or link an SSO user in a single INSERT ... ON CONFLICT ... RETURNING.
+
+	Works for any model with email, full_name, sso_provider, sso_user_id and
+	updated_at columns (Patient and Doctor). An existing row with the same email
+	is linked to the SSO identity; its name is only filled in if missing. A row
+	that is already linked and named is left untouched, so a repeat login does
+	not move updated_at (which orders the patient listing and feeds ETags).
+
+	Args:
+		model: The user model class
+		email: Email from the identity provider
+		full_name: Display name from the identity provider
+		sso_provider: Name of the identity provider, e.g. "Google"
+		sso_user_id: Subject identifier from the identity provider
+
+	Returns:
+		The persisted user instance
+	"""
+	now = datetime.utcnow()
+	stmt = insert(model).values(
+		email=email,
+		full_name=full_name,
+		sso_provider=sso_provider,
+		sso_user_id=sso_user_id,
+		updated_at=now
+	)
+	stmt = stmt.on_conflict_do_update(
+		index_elements=[model.email],
+		set_={
+			"sso_provider": stmt.excluded.sso_provider,
+			"sso_user_id": stmt.excluded.sso_user_id,
+			"full_name": db.func.coalesce(model.full_name, stmt.excluded.full_name),
+			"updated_at": now
+		},
+		where=or_(
+			model.sso_provider.is_distinct_from(stmt.excluded.sso_provider),
+			model.sso_user_id.is_distinct_from(stmt.excluded.sso_user_id),
+			and_(model.full_name.is_(None), stmt.excluded.full_name.isnot(None))
+		)
+	).returning(model)
+
+	try:
+		user = db.session.scalars(stmt, execution_options={"populate_existing": True}).one_or_none()
+		db.session.commit()
+		if user is None:
+			# Nothing changed, so the conflicting row was not updated or returned
+			user = db.session.scalars(select(model).filter_by(email=email)).one()
+		return user
+	except IntegrityError:
+		# The SSO identity is already linked to a row with a different email,
+		# e.g. after the email changed at the provider.
+		db.session.rollback()
+		user = db.session.scalars(select(model).filter_by(sso_user_id=sso_user_id)).first()
+		if user is None:
+			raise
+		return user
@@ -1,6 +1,7 @@
 from authlib.integrations.flask_client import OAuth
 from flask import session
 from app.config import Config
+from app.oauth_cache import OIDCMetadataCache
 
 oauth = OAuth()
 google = oauth.register(
@@ -13,3 +14,11 @@ google = oauth.register(
 
 def init_oauth(app):
     oauth.init_app(app)
+
+    # Serve Google's discovery document and signing keys from a cache shared by all workers
+    metadata_cache = OIDCMetadataCache(
+        Config.GOOGLE_DISCOVERY_URL,
+        app.config["OAUTH_METADATA_CACHE_PATH"],
+        ttl=app.config["OAUTH_METADATA_CACHE_TTL"]
+    )
+    metadata_cache.attach(oauth.create_client("google"))
@@ -0,0 +1,113 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import requests
+
+
+class OIDCMetadataCache:
+    """
+    Disk-backed cache of an OpenID provider's discovery document and JWKS.
+
+    The cache file is shared by every worker on the host. Whichever worker finds
+    it missing or older than half the TTL refreshes it under an exclusive file
+    lock, and every worker seeds its authlib client from the file, so ID token
+    validation does not fetch provider metadata on the request path.
+    """
+
+    def __init__(self, discovery_url, path, ttl=3600, fetch_timeout=5):
+        self.discovery_url = discovery_url
+        self.path = path
+        self.ttl = ttl
+        self.fetch_timeout = fetch_timeout
+        self._thread = None
+
+    def load(self):
+        """Return the cached document, or None if the file is missing or unreadable."""
+        try:
+            with open(self.path, "r") as f:
+                doc = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not all(key in doc for key in ("fetched_at", "metadata", "jwks")):
+            return None
+        return doc
+
+    def age(self, doc):
+        return time.time() - doc["fetched_at"]
+
+    def fetch(self):
+        """Fetch the discovery document and the JWKS it points to."""
+        resp = requests.get(self.discovery_url, timeout=self.fetch_timeout)
+        resp.raise_for_status()
+        metadata = resp.json()
+
+        resp = requests.get(metadata["jwks_uri"], timeout=self.fetch_timeout)
+        resp.raise_for_status()
+        jwks = resp.json()
+
+        return {"fetched_at": time.time(), "metadata": metadata, "jwks": jwks}
+
+    def refresh(self, max_age=None):
+        """
+        Refresh the cache file if it is older than max_age (defaults to half the TTL).
+
+        Returns:
+            The current document, or None if none could be loaded or fetched
+        """
+        max_age = self.ttl / 2 if max_age is None else max_age
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another worker may have refreshed while we waited for the lock
+                doc = self.load()
+                if doc is not None and self.age(doc) < max_age:
+                    return doc
+                try:
+                    fresh = self.fetch()
+                except Exception as e:
+                    logging.error(f"Failed to refresh OpenID metadata from {self.discovery_url}: {str(e)}")
+                    return doc
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(fresh, f)
+                os.replace(tmp_path, self.path)
+                return fresh
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def apply(self, client, doc):
+        """Seed an authlib client so load_server_metadata and fetch_jwk_set use the cached copy."""
+        client.server_metadata.update(doc["metadata"])
+        client.server_metadata["jwks"] = doc["jwks"]
+        client.server_metadata["_loaded_at"] = doc["fetched_at"]
+
+    def attach(self, client):
+        """Seed a client from the cache now and keep it fresh from a background thread."""
+        doc = self.load()
+        if doc is None or self.age(doc) >= self.ttl:
+            doc = self.refresh()
+        if doc is not None:
+            self.apply(client, doc)
+        else:
+            logging.warning("No cached OpenID metadata available; it will be fetched on first login")
+
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._refresh_loop, args=(client,), name="oidc-metadata-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def _refresh_loop(self, client):
+        interval = max(min(self.ttl / 4, 300), 1)
+        while True:
+            time.sleep(interval)
+            try:
+                doc = self.refresh()
+                if doc is not None and doc["fetched_at"] > client.server_metadata.get("_loaded_at", 0):
+                    self.apply(client, doc)
+            except Exception as e:
+                logging.error(f"OpenID metadata refresh failed: {str(e)}")
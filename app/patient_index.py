@@ -0,0 +1,330 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.ai_services.embeddings import get_embedder
+from app.background import run_in_background
+from app.conversation_summary import model_context
+from app.gcs_service import GCSService
+from app.metrics import counter, histogram
+
+PATIENT_INDEX_UPSERTS = counter(
+    "patient_index_upserts_total",
+    "Patient embeddings written to the similar-patient index, by outcome",
+    ("outcome",)
+)
+PATIENT_INDEX_SEARCH_SECONDS = histogram(
+    "patient_index_search_seconds",
+    "Time to run a top-k search over the similar-patient index",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+EMPTY = -1
+
+
+class PatientIndex:
+    """
+    Embeddings of patient conversations for similar-patient search.
+
+    The vectors are one contiguous float32 matrix in vectors.npy, with the
+    patient ID of each row in ids.npy (-1 for a free row); both are memory
+    mapped, so the index is shared by every worker on the node through the
+    page cache and survives restarts. Upserts overwrite a patient's row in
+    place, under a file lock; when the matrix is full it is copied into one
+    twice the size and swapped in with a rename, which other processes pick
+    up on their next search.
+
+    Searches are batched matrix products over blocks of batch_rows rows,
+    keeping the running top k per query, so memory stays bounded however
+    many patients there are.
+
+    The directory must be on a filesystem with working fcntl locks that
+    every process writing or searching the index mounts, e.g. a local disk
+    shared by the workers of one instance or one persistent volume mounted
+    into all instances. Instances with separate directories have separate
+    indexes, each of which needs its own backfill.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, directory, dimensions, batch_rows=65536):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.batch_rows = batch_rows
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.ids_path = os.path.join(directory, "ids.npy")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._vectors = None
+        self._ids = None
+        self._mapped = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Map the files on disk, again if they were replaced since they were last mapped."""
+        try:
+            current = (os.stat(self.vectors_path).st_ino, os.stat(self.ids_path).st_ino)
+        except FileNotFoundError:
+            self._vectors, self._ids, self._mapped = None, None, None
+            return
+        if current == self._mapped:
+            return
+        vectors = np.load(self.vectors_path, mmap_mode="r+")
+        ids = np.load(self.ids_path, mmap_mode="r+")
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimensions:
+            # Written with another embedder; rebuilt by the next upserts
+            logging.warning(f"Ignoring similar-patient index with shape {vectors.shape}, expected {self.dimensions} dimensions")
+            self._vectors, self._ids, self._mapped = None, None, None
+            return
+        self._vectors, self._ids, self._mapped = vectors, ids, current
+
+    def _resize(self, capacity):
+        """Write matrix and ID files of the given capacity holding the current rows, and swap them in."""
+        vectors = np.lib.format.open_memmap(self.vectors_path + ".tmp", mode="w+", dtype=np.float32,
+                                            shape=(capacity, self.dimensions))
+        ids = np.lib.format.open_memmap(self.ids_path + ".tmp", mode="w+", dtype=np.int64, shape=(capacity,))
+        ids[:] = EMPTY
+        if self._ids is not None:
+            rows = min(len(self._ids), self._vectors.shape[0])
+            vectors[:rows] = self._vectors[:rows]
+            ids[:rows] = self._ids[:rows]
+        vectors.flush()
+        ids.flush()
+        del vectors, ids
+        # Readers only use as many rows as ids.npy has, so the larger matrix goes in first
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.ids_path + ".tmp", self.ids_path)
+        self._refresh()
+
+    def upsert(self, patient_id, vector):
+        """Store or replace a patient's embedding."""
+        self.upsert_many([patient_id], [vector])
+
+    def upsert_many(self, patient_ids, vectors):
+        """Store or replace the embeddings of several patients under one lock and flush."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(patient_ids), -1)
+        if vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Expected vectors of {self.dimensions} dimensions, got {vectors.shape[1]}")
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._ids is None:
+                self._resize(self.INITIAL_CAPACITY)
+            for patient_id, vector in zip(patient_ids, vectors):
+                rows = np.flatnonzero(self._ids == patient_id)
+                if rows.size:
+                    row = rows[0]
+                else:
+                    free = np.flatnonzero(self._ids == EMPTY)
+                    if not free.size:
+                        self._resize(len(self._ids) * 2)
+                        free = np.flatnonzero(self._ids == EMPTY)
+                    row = free[0]
+                # Vector before ID, so a concurrent search never sees a new ID with a stale vector
+                self._vectors[row] = vector
+                self._ids[row] = patient_id
+            self._vectors.flush()
+            self._ids.flush()
+
+    def remove_except(self, patient_ids):
+        """
+        Drop every patient not in patient_ids from the index.
+
+        Returns:
+            The number of patients removed
+        """
+        keep = np.asarray(list(patient_ids), dtype=np.int64)
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._ids is None:
+                return 0
+            stale = np.flatnonzero((self._ids != EMPTY) & ~np.isin(self._ids, keep))
+            self._ids[stale] = EMPTY
+            self._ids.flush()
+            return int(stale.size)
+
+    def _snapshot(self):
+        with self._lock:
+            self._refresh()
+            if self._ids is None:
+                return None, None
+            rows = min(len(self._ids), self._vectors.shape[0])
+            return self._vectors[:rows], self._ids[:rows]
+
+    def vector(self, patient_id):
+        """A patient's stored embedding, or None if the patient is not indexed."""
+        vectors, ids = self._snapshot()
+        if ids is None:
+            return None
+        rows = np.flatnonzero(ids == patient_id)
+        return np.array(vectors[rows[0]]) if rows.size else None
+
+    def search(self, queries, k, exclude=()):
+        """
+        Top-k cosine search for a batch of unit length query vectors.
+
+        Returns:
+            One list of (patient_id, score) per query, most similar first
+        """
+        started = time.monotonic()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        vectors, ids = self._snapshot()
+        if ids is None or k <= 0:
+            return [[] for _ in queries]
+
+        excluded = np.asarray(list(exclude), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(ids), self.batch_rows):
+            block_ids = np.array(ids[start:start + self.batch_rows])
+            scores = queries @ vectors[start:start + self.batch_rows].T
+            scores[:, (block_ids == EMPTY) | np.isin(block_ids, excluded)] = -np.inf
+
+            scores = np.concatenate([best_scores, scores], axis=1)
+            candidates = np.concatenate([best_ids, np.broadcast_to(block_ids, (len(queries), len(block_ids)))], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                candidates = np.take_along_axis(candidates, top, axis=1)
+            best_scores, best_ids = scores, candidates
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        PATIENT_INDEX_SEARCH_SECONDS.observe(time.monotonic() - started)
+        return [
+            [(int(patient_id), float(score)) for patient_id, score in zip(row_ids, row_scores) if np.isfinite(score)]
+            for row_ids, row_scores in zip(best_ids, best_scores)
+        ]
+
+    def similar(self, patient_id, k):
+        """
+        The k patients most similar to an indexed patient.
+
+        Returns:
+            A list of (patient_id, score), or None if the patient is not indexed
+        """
+        vector = self.vector(patient_id)
+        if vector is None:
+            return None
+        return self.search(vector, k, exclude=[patient_id])[0]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_patient_index():
+    """The process-wide similar-patient index in PATIENT_INDEX_DIR."""
+    directory = current_app.config.get("PATIENT_INDEX_DIR", "instance/patient_index")
+    dimensions = current_app.config.get("EMBEDDING_DIMENSIONS", 256)
+    key = (directory, dimensions)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = PatientIndex(
+                directory, dimensions, current_app.config.get("PATIENT_INDEX_BATCH_ROWS", 65536)
+            )
+        return index
+
+
+def index_text(gcs_service, patient_id, history_text):
+    """The text a patient is indexed by: their summarized conversation, truncated to PATIENT_INDEX_MAX_CHARS."""
+    text = model_context(gcs_service, patient_id, history_text)
+    return text[:current_app.config.get("PATIENT_INDEX_MAX_CHARS", 8000)]
+
+
+def index_patient(gcs_service, patient_id, history_text):
+    """Embed a patient's summarized conversation and upsert it into the index."""
+    vector = get_embedder("SEMANTIC_SIMILARITY").embed([index_text(gcs_service, patient_id, history_text)])[0]
+    get_patient_index().upsert(int(patient_id), vector)
+
+
+def index_patient_in_background(patient_id, history_text):
+    """Update a patient's entry in the similar-patient index without delaying the response."""
+    try:
+        patient_id = int(patient_id)
+    except (TypeError, ValueError):
+        return
+
+    def run(history_text):
+        try:
+            index_patient(GCSService("patientstorage"), patient_id, history_text)
+            PATIENT_INDEX_UPSERTS.inc(outcome="success")
+        except Exception:
+            PATIENT_INDEX_UPSERTS.inc(outcome="error")
+            raise
+
+    run_in_background("patient_index", patient_id, run, history_text)
+
+
+patient_index_cli = AppGroup("patient-index", help="Manage the similar-patient index.")
+
+
+@patient_index_cli.command("backfill")
+@click.option("--batch-size", default=32, show_default=True, help="Patients embedded per model call.")
+@click.option("--prune", is_flag=True, help="Also remove patients that no longer exist or have no history.")
+def backfill_command(batch_size, prune):
+    """
+    Index every patient with a chat history, e.g. after deploying the index,
+    changing the embedder or losing the index directory. Patients already in
+    the index are re-embedded; chats during the backfill keep updating it.
+    """
+    from app.models.patient import Patient
+
+    gcs_service = GCSService("patientstorage")
+    embedder = get_embedder("SEMANTIC_SIMILARITY")
+    index = get_patient_index()
+    indexed = []
+    failed = 0
+
+    def flush(batch):
+        nonlocal failed
+        try:
+            vectors = embedder.embed([text for _, text in batch])
+            index.upsert_many([patient_id for patient_id, _ in batch], vectors)
+            indexed.extend(patient_id for patient_id, _ in batch)
+            PATIENT_INDEX_UPSERTS.inc(len(batch), outcome="success")
+        except Exception as e:
+            failed += len(batch)
+            PATIENT_INDEX_UPSERTS.inc(len(batch), outcome="error")
+            logging.error(f"Error indexing patients {batch[0][0]}-{batch[-1][0]}: {str(e)}")
+
+    batch = []
+    query = Patient.query.with_entities(Patient.patient_id).order_by(Patient.patient_id)
+    for (patient_id,) in query.yield_per(1000):
+        try:
+            history_text = gcs_service.download_text(f"{patient_id}/chat_history")
+        except Exception as e:
+            failed += 1
+            logging.error(f"Error reading the chat history of patient {patient_id}: {str(e)}")
+            continue
+        if not history_text:
+            continue
+        batch.append((patient_id, index_text(gcs_service, patient_id, history_text)))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    removed = index.remove_except(indexed) if prune and not failed else 0
+    if prune and failed:
+        click.echo("Not pruning, as some patients could not be indexed")
+    click.echo(f"Indexed {len(indexed)} patients, {failed} failed, {removed} removed")
@@ -1,11 +1,23 @@
 from flask_restful import Resource
 from flask import request, jsonify
 from flask_login import login_required, current_user
-from app.decorators import doctor_required
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
+from app.decorators import doctor_required, read_only
+from app import db
 from app.gcs_service import GCSService
 from app.ai_services import get_ai_service
+from app.ai_services.resilience import is_unavailable
+from app.ai_services.profiles import get_profile
+from app.ai_services.structured_output import structured_output
+from app.circuit_breaker import CircuitOpenError
+from app.deadline import DeadlineExceeded
+from app.result_cache import result_cache
+from app.conversation_summary import model_context
+from app.models.ai_result import AIResult
+from app.utils.etag import etag_headers, not_modified, row_etag
+from datetime import timezone
+import hashlib
 import logging
-import json
 
 class AIResource(Resource):
     PATIENT_GCS_BUCKET_NAME = "patientstorage"
@@ -14,7 +26,7 @@ class AIResource(Resource):
     def __init__(self, method_type='soap'):
         self.patient_gcs_service = GCSService(self.PATIENT_GCS_BUCKET_NAME)
         self.doctor_gcs_service = GCSService(self.DOCTOR_GCS_BUCKET_NAME)
-        self.ai_service = get_ai_service("medical_lm")
+        self.ai_service = get_ai_service("medical_lm", task=method_type)
         self.method_type = method_type  # Store the method type ('soap' or 'dvx')
     
     def get_soap_prompt(self, doctor_id):
@@ -35,6 +47,11 @@ class AIResource(Resource):
             soap_content = self.doctor_gcs_service.download_text(blob_name)
             
             return soap_content
+        except CircuitOpenError:
+            logging.warning("Doctor storage is unavailable, using the default SOAP prompt")
+            return None
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Error getting SOAP prompt from blob storage: {str(e)}")
             return None
@@ -57,6 +74,9 @@ class AIResource(Resource):
             chat_history = self.patient_gcs_service.download_text(blob_name)
             
             return chat_history
+        except HTTPException:
+            # Out of time or storage down: not the same as having no history
+            raise
         except Exception as e:
             logging.error(f"Error getting chat history from blob storage: {str(e)}")
             return None
@@ -79,10 +99,53 @@ class AIResource(Resource):
             dvx_content = self.doctor_gcs_service.download_text(blob_name)
             
             return dvx_content
+        except CircuitOpenError:
+            logging.warning("Doctor storage is unavailable, using the default DVX prompt")
+            return None
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Error getting DVX prompt from blob storage: {str(e)}")
             return None
     
+    @login_required
+    @doctor_required
+    @read_only
+    def get(self, patient_id=None):
+        """
+        Return the latest stored result of this endpoint's type for a patient,
+        in the current output format, without calling the model or reading storage.
+
+        Only results generated for the current doctor are considered, unless
+        ?doctor=any asks for the latest one generated for any doctor.
+        """
+        if self.method_type not in ('soap', 'dvx'):
+            return {"error": f"Unknown method type: {self.method_type}"}, 400
+
+        doctor = request.args.get("doctor")
+        if doctor == "any":
+            doctor_id = None
+        elif doctor is None:
+            doctor_id = current_user.doctor_id
+        else:
+            return {"error": "The doctor parameter only accepts 'any'"}, 400
+
+        try:
+            result = AIResult.latest(patient_id, self.method_type, get_profile(self.method_type).tag, doctor_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logging.error(f"Error reading stored {self.method_type} result: {str(e)}")
+            return {"error": f"Failed to read stored {self.method_type} result"}, 500
+        if result is None:
+            return {"error": f"No {self.method_type} result found for patient {patient_id}"}, 404
+
+        etag = row_etag(self.method_type, result.result_id, result.created_at)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        return result.to_dict(), 200, etag_headers(etag)
+
     @login_required
     @doctor_required
     def post(self, patient_id=None):
@@ -125,50 +188,35 @@ class AIResource(Resource):
                     "Provide a structured, professional medical SOAP note format."
                 )
             
-            # Create message with chat history
-            prompt = f"{chat_history}"
+            # Create message with the summarized chat history
+            prompt = model_context(self.patient_gcs_service, patient_id, chat_history)
             messages = [{"type": "user", "content": prompt}]
             
             # Log prompt and system instruction for debugging
             logging.info(f"System instruction for patient {patient_id}: {system_instruction}")
             logging.info(f"Prompt for patient {patient_id}: {prompt}")
 
-            # Define structured response schema for SOAP notes
-            response_schema = {
-                "type": "OBJECT",
-                "properties": {
-                    "subjective": {
-                        "type": "ARRAY",
-                        "items": {"type": "STRING"}
-                    },
-                    "objective": {
-                        "type": "ARRAY",
-                        "items": {"type": "STRING"}
-                    },
-                    "assessment": {
-                        "type": "ARRAY",
-                        "items": {"type": "STRING"}
-                    },
-                    "plan": {
-                        "type": "ARRAY",
-                        "items": {"type": "STRING"}
-                    }
-                },
-                "required": ["subjective", "objective", "assessment", "plan"]
-            }
-
             # Generate SOAP notes with the AI service
-            soap_notes = self.ai_service.generate_response(
-                messages,
-                system_instruction,
-                response_mime_type="application/json",
-                response_schema=response_schema
-            )
+            try:
+                soap_notes = self.ai_service.generate_response(
+                    messages,
+                    system_instruction,
+                    profile=self.method_type
+                )
+            except Exception as e:
+                if not is_unavailable(e):
+                    raise
+                return self.cached_result(patient_id, doctor_id)
             
+            content = self.parse_result(soap_notes, messages, system_instruction)
+            result_cache.put(self.result_key(patient_id, doctor_id), content)
+            self.store_result(patient_id, doctor_id, chat_history, content)
             return {
-                "content": json.loads(soap_notes),
+                "content": content,
             }, 201
             
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"Error generating SOAP notes: {str(e)}")
             return {"error": "Failed to generate SOAP notes"}, 500
@@ -201,61 +249,99 @@ class AIResource(Resource):
                     "risk levels, confidence percentages, and recommended next steps for each condition."
                 )
             
-            # Create message with chat history
-            prompt = f"{chat_history}"
+            # Create message with the summarized chat history
+            prompt = model_context(self.patient_gcs_service, patient_id, chat_history)
             messages = [{"type": "user", "content": prompt}]
             
-            # Define structured response schema for differential diagnosis
-            response_schema = {
-                "type": "ARRAY",
-                "items": {
-                    "type": "OBJECT",
-                    "required": [
-                        "condition",
-                        "risk",
-                        "confidence",
-                        "steps"
-                    ],
-                    "properties": {
-                        "condition": {
-                            "type": "STRING"
-                        },
-                        "risk": {
-                            "type": "STRING",
-                            "enum": [
-                                "Low",
-                                "Moderate",
-                                "Critical"
-                            ]
-                        },
-                        "confidence": {
-                            "type": "INTEGER",
-                            "minimum": 0,
-                            "maximum": 100
-                        },
-                        "steps": {
-                            "type": "STRING"
-                        }
-                    }
-                }
-            }
-            
             # Log prompt and system instruction for debugging
             logging.info(f"DVX System instruction for patient {patient_id}: {system_instruction}")
             logging.info(f"DVX Prompt for patient {patient_id}: {prompt}")
             
             # Use the existing medical_lm_service for differential diagnosis
-            differential_diagnosis = self.ai_service.generate_response(
-                messages, 
-                system_instruction,
-                response_mime_type="application/json",
-                response_schema=response_schema
-            )
+            try:
+                differential_diagnosis = self.ai_service.generate_response(
+                    messages, 
+                    system_instruction,
+                    profile=self.method_type
+                )
+            except Exception as e:
+                if not is_unavailable(e):
+                    raise
+                return self.cached_result(patient_id, doctor_id)
             
+            content = self.parse_result(differential_diagnosis, messages, system_instruction)
+            result_cache.put(self.result_key(patient_id, doctor_id), content)
+            self.store_result(patient_id, doctor_id, chat_history, content)
             return {
-                "content": json.loads(differential_diagnosis),
+                "content": content,
             }, 201
             
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"Error generating differential diagnosis: {str(e)}")
             return {"error": "Failed to generate differential diagnosis"}, 500
+
+    def parse_result(self, output, messages, system_instruction):
+        """
+        Repair and validate model output against the endpoint's profile schema,
+        asking the model again for only the invalid parts if that is unavoidable.
+        """
+        return structured_output(
+            self.method_type,
+            output,
+            regenerate=lambda instructions, schema: self.ai_service.generate_response(
+                messages + [
+                    {"type": "assistant", "content": output},
+                    {"type": "user", "content": instructions}
+                ],
+                system_instruction,
+                response_mime_type="application/json",
+                response_schema=schema
+            )
+        )
+
+    def store_result(self, patient_id, doctor_id, chat_history, content):
+        """Persist a generated result; the response does not depend on this succeeding."""
+        history_hash = hashlib.sha256(chat_history.encode('utf-8')).hexdigest()
+        try:
+            AIResult.record(
+                patient_id, doctor_id, self.method_type, get_profile(self.method_type).tag, history_hash, content
+            )
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error storing {self.method_type} result for patient {patient_id}: {str(e)}")
+
+    def result_key(self, patient_id, doctor_id):
+        # Keyed by profile tag, so results in an older output format are not served
+        return (get_profile(self.method_type).tag, patient_id, doctor_id)
+
+    def cached_result(self, patient_id, doctor_id):
+        """
+        The last result generated for this patient and doctor, marked stale, for
+        when no model can serve the request.
+
+        Raises:
+            ServiceUnavailable: If there is no earlier result to fall back on
+        """
+        cached = result_cache.get(self.result_key(patient_id, doctor_id))
+        if cached is None:
+            # Not generated by this process; fall back on the stored results
+            try:
+                stored = AIResult.latest(patient_id, self.method_type, get_profile(self.method_type).tag, doctor_id)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logging.error(f"Error reading stored {self.method_type} result: {str(e)}")
+                stored = None
+            if stored is None:
+                raise ServiceUnavailable("The AI service is unavailable, please try again shortly.")
+            # created_at is stored as naive UTC
+            cached = (stored.content, stored.created_at.replace(tzinfo=timezone.utc))
+        content, generated_at = cached
+        logging.warning(f"AI service unavailable, serving cached {self.method_type} result for patient {patient_id}")
+        return {
+            "content": content,
+            "stale": True,
+            "generated_at": generated_at.isoformat()
+        }, 200
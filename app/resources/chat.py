@@ -1,40 +1,132 @@
 from flask_restful import Resource
 from flask_login import login_user, logout_user, login_required
-from flask import jsonify, request
+from flask import jsonify, request, current_app
 import logging
 from app.gcs_service import GCSService
-from app.ai_services import get_ai_service
+from werkzeug.exceptions import HTTPException
+from app.ai_services import get_ai_service, ai_priority, INTERACTIVE
+from app.circuit_breaker import CircuitOpenError
+from app.chat_history_store import ChatHistoryStore, HistoryFormatError, sync_cursor
+from app.metadata_extraction import extract_metadata_incrementally
+from app.conversation_summary import advance_summary_in_background
+from app.patient_index import index_patient_in_background
+from app.background import run_in_background
+from app.ai_services.embeddings import get_embedder
+from app.semantic_cache import semantic_cache
+from app.utils.cancellation import cancellable, RequestCancelled, DEADLINE_EXCEEDED
+from app import deadline
 
 class ChatAPI(Resource):
 	def __init__(self):
 		self.gcs_service = GCSService("patientstorage")
-		self.ai_service = get_ai_service()  # Get default AI service
+		self.ai_service = get_ai_service(task="chat")
 
 	@login_required
 	def post(self, patient_id):
+		"""
+		Generate the assistant's reply to a conversation.
+
+		Clients either send the full transcript as "messages", or only the new
+		turn as "message" and let the server keep the conversation: the stored
+		history is used as model context and both turns are appended to it.
+		"""
 		try:
 			data = request.get_json()
 			messages = data.get("messages", [])
 
+			if not messages and data.get("message"):
+				return self.post_server_managed(patient_id, data["message"])
+
 			if not messages:
 				return {"error": "No messages provided"}, 400
-			
-			# Fetch system_instruction from Google Cloud Storage
-			system_instruction_blob = f"{patient_id}/system_instruction.txt"
+
+			system_instruction = self.get_system_instruction(patient_id)
+			response_text = self.generate_reply(messages, system_instruction)
+
+			return {'message': response_text}, 201
+
+		except RequestCancelled as e:
+			if e.reason == DEADLINE_EXCEEDED:
+				return {"error": "Response generation timed out"}, 504
+			# Nobody is left to read this response
+			return {"error": "Client closed request"}, 499
+		except HTTPException:
+			raise
+		except Exception as e:
+			return {"error": str(e)}, 500
+
+	def post_server_managed(self, patient_id, message):
+		"""Answer a single new user turn against the server-side conversation history."""
+		if not isinstance(message, str) or not message.strip():
+			return {"error": "No message provided"}, 400
+
+		store = ChatHistoryStore(self.gcs_service)
+		try:
+			history, generation, data = store.load(patient_id)
+		except HistoryFormatError as e:
+			return {"error": f"{str(e)}; send the full 'messages' array instead"}, 409
+
+		user_turn = {"type": "user", "content": message}
+		context_size = current_app.config.get("CHAT_CONTEXT_MAX_MESSAGES", 50)
+		context = (history[-context_size:] if context_size > 0 else []) + [user_turn]
+
+		system_instruction = self.get_system_instruction(patient_id)
+		response_text = self.generate_reply(context, system_instruction)
+
+		generation, data = store.append(
+			patient_id,
+			[user_turn, {"type": "assistant", "content": response_text}],
+			generation,
+			data
+		)
+		history_text = data.decode("utf-8")
+		advance_summary_in_background(patient_id, history_text)
+		self.extract_metadata_in_background(patient_id, history_text)
+		index_patient_in_background(patient_id, history_text)
+
+		return {
+			'message': response_text,
+			'cursor': sync_cursor(generation, data)
+		}, 201
+
+	def get_system_instruction(self, patient_id):
+		# Fetch system_instruction from Google Cloud Storage
+		system_instruction_blob = f"{patient_id}/system_instruction.txt"
+		try:
 			system_instruction = self.gcs_service.download_text(system_instruction_blob)
-			if not system_instruction:
-				system_instruction = "You are a helpful assistant."
-			
-			logging.info(f"System instruction: {system_instruction}")
-
-			# Use the AI service to generate a response
-			response_text = ""
-			logging.info("start generate_content_stream")
-			for chunk in self.ai_service.generate_stream(messages, system_instruction):
+		except CircuitOpenError:
+			logging.warning("Patient storage is unavailable, using the default system instruction")
+			system_instruction = None
+		if not system_instruction:
+			system_instruction = "You are a helpful assistant."
+
+		logging.info(f"System instruction: {system_instruction}")
+		return system_instruction
+
+	def generate_reply(self, messages, system_instruction):
+		# Standalone questions matching a vetted FAQ entry reuse the answer given under the same instruction
+		embedder = get_embedder("RETRIEVAL_QUERY") if semantic_cache.enabled else None
+		cached, cache_key = semantic_cache.lookup(embedder, system_instruction, messages)
+		if cached is not None:
+			logging.info("Answered from the semantic cache")
+			return cached
+
+		# Use the AI service to generate a response, abandoning it if the client leaves
+		response_text = ""
+		logging.info("start generate_content_stream")
+		with ai_priority(INTERACTIVE):
+			stream = self.ai_service.generate_stream(messages, system_instruction, profile="chat")
+			for chunk in cancellable(stream, "chat", deadline.deadline_at()):
 				logging.info(chunk)
 				response_text += chunk
+		semantic_cache.store(cache_key, response_text)
+		return response_text
 
-			return {'message': response_text}, 201
+	def extract_metadata_in_background(self, patient_id, chat_content):
+		"""Update patient metadata as a history save would, without delaying the reply."""
+		gcs_service = self.gcs_service
 
-		except Exception as e:
-			return {"error": str(e)}, 500
\ No newline at end of file
+		def run(chat_content):
+			extract_metadata_incrementally(get_ai_service(task="extraction"), gcs_service, patient_id, chat_content)
+
+		run_in_background("metadata_extraction", patient_id, run, chat_content)
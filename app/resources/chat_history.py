@@ -3,9 +3,17 @@ from flask import jsonify, request
 from google.cloud import storage
 from flask_login import login_user, logout_user, login_required
 from app.gcs_service import GCSService
-from app.ai_services import get_ai_service
-from app.models.patient import Patient
-from app import db
+from app.ai_services import get_ai_service, ai_priority, BACKGROUND
+from app.utils.etag import etag_headers, not_modified
+from app.utils.pagination import decode_cursor, InvalidCursorError
+from app.chat_history_store import (
+    history_cursor, message_cursor, messages_hash, parse_messages, sync_cursor,
+    CURSOR_TAIL_BYTES, HistoryFormatError
+)
+from app.metadata_extraction import extract_metadata_incrementally
+from app.conversation_summary import advance_summary_in_background
+from app.patient_index import index_patient_in_background
+import hashlib
 import json
 import logging
 
@@ -21,23 +29,126 @@ class ChatHistoryResource(Resource):
     def __init__(self):
         self.patient_gcs_service = GCSService(self.PATIENT_GCS_BUCKET_NAME)
         self.doctor_gcs_service = GCSService(self.DOCTOR_GCS_BUCKET_NAME)
-        self.ai_service = get_ai_service("gemini")
+        self.ai_service = get_ai_service("gemini", task="extraction")
     
     @login_required
     def get(self, user_id):
         """
-        Retrieve chat history for a specific user
+        Retrieve chat history for a specific user.
+
+        The ETag is the blob's GCS generation, so a matching If-None-Match is
+        answered with 304 from object metadata without downloading the history.
+
+        Every response includes a cursor. Passing it back as ?since=<cursor>
+        returns only the content appended since then; if the history was
+        rewritten rather than appended to, the full content is returned with
+        reset set to true. For a history stored as a JSON array of messages,
+        the delta content is a JSON array of the messages added since then.
         """
         user_type = request.args.get('user_type')
         
         if user_type not in UserType.VALID_TYPES:
             return {'message': 'Invalid user type.'}, 400
         
-        chat_history = self.get_history_from_gcs(user_type, user_id)
+        since = request.args.get('since')
+        if since:
+            return self.get_history_delta(user_type, user_id, since)
+        
+        generation = self.get_history_generation(user_type, user_id)
+        if generation is None:
+            return {'message': 'No chat history found for this user.'}, 404
+        
+        etag = f"history-{generation}"
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
+        chat_history = self.get_history_from_gcs(user_type, user_id, generation)
         if not chat_history:
             return {'message': 'No chat history found for this user.'}, 404
         
-        return {'content': chat_history}, 200
+        return {
+            'content': chat_history,
+            'cursor': self.full_history_cursor(generation, chat_history)
+        }, 200, etag_headers(etag)
+    
+    def get_history_delta(self, user_type, user_id, since):
+        """Return the history appended after a cursor, using a ranged read of the blob."""
+        try:
+            cursor = decode_cursor(since)
+            generation = int(cursor['g'])
+            if 'm' in cursor:
+                offset, tail_hash = None, None
+                count, prefix_hash = int(cursor['m']), cursor['h']
+            else:
+                offset, tail_hash = int(cursor['o']), cursor['t']
+        except (InvalidCursorError, KeyError, TypeError, ValueError):
+            return {'message': 'Invalid cursor.'}, 400
+        
+        gcs_service = self.doctor_gcs_service if user_type == UserType.DOCTOR else self.patient_gcs_service
+        blob_path = f"{user_id}/chat_history"
+        info = gcs_service.get_info(blob_path)
+        if info is None:
+            return {'message': 'No chat history found for this user.'}, 404
+        
+        if info['generation'] == generation:
+            return {'content': '', 'cursor': since, 'reset': False}, 200
+        
+        if offset is None:
+            return self.get_message_delta(gcs_service, blob_path, info['generation'], count, prefix_hash)
+        
+        if 0 < offset <= info['size']:
+            # Re-read the bytes just before the cursor to check the history was only appended to
+            start = max(offset - CURSOR_TAIL_BYTES, 0)
+            data = gcs_service.download_range(blob_path, start, generation=info['generation'])
+            if data is not None and hashlib.sha1(data[:offset - start]).hexdigest() == tail_hash:
+                try:
+                    delta = data[offset - start:].decode('utf-8')
+                except UnicodeDecodeError:
+                    delta = None
+                if delta is not None:
+                    return {
+                        'content': delta,
+                        'cursor': history_cursor(info['generation'], start + len(data), data),
+                        'reset': False
+                    }, 200
+        
+        chat_history = gcs_service.download_text(blob_path, info['generation'])
+        return self.full_history_reset(info['generation'], chat_history)
+    
+    def get_message_delta(self, gcs_service, blob_path, generation, count, prefix_hash):
+        """
+        Return the messages added to a JSON array history after a message cursor.
+
+        The array is rewritten whole on every change, so there is no byte range
+        to read: the history is downloaded and compared message by message.
+        """
+        chat_history = gcs_service.download_text(blob_path, generation)
+        if chat_history is None:
+            return {'message': 'No chat history found for this user.'}, 404
+        try:
+            messages, is_jsonl = parse_messages(chat_history)
+        except HistoryFormatError:
+            is_jsonl = True
+        if not is_jsonl and count <= len(messages) and messages_hash(messages[:count]) == prefix_hash:
+            return {
+                'content': json.dumps(messages[count:], ensure_ascii=False),
+                'cursor': message_cursor(generation, messages),
+                'reset': False
+            }, 200
+        return self.full_history_reset(generation, chat_history)
+    
+    def full_history_reset(self, generation, chat_history):
+        if chat_history is None:
+            return {'message': 'No chat history found for this user.'}, 404
+        return {
+            'content': chat_history,
+            'cursor': self.full_history_cursor(generation, chat_history),
+            'reset': True
+        }, 200
+    
+    def full_history_cursor(self, generation, chat_history):
+        return sync_cursor(generation, chat_history.encode('utf-8'))
     
     @login_required
     def post(self, user_id):
@@ -61,19 +172,27 @@ class ChatHistoryResource(Resource):
         # Process with AI service if this is patient data
         if user_type == UserType.PATIENT:
             try:
-                self.process_with_ai_service(user_id, history_data_content)
+                with ai_priority(BACKGROUND):
+                    self.process_with_ai_service(user_id, history_data_content)
             except Exception as e:
                 logging.error(f"Error processing chat history with AI service: {str(e)}")
                 # Continue execution even if AI processing fails
+            advance_summary_in_background(user_id, history_data_content)
+            index_patient_in_background(user_id, history_data_content)
         
         return {'message': 'Chat history saved successfully.'}, 201
     
-    def get_history_from_gcs(self, user_type, user_id):
+    def get_history_from_gcs(self, user_type, user_id, generation=None):
         blob_path = f"{user_id}/chat_history"
         gcs_service = self.doctor_gcs_service if user_type == UserType.DOCTOR else self.patient_gcs_service
-        data = gcs_service.download_text(blob_path)
+        data = gcs_service.download_text(blob_path, generation)
         return data
     
+    def get_history_generation(self, user_type, user_id):
+        blob_path = f"{user_id}/chat_history"
+        gcs_service = self.doctor_gcs_service if user_type == UserType.DOCTOR else self.patient_gcs_service
+        return gcs_service.get_generation(blob_path)
+    
     def save_history_to_gcs(self, user_type, user_id, history_data):
         blob_path = f"{user_id}/chat_history"
         gcs_service = self.doctor_gcs_service if user_type == UserType.DOCTOR else self.patient_gcs_service
@@ -81,93 +200,11 @@ class ChatHistoryResource(Resource):
     
     def process_with_ai_service(self, patient_id, chat_content):
         """
-        Process chat history with AI service and update patient metadata.
+        Process chat history with AI service and update patient metadata,
+        analysing only the turns added since the last extraction.
         
         Args:
             patient_id (str): The ID of the patient
             chat_content (str): The chat history content
         """
-        # Define the schema as specified
-        response_schema = {
-            "type": "object",
-            "properties": {
-                "Risk": {
-                    "type": "string",
-                    "enum": ["High", "Medium", "Low"],
-                    "description": "The level of risk associated with the condition."
-                },
-                "Condition": {
-                    "type": "string",
-                    "description": "The medical condition diagnosed."
-                },
-                "Age": {
-                    "type": "integer",
-                    "format": "int32",
-                    "description": "The age of the patient."
-                },
-                "LastVisit": {
-                    "type": "string",
-                    "format": "date",
-                    "description": "The date of the patient's last medical visit in YYYY-MM-DD format."
-                }
-            },
-            "required": ["Risk", "Condition"]
-        }
-        
-        # Create system instruction for Gemini
-        system_instruction = (
-            "You are a medical analysis AI. Analyze the patient conversation with chatbot and extract key information. "
-            "Include the patient's risk level (High/Medium/Low), medical condition, age (if mentioned), "
-            "and last visit date in YYYY-MM-DD format (if mentioned)."
-        )
-        
-        # Format message for the AI service
-        prompt = (
-            f"Analyze this patient conversation and extract key medical information:\n\n"
-            f"{chat_content}"
-        )
-        
-        messages = [{"type": "user", "content": prompt}]
-        
-        # Call the AI service with the response schema
-        ai_response = self.ai_service.generate_response(
-            messages, 
-            system_instruction,
-            response_mime_type="application/json",
-            response_schema=response_schema
-        )
-        
-        # Extract JSON from response
-        try:
-            # Try to parse the entire response as JSON
-            parsed_response = json.loads(ai_response)
-        except json.JSONDecodeError:
-            # If that fails, try to extract JSON from the text using regex
-            import re
-            json_match = re.search(r'({[\s\S]*})', ai_response)
-            if json_match:
-                try:
-                    parsed_response = json.loads(json_match.group(1))
-                except json.JSONDecodeError:
-                    logging.error("Failed to extract valid JSON from AI response")
-                    return
-            else:
-                logging.error("No JSON found in AI response")
-                return
-        
-        # Update patient metadata with AI analysis
-        patient = Patient.query.get(patient_id)
-        if patient:
-            # Initialize metadata if None
-            current_metadata = patient.patient_metadata or {}
-            
-            # Merge with existing metadata
-            if isinstance(current_metadata, dict):
-                current_metadata.update(parsed_response)
-            else:
-                current_metadata = parsed_response
-            
-            # Update patient record
-            patient.patient_metadata = current_metadata
-            db.session.commit()
-            logging.info(f"Updated metadata for patient {patient_id}")
+        extract_metadata_incrementally(self.ai_service, self.patient_gcs_service, patient_id, chat_content)
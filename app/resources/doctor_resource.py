@@ -2,13 +2,16 @@ from flask_restful import Resource
 from flask import request, jsonify
 from flask_login import login_required, current_user
 from app.models.doctor import Doctor
-from app.decorators import doctor_required
+from app.decorators import doctor_required, read_only
+from app.deadline import DeadlineExceeded
+from app.utils.etag import etag_headers, not_modified, row_etag
 import logging
 
 class DoctorResource(Resource):
     """Resource for doctor-related operations."""
     
     @login_required
+    @read_only
     def get(self, doctor_id=None):
         """
         Get doctor information by ID.
@@ -32,6 +35,11 @@ class DoctorResource(Resource):
             if not doctor:
                 return {"error": f"Doctor with ID {doctor_id} not found"}, 404
             
+            etag = row_etag("doctor", doctor.doctor_id, doctor.updated_at)
+            unchanged = not_modified(etag)
+            if unchanged:
+                return unchanged
+            
             # Build doctor data response
             doctor_data = {
                 "doctor_id": doctor.doctor_id,
@@ -42,8 +50,10 @@ class DoctorResource(Resource):
                 "updated_at": doctor.updated_at.isoformat() if doctor.updated_at else None
             }
             
-            return doctor_data, 200
+            return doctor_data, 200, etag_headers(etag)
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Error retrieving doctor: {str(e)}")
             return {"error": "Failed to retrieve doctor information"}, 500
@@ -1,19 +1,103 @@
 from flask_restful import Resource
-from flask import jsonify
+from flask import jsonify, request, current_app
+from datetime import datetime, date
+from sqlalchemy import tuple_, or_
 from app import db
-from app.models.patient import Patient
-from app.decorators import doctor_required
+from app.models.patient import Patient, RISK_RANK, AGE, AGE_SORT, LAST_VISIT, LAST_VISIT_SORT
+from app.decorators import doctor_required, read_only
+from app.deadline import DeadlineExceeded
+from app.utils.pagination import encode_cursor, decode_cursor, parse_page_size, InvalidCursorError
+from app.patient_index import get_patient_index
+
+RISK_LEVELS = ("High", "Medium", "Low")
+
+# Sortable keys: (SQL expression with no NULLs, cursor encoder, cursor decoder).
+# Each expression has a matching (expression, patient_id) index on patient.
+SORT_KEYS = {
+    'updated_at': (Patient.updated_at, lambda v: v.isoformat(), datetime.fromisoformat),
+    'risk': (RISK_RANK, int, int),
+    'age': (AGE_SORT, float, float),
+    'last_visit': (LAST_VISIT_SORT, str, str),
+}
 
 class PatientsResource(Resource):
+    NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
     @doctor_required
+    @read_only
     def get(self):
+        """
+        List patients one page at a time, optionally filtered on AI extracted metadata.
+
+        Query parameters:
+            limit: Page size (defaults to PATIENTS_PAGE_SIZE)
+            cursor: Opaque token from the X-Next-Cursor header of the previous page
+            sort: One of updated_at (default), risk, age, last_visit
+            order: desc (default) or asc
+            risk: Comma separated risk levels, e.g. High or High,Medium
+            condition: Case-insensitive substring of the extracted condition
+            age_min, age_max: Inclusive age range
+            last_visit_from, last_visit_to: Inclusive YYYY-MM-DD last visit window
+        """
+        try:
+            page_size = parse_page_size(
+                request.args.get('limit'),
+                current_app.config.get('PATIENTS_PAGE_SIZE', 20),
+                current_app.config.get('PATIENTS_MAX_PAGE_SIZE', 100)
+            )
+
+            sort = request.args.get('sort', 'updated_at')
+            if sort not in SORT_KEYS:
+                return {'error': f"Invalid sort. Must be one of: {', '.join(SORT_KEYS)}"}, 400
+            order = request.args.get('order', 'desc')
+            if order not in ('asc', 'desc'):
+                return {'error': "Invalid order. Must be 'asc' or 'desc'"}, 400
+            sort_expr, encode_value, decode_value = SORT_KEYS[sort]
+
+            cursor = decode_cursor(request.args.get('cursor'))
+            if cursor:
+                if cursor.get('s') != sort or cursor.get('o') != order:
+                    return {'error': 'Cursor does not match the requested sort order'}, 400
+                last_value = decode_value(cursor['v'])
+                last_patient_id = int(cursor['id'])
+
+            filters = self.build_filters(request.args)
+        except (ValueError, InvalidCursorError) as e:
+            return {'error': str(e)}, 400
+        except (KeyError, TypeError):
+            return {'error': 'Invalid cursor'}, 400
+
         try:
-            # Get top 20 patients, ordered by most recently updated
-            patients = Patient.query.order_by(Patient.updated_at.desc()).limit(20).all()
-            
+            query = db.session.query(Patient, sort_expr.label('sort_value')).filter(*filters)
+            if cursor:
+                position = tuple_(sort_expr, Patient.patient_id)
+                if order == 'desc':
+                    query = query.filter(position < (last_value, last_patient_id))
+                else:
+                    query = query.filter(position > (last_value, last_patient_id))
+
+            if order == 'desc':
+                query = query.order_by(sort_expr.desc(), Patient.patient_id.desc())
+            else:
+                query = query.order_by(sort_expr.asc(), Patient.patient_id.asc())
+
+            # Fetch one extra row to know whether another page exists
+            rows = query.limit(page_size + 1).all()
+
+            next_cursor = None
+            if len(rows) > page_size:
+                rows = rows[:page_size]
+                last_patient, last_sort_value = rows[-1]
+                next_cursor = encode_cursor({
+                    's': sort,
+                    'o': order,
+                    'v': encode_value(last_sort_value),
+                    'id': last_patient.patient_id
+                })
+
             # Convert to JSON serializable format
             patients_data = []
-            for patient in patients:
+            for patient, _ in rows:
                 patients_data.append({
                     'patient_id': patient.patient_id,
                     'full_name': patient.full_name,
@@ -22,8 +106,100 @@ class PatientsResource(Resource):
                     'created_at': patient.created_at.isoformat() if patient.created_at else None,
                     'updated_at': patient.updated_at.isoformat() if patient.updated_at else None
                 })
-            
-            return jsonify(patients_data)
-        
+
+            response = jsonify(patients_data)
+            if next_cursor:
+                response.headers[self.NEXT_CURSOR_HEADER] = next_cursor
+            return response
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    def build_filters(self, args):
+        """
+        Translate metadata query parameters into SQL filter clauses.
+
+        Raises:
+            ValueError: If a parameter is malformed
+        """
+        filters = []
+
+        risk = args.get('risk')
+        if risk:
+            levels = [level.strip().capitalize() for level in risk.split(',') if level.strip()]
+            invalid = [level for level in levels if level not in RISK_LEVELS]
+            if invalid:
+                raise ValueError(f"Invalid risk level(s): {', '.join(invalid)}")
+            # Containment predicates are served by the GIN index on patient_metadata
+            filters.append(or_(*[Patient.patient_metadata.contains({'Risk': level}) for level in levels]))
+
+        condition = args.get('condition')
+        if condition:
+            pattern = condition.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            filters.append(Patient.patient_metadata['Condition'].astext.ilike(f"%{pattern}%", escape='\\'))
+
+        age_min = args.get('age_min')
+        if age_min:
+            filters.append(AGE >= int(age_min))
+        age_max = args.get('age_max')
+        if age_max:
+            filters.append(AGE <= int(age_max))
+
+        last_visit_from = args.get('last_visit_from')
+        if last_visit_from:
+            filters.append(LAST_VISIT >= date.fromisoformat(last_visit_from).isoformat())
+        last_visit_to = args.get('last_visit_to')
+        if last_visit_to:
+            filters.append(LAST_VISIT <= date.fromisoformat(last_visit_to).isoformat())
+
+        return filters
+
+class SimilarPatientsResource(Resource):
+    @doctor_required
+    @read_only
+    def get(self, patient_id):
+        """
+        Patients whose conversations are most similar to this patient's,
+        most similar first, from the similar-patient index.
+
+        Query parameters:
+            limit: Number of patients (defaults to SIMILAR_PATIENTS_DEFAULT)
+        """
+        try:
+            limit = parse_page_size(
+                request.args.get('limit'),
+                current_app.config.get('SIMILAR_PATIENTS_DEFAULT', 10),
+                current_app.config.get('SIMILAR_PATIENTS_MAX', 100)
+            )
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        try:
+            matches = get_patient_index().similar(patient_id, limit)
+            if matches is None:
+                return {'error': f'Patient {patient_id} has no indexed chat history yet'}, 404
+
+            patients = {
+                patient.patient_id: patient
+                for patient in Patient.query.filter(Patient.patient_id.in_([match_id for match_id, _ in matches]))
+            }
+            similar = []
+            for match_id, score in matches:
+                patient = patients.get(match_id)
+                if patient is None:
+                    # Deleted since it was indexed
+                    continue
+                similar.append({
+                    'patient_id': patient.patient_id,
+                    'full_name': patient.full_name,
+                    'metadata': patient.patient_metadata,
+                    'similarity': round(score, 4)
+                })
+            return jsonify(similar)
+
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             return {'error': str(e)}, 500
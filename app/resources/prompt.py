@@ -3,6 +3,7 @@ from flask import jsonify, request
 from google.cloud import storage
 from flask_login import login_user, logout_user, login_required
 from app.gcs_service import GCSService
+from app.utils.etag import etag_headers, not_modified
 
 class UserType:
 	PATIENT = 'patient'
@@ -28,11 +29,21 @@ class PromptResource(Resource):
 		if not prompt_blob:
 			return {'message': 'Prompt blob is required.'}, 400
 		
-		prompt = self.get_prompt_from_gcs(user_type, user_id, prompt_blob)
+		# Revalidate against the blob's GCS generation before downloading it
+		generation = self.get_prompt_generation(user_type, user_id, prompt_blob)
+		if generation is None:
+			return {'content': None}, 200
+
+		etag = f"prompt-{generation}"
+		unchanged = not_modified(etag)
+		if unchanged:
+			return unchanged
+
+		prompt = self.get_prompt_from_gcs(user_type, user_id, prompt_blob, generation)
 		# if not prompt:
 		# 	return {'message': 'No prompt found for this ID.'}, 404
 		
-		return {'content': prompt}, 200
+		return {'content': prompt}, 200, etag_headers(etag)
 	
 	@login_required
 	def post(self, user_id):
@@ -54,11 +65,16 @@ class PromptResource(Resource):
 		self.save_prompt_to_gcs(user_type, user_id, prompt_blob, prompt_content)
 		return {'message': 'Prompt saved successfully.'}, 201
 
-	def get_prompt_from_gcs(self, user_type, user_id, prompt_blob):
+	def get_prompt_from_gcs(self, user_type, user_id, prompt_blob, generation=None):
 		blob_name = f"{user_id}/{prompt_blob}"
 		gcs_service = self.doctor_gcs_service if user_type == UserType.DOCTOR else self.patient_gcs_service
-		data = gcs_service.download_text(blob_name)
+		data = gcs_service.download_text(blob_name, generation)
 		return data
+
+	def get_prompt_generation(self, user_type, user_id, prompt_blob):
+		blob_name = f"{user_id}/{prompt_blob}"
+		gcs_service = self.doctor_gcs_service if user_type == UserType.DOCTOR else self.patient_gcs_service
+		return gcs_service.get_generation(blob_name)
 	
 	def save_prompt_to_gcs(self, user_type, user_id, prompt_blob, prompt_data):
 		blob_name = f"{user_id}/{prompt_blob}"
@@ -0,0 +1,41 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class ResultCache:
+    """
+    Last successful AI result per key, kept in process memory.
+
+    Used to serve a stale result, clearly marked, while the models are
+    unavailable. Least recently used entries are evicted beyond max_size.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Returns (content, generated_at) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, content):
+        with self._lock:
+            self._entries[key] = (content, datetime.now(timezone.utc))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+result_cache = ResultCache()
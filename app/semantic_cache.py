@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.metrics import counter, gauge
+
+SEMANTIC_CACHE_REQUESTS = counter(
+    "semantic_cache_requests_total",
+    "Chat questions looked up in the semantic cache, by outcome",
+    ("outcome",)
+)
+SEMANTIC_CACHE_EVICTIONS = counter(
+    "semantic_cache_evictions_total",
+    "Semantic cache entries replaced, by reason",
+    ("reason",)
+)
+SEMANTIC_CACHE_ENTRIES = gauge(
+    "semantic_cache_entries",
+    "Answers held in the semantic cache",
+    multiprocess_mode="livesum"
+)
+SEMANTIC_CACHE_HIT_RATIO = gauge(
+    "semantic_cache_hit_ratio",
+    "Share of semantic cache lookups answered from the cache since the process started"
+)
+
+
+# Questions whose answer hinges on details that embeddings barely tell apart:
+# numbers (doses, ages, readings), negations and medications. "Can I take 2
+# pills?" and "Can I take 20 pills?" embed almost identically.
+UNCACHEABLE = re.compile(
+    r"\d|"
+    r"\b(no|not|never|none|nor|without|neither|cannot|stop(ped)?|avoid)\b|n't\b|"
+    r"\b(medic\w*|drugs?|pills?|tablets?|capsules?|doses?|dosage|mg|ml|prescri\w*|"
+    r"aspirin|ibuprofen|paracetamol|acetaminophen|naproxen|insulin|warfarin|heparin|"
+    r"antibiotics?|steroids?|prednisone|opioids?|morphine|codeine|tramadol|antihistamines?|"
+    r"\w+(pril|sartan|olol|dipine|statin|formin|gliptin|prazole|tidine|cillin|mycin|"
+    r"floxacin|cycline|azole|vir|mab|nib|pam|lam|triptan|codone|semide|thiazide|xetine|apine))\b",
+    re.IGNORECASE
+)
+
+
+def scope_key(system_instruction):
+    """
+    Answers are shared between conversations with the same system instruction.
+    A patient-specific instruction therefore gets a scope of its own.
+    """
+    return hashlib.sha1((system_instruction or "").encode("utf-8")).hexdigest()
+
+
+def standalone_question(messages):
+    """The question of a conversation that consists of a single user turn, else None."""
+    if len(messages) == 1 and messages[0].get("type") == "user":
+        question = messages[0].get("content")
+        if isinstance(question, str) and question.strip():
+            return question.strip()
+    return None
+
+
+def cacheable_question(messages):
+    """The standalone question of a conversation if its answer may be reused, else None."""
+    question = standalone_question(messages)
+    if question is None or UNCACHEABLE.search(question):
+        return None
+    return question
+
+
+def load_faq(path):
+    """
+    The vetted FAQ questions from a JSON file holding a list of strings.
+
+    Returns an empty list, disabling every cache hit, if there is no file or it is unreadable.
+    """
+    if not path:
+        return []
+    try:
+        with open(path, encoding="utf-8") as faq_file:
+            questions = json.load(faq_file)
+        if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+            raise ValueError("expected a JSON list of questions")
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not load the semantic cache FAQ from {path}: {str(e)}")
+        return []
+    return [question.strip() for question in questions if question.strip()]
+
+
+class SemanticCache:
+    """
+    Chat answers to vetted FAQ questions, shared per prompt scope and kept in
+    process memory.
+
+    Only questions that match an entry of a vetted FAQ list are cached. The
+    list holds questions a clinician has confirmed do not depend on who asks,
+    e.g. how to prepare for a blood test. A standalone question is embedded
+    and compared with the embedded FAQ questions in one vectorised matrix
+    product. If the best match is at least `threshold` cosine-similar, the
+    answer generated for that entry under the same system instruction is
+    served, or the fresh answer is stored for it. Questions that mention
+    numbers, negations or medications are never cached, even if they resemble
+    an entry. Answers expire after ttl seconds, and the least recently used
+    ones are evicted beyond max_entries.
+    """
+
+    EMBED_BATCH_SIZE = 100
+
+    def __init__(self, enabled=False, threshold=0.92, max_entries=1000, ttl=86400, faq=()):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.faq = list(faq)
+        self._faq_vectors = {}
+        self._answers = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+
+    def configure(self, enabled, threshold, max_entries, ttl, faq):
+        with self._lock:
+            self.enabled = enabled
+            self.threshold = threshold
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self.faq = list(faq)
+            self._faq_vectors.clear()
+            self._answers.clear()
+
+    def _faq_matrix(self, embedder):
+        """The FAQ questions embedded as rows of one matrix, computed once per embedder."""
+        key = (embedder.name, embedder.dimensions)
+        with self._lock:
+            vectors = self._faq_vectors.get(key)
+            faq = self.faq
+        if vectors is None:
+            batches = [
+                embedder.embed(faq[start:start + self.EMBED_BATCH_SIZE])
+                for start in range(0, len(faq), self.EMBED_BATCH_SIZE)
+            ]
+            vectors = np.vstack(batches) if batches else np.zeros((0, embedder.dimensions), dtype=np.float32)
+            with self._lock:
+                self._faq_vectors[key] = vectors
+        return vectors
+
+    def match(self, embedder, question):
+        """The index of the FAQ entry question is at least threshold similar to, else None."""
+        vectors = self._faq_matrix(embedder)
+        if not len(vectors):
+            return None
+        similarities = vectors @ embedder.embed([question])[0]
+        best = int(np.argmax(similarities))
+        return best if similarities[best] >= self.threshold else None
+
+    def lookup(self, embedder, system_instruction, messages):
+        """
+        Find a cached answer for a standalone FAQ question.
+
+        Returns:
+            (answer, key): answer is None on a miss; key is where to store the
+            fresh answer, or None if the conversation cannot be cached
+        """
+        if not self.enabled:
+            return None, None
+        question = cacheable_question(messages)
+        if question is None:
+            if standalone_question(messages) is not None:
+                SEMANTIC_CACHE_REQUESTS.inc(outcome="uncacheable")
+            return None, None
+        try:
+            index = self.match(embedder, question)
+        except Exception as e:
+            logging.warning(f"Could not embed chat question, skipping the semantic cache: {str(e)}")
+            SEMANTIC_CACHE_REQUESTS.inc(outcome="error")
+            return None, None
+        if index is None:
+            SEMANTIC_CACHE_REQUESTS.inc(outcome="not_faq")
+            return None, None
+
+        key = (scope_key(system_instruction), embedder.name, embedder.dimensions, index)
+        now = time.time()
+        with self._lock:
+            self._lookups += 1
+            entry = self._answers.get(key)
+            if entry is not None:
+                answer, created = entry
+                if self.ttl and created < now - self.ttl:
+                    del self._answers[key]
+                    SEMANTIC_CACHE_EVICTIONS.inc(reason="expired")
+                else:
+                    self._answers.move_to_end(key)
+                    self._hits += 1
+                    SEMANTIC_CACHE_REQUESTS.inc(outcome="hit")
+                    return answer, None
+        SEMANTIC_CACHE_REQUESTS.inc(outcome="miss")
+        return None, key
+
+    def store(self, key, answer):
+        """Cache an answer under the key returned by lookup()."""
+        if key is None or not answer or not self.enabled:
+            return
+        with self._lock:
+            self._answers[key] = (answer, time.time())
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_entries:
+                self._answers.popitem(last=False)
+                SEMANTIC_CACHE_EVICTIONS.inc(reason="lru")
+
+    def entries(self):
+        with self._lock:
+            return len(self._answers)
+
+    def hit_ratio(self):
+        with self._lock:
+            return self._hits / self._lookups if self._lookups else 0.0
+
+
+semantic_cache = SemanticCache()
+
+SEMANTIC_CACHE_ENTRIES.set_function(lambda: [({}, semantic_cache.entries())])
+SEMANTIC_CACHE_HIT_RATIO.set_function(lambda: [({}, semantic_cache.hit_ratio())])
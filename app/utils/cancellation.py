@@ -0,0 +1,87 @@
+import logging
+import select
+import socket
+import time
+from flask import request, has_request_context
+from app.metrics import counter
+
+REQUESTS_CANCELLED = counter(
+    "ai_requests_cancelled_total",
+    "Model generations stopped early because nobody was waiting for them",
+    ("endpoint", "reason")
+)
+
+CLIENT_DISCONNECTED = "client_disconnected"
+DEADLINE_EXCEEDED = "deadline_exceeded"
+
+
+class RequestCancelled(Exception):
+    """Raised when a generation is abandoned because the client left or the deadline passed."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def client_disconnected(environ=None):
+    """
+    Check whether the client has closed its connection.
+
+    Uses the raw socket exposed by gunicorn or the Werkzeug server. The request
+    body has already been read, so a readable socket that returns no bytes means
+    the peer closed the connection. Returns False when the socket is unavailable.
+    """
+    if environ is None:
+        if not has_request_context():
+            return False
+        environ = request.environ
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+def cancellable(chunks, endpoint, deadline=None, check_interval=0.25):
+    """
+    Yield from a model stream, stopping it once the client is gone or the deadline passes.
+
+    Closing the wrapped generator closes the upstream model stream.
+
+    Args:
+        chunks: Generator of response chunks, e.g. from AIService.generate_stream
+        endpoint: Endpoint name used in metrics
+        deadline: Optional time.monotonic() value after which generation stops
+        check_interval: Minimum seconds between client connection checks
+
+    Raises:
+        RequestCancelled: When the generation was stopped early
+    """
+    environ = request.environ if has_request_context() else None
+    last_check = time.monotonic()
+    try:
+        for chunk in chunks:
+            yield chunk
+
+            now = time.monotonic()
+            reason = None
+            if deadline is not None and now > deadline:
+                reason = DEADLINE_EXCEEDED
+            elif environ is not None and now - last_check >= check_interval:
+                last_check = now
+                if client_disconnected(environ):
+                    reason = CLIENT_DISCONNECTED
+
+            if reason:
+                REQUESTS_CANCELLED.inc(endpoint=endpoint, reason=reason)
+                logging.warning(f"Cancelling model stream for {endpoint}: {reason}")
+                raise RequestCancelled(reason)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
@@ -0,0 +1,31 @@
+from flask import request, Response
+from werkzeug.http import quote_etag
+
+# Clients may keep the body but must revalidate it with If-None-Match before reuse
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag_headers(etag):
+    """Response headers advertising a strong ETag."""
+    return {"ETag": quote_etag(etag), "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag):
+    """
+    Return a 304 response if the request's If-None-Match matches the ETag.
+
+    Args:
+        etag: The current (unquoted) strong ETag of the resource
+
+    Returns:
+        A 304 Response, or None if the client does not have the current version
+    """
+    if etag is not None and request.if_none_match.contains(etag):
+        return Response(status=304, headers=etag_headers(etag))
+    return None
+
+
+def row_etag(prefix, row_id, updated_at):
+    """Build an ETag for a database row from its ID and updated_at timestamp."""
+    version = int(updated_at.timestamp() * 1000000) if updated_at else 0
+    return f"{prefix}-{row_id}-{version}"
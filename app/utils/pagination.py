@@ -0,0 +1,54 @@
+import base64
+import json
+from typing import Any, Dict, Optional
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    """
+    Encode a keyset position as an opaque, URL-safe cursor token.
+
+    Args:
+        payload: JSON serializable dictionary describing the last row of a page
+
+    Returns:
+        str: The cursor token
+    """
+    raw = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Decode a cursor token produced by encode_cursor.
+
+    Args:
+        token: The cursor token, or None for the first page
+
+    Returns:
+        The decoded payload, or None if no token was given
+    """
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {str(e)}")
+    if not isinstance(payload, dict):
+        raise InvalidCursorError("Invalid cursor: expected an object")
+    return payload
+
+
+def parse_page_size(value: Optional[str], default: int, maximum: int) -> int:
+    """Parse a requested page size, clamping it to [1, maximum]."""
+    if value is None or value == "":
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    return max(1, min(size, maximum))
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+
+from app.ai_services.profiles import get_profile
+from app.chat_history_store import format_messages
+
+
+def prefix_hash(messages):
+    """Hash of the messages a state covers, to notice a history that was rewritten under it."""
+    return hashlib.sha1(format_messages(messages).encode("utf-8")).hexdigest()
+
+
+class WatermarkedState:
+    """
+    A JSON blob at {patient_id}/<name> recording how far a patient's chat
+    history has been processed with a generation profile.
+
+    The state holds a watermark (the number of leading messages processed),
+    a hash of those messages and the profile tag. It only applies while the
+    history still starts with exactly those messages and while the profile
+    version is unchanged; otherwise processing starts over. Writes are
+    conditional on the generation that was read, so concurrent runs cannot
+    move the watermark back.
+    """
+
+    MAX_LOAD_ATTEMPTS = 3
+
+    def __init__(self, gcs_service, name, profile_name):
+        self.gcs_service = gcs_service
+        self.name = name
+        self.profile_name = profile_name
+
+    def blob_path(self, patient_id):
+        return f"{patient_id}/{self.name}"
+
+    def load(self, patient_id):
+        """
+        Returns:
+            (state, generation): state is None if none is stored or it is unreadable,
+            generation 0 if there is no blob
+        """
+        blob_path = self.blob_path(patient_id)
+        for attempt in range(self.MAX_LOAD_ATTEMPTS):
+            info = self.gcs_service.get_info(blob_path)
+            if info is None:
+                return None, 0
+            text = self.gcs_service.download_text(blob_path, info["generation"])
+            if text is None:
+                # Replaced between the metadata read and the download
+                continue
+            try:
+                return json.loads(text), info["generation"]
+            except json.JSONDecodeError:
+                logging.warning(f"Ignoring unreadable {self.name} for {patient_id}")
+                return None, info["generation"]
+        raise RuntimeError(f"{self.name} for {patient_id} kept changing while it was read")
+
+    def save(self, patient_id, state, generation):
+        """
+        Store a state unless another one was stored since generation was read.
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: If it was
+        """
+        self.gcs_service.upload_text(
+            json.dumps(state, ensure_ascii=False),
+            self.blob_path(patient_id),
+            if_generation_match=generation
+        )
+
+    def stamp(self, messages):
+        """The fields recording that messages were processed with the current profile."""
+        return {
+            "profile": get_profile(self.profile_name).tag,
+            "watermark": len(messages),
+            "prefix_hash": prefix_hash(messages)
+        }
+
+    def watermark(self, state, messages):
+        """The number of leading messages already processed, or 0 if the state no longer applies."""
+        if not state or state.get("profile") != get_profile(self.profile_name).tag:
+            return 0
+        watermark = state.get("watermark", 0)
+        if watermark > len(messages) or state.get("prefix_hash") != prefix_hash(messages[:watermark]):
+            return 0
+        return watermark
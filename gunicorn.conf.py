@@ -0,0 +1,26 @@
+import os
+import shutil
+
+# Loaded by gunicorn from the working directory. With PROMETHEUS_MULTIPROC_DIR
+# set, every worker writes its metrics to that directory; it is emptied when
+# the server starts and a worker's live gauges are dropped when it exits.
+
+# A worker that takes longer than this on one request is killed and restarted
+# (gunicorn's default is 30s). It must stay above the largest budget in
+# REQUEST_DEADLINES (chatapi=120 by default), or a slow request is killed
+# before its deadline can end it with a 504.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 150))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", timeout))
+
+
+def on_starting(server):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,26 @@
+"""add patient (updated_at, patient_id) index
+
+Revision ID: 3f9a2c7d1e48
+Revises: 17341a6922c1
+Create Date: 2025-03-10 09:12:41.208533
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c7d1e48'
+down_revision = '17341a6922c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.create_index('ix_patient_updated_at_patient_id', ['updated_at', 'patient_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index('ix_patient_updated_at_patient_id')
@@ -0,0 +1,57 @@
+"""convert patient_metadata to jsonb with gin index
+
+Revision ID: 8c41d5b7a903
+Revises: 3f9a2c7d1e48
+Create Date: 2025-03-12 16:04:27.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d5b7a903'
+down_revision = '3f9a2c7d1e48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.alter_column('patient_metadata',
+               existing_type=sa.JSON(),
+               type_=postgresql.JSONB(astext_type=sa.Text()),
+               existing_nullable=True,
+               postgresql_using='patient_metadata::jsonb')
+        batch_op.create_index('ix_patient_metadata_gin', ['patient_metadata'], unique=False,
+               postgresql_using='gin', postgresql_ops={'patient_metadata': 'jsonb_path_ops'})
+        # Keyset pagination of the listing sorted on metadata. The expressions
+        # must match the sort keys in app/models/patient.py as SQLAlchemy renders them.
+        batch_op.create_index('ix_patient_risk_rank_patient_id', [
+            sa.text("(CASE patient_metadata ->> 'Risk' WHEN 'High' THEN 3 WHEN 'Medium' THEN 2 "
+                    "WHEN 'Low' THEN 1 ELSE 0 END)"),
+            'patient_id'
+        ], unique=False)
+        batch_op.create_index('ix_patient_age_patient_id', [
+            sa.text("coalesce(CASE WHEN (jsonb_typeof(patient_metadata -> 'Age') = 'number') "
+                    "THEN CAST(patient_metadata ->> 'Age' AS NUMERIC) END, -1)"),
+            'patient_id'
+        ], unique=False)
+        batch_op.create_index('ix_patient_last_visit_patient_id', [
+            sa.text("coalesce(patient_metadata ->> 'LastVisit', '')"),
+            'patient_id'
+        ], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index('ix_patient_last_visit_patient_id')
+        batch_op.drop_index('ix_patient_age_patient_id')
+        batch_op.drop_index('ix_patient_risk_rank_patient_id')
+        batch_op.drop_index('ix_patient_metadata_gin', postgresql_using='gin')
+        batch_op.alter_column('patient_metadata',
+               existing_type=postgresql.JSONB(astext_type=sa.Text()),
+               type_=sa.JSON(),
+               existing_nullable=True,
+               postgresql_using='patient_metadata::json')
@@ -0,0 +1,42 @@
+"""add ai_result table for generated SOAP and DVX results
+
+Revision ID: d5e1a7c94b20
+Revises: 8c41d5b7a903
+Create Date: 2026-10-19 13:05:11.482317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e1a7c94b20'
+down_revision = '8c41d5b7a903'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ai_result',
+        sa.Column('result_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('doctor_id', sa.Integer(), nullable=True),
+        sa.Column('method_type', sa.String(length=20), nullable=False),
+        sa.Column('profile', sa.String(length=50), nullable=False),
+        sa.Column('history_hash', sa.String(length=64), nullable=False),
+        sa.Column('content', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['patient_id'], ['patient.patient_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['doctor_id'], ['doctor.doctor_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('result_id')
+    )
+    with op.batch_alter_table('ai_result', schema=None) as batch_op:
+        batch_op.create_index('ix_ai_result_patient_latest', ['patient_id', 'method_type', 'profile', 'doctor_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ai_result', schema=None) as batch_op:
+        batch_op.drop_index('ix_ai_result_patient_latest')
+
+    op.drop_table('ai_result')
@@ -0,0 +1,22 @@
+import json
+
+from app.chat_history_store import messages_hash, sync_cursor
+from app.utils.pagination import decode_cursor
+
+HISTORY = [{"type": "user", "content": "hi"}, {"type": "assistant", "content": "hello"}]
+
+
+def test_json_array_history_gets_a_message_cursor():
+    cursor = decode_cursor(sync_cursor(7, json.dumps(HISTORY).encode("utf-8")))
+    assert cursor == {"g": 7, "m": 2, "h": messages_hash(HISTORY)}
+
+
+def test_json_lines_history_gets_a_byte_cursor():
+    data = "".join(json.dumps(message) + "\n" for message in HISTORY).encode("utf-8")
+    cursor = decode_cursor(sync_cursor(7, data))
+    assert cursor["o"] == len(data) and "m" not in cursor
+
+
+def test_unparseable_history_gets_a_byte_cursor():
+    cursor = decode_cursor(sync_cursor(7, b"[not json"))
+    assert cursor["o"] == len(b"[not json")
@@ -0,0 +1,85 @@
+import pytest
+
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Outage(Exception):
+    pass
+
+
+class Missing(Exception):
+    pass
+
+
+def is_failure(error):
+    return isinstance(error, Outage)
+
+
+def fail(breaker, error=Outage):
+    with pytest.raises(error):
+        with breaker.guard(is_failure):
+            raise error()
+
+
+def succeed(breaker):
+    with breaker.guard(is_failure):
+        pass
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED
+    fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as raised:
+        succeed(breaker)
+    assert raised.value.dependency == "test"
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    fail(breaker)
+    succeed(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_errors_that_are_not_failures_do_not_count():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    fail(breaker, Missing)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    fail(breaker)
+    assert breaker.state == OPEN
+    succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_reopens_on_failure():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == OPEN
+
+
+def test_half_open_limits_probes():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0, half_open_max_calls=1)
+    fail(breaker)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_stays_open_until_the_reset_timeout():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    fail(breaker)
+    assert breaker.is_open()
+    assert not breaker.allow()
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from app.ai_services.limiter import (
+    AdmissionRejected, BACKGROUND, INTERACTIVE, STANDARD, ModelLimiter, TokenBucket
+)
+
+
+def test_token_bucket_keeps_a_reserve_for_lower_shares():
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(1, 1.0) == 0
+    bucket.take(59)
+    assert bucket.wait_time(1, 1.0) == 0
+    # Half the capacity stays in reserve for a 0.5 share
+    assert bucket.wait_time(1, 0.5) == pytest.approx(30.0)
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    bucket.refill(bucket.updated + 2.0)
+    assert bucket.level == pytest.approx(2.0)
+
+
+def test_concurrency_cap():
+    limiter = ModelLimiter("test", max_concurrency=2)
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire(INTERACTIVE, 0, timeout=0.05)
+    limiter.release()
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    assert limiter.in_flight == 2
+
+
+def test_background_calls_only_use_their_share_of_slots():
+    limiter = ModelLimiter("test", max_concurrency=4)
+    limiter.acquire(BACKGROUND, 0, timeout=0.1)
+    limiter.acquire(BACKGROUND, 0, timeout=0.1)
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire(BACKGROUND, 0, timeout=0.05)
+    # The remaining slots are still available to interactive calls
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    assert limiter.in_flight == 4
+
+
+def test_requests_per_minute():
+    limiter = ModelLimiter("test", requests_per_minute=2)
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire(INTERACTIVE, 0, timeout=0.05)
+
+
+def test_large_calls_are_capped_at_the_token_budget():
+    limiter = ModelLimiter("test", tokens_per_minute=1000)
+    limiter.acquire(INTERACTIVE, 50000, timeout=0.1)
+    assert limiter.tokens.level == pytest.approx(0.0, abs=1.0)
+
+
+def test_waiters_are_admitted_in_priority_order():
+    limiter = ModelLimiter("test", max_concurrency=1)
+    limiter.acquire(INTERACTIVE, 0, timeout=0.1)
+    admitted = []
+
+    def wait(priority):
+        limiter.acquire(priority, 0, timeout=5)
+        admitted.append(priority)
+        limiter.release()
+
+    threads = [threading.Thread(target=wait, args=(priority,)) for priority in (BACKGROUND, STANDARD, INTERACTIVE)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    limiter.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert admitted == [INTERACTIVE, STANDARD, BACKGROUND]
+
+
+def test_admit_releases_on_error():
+    limiter = ModelLimiter("test", max_concurrency=1)
+    with pytest.raises(RuntimeError):
+        with limiter.admit(INTERACTIVE, 0, timeout=0.1):
+            raise RuntimeError("model failed")
+    assert limiter.in_flight == 0
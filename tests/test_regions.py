@@ -0,0 +1,100 @@
+import pytest
+from google.genai import errors as genai_errors
+
+from app.ai_services.regions import RegionPool
+
+
+class FakeModels:
+    """Stands in for genai.Client.models, following a script of outcomes per region."""
+
+    def __init__(self, location, script, calls):
+        self.location = location
+        self.script = script
+        self.calls = calls
+
+    def _outcome(self):
+        self.calls.append(self.location)
+        outcome = self.script.get(self.location, "ok")
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def generate_content(self, **kwargs):
+        return f"{self._outcome()} from {self.location}"
+
+    def generate_content_stream(self, **kwargs):
+        # Like the real client, nothing is sent until the stream is iterated
+        yield f"{self._outcome()} from {self.location}"
+        if self.script.get(f"{self.location}:mid-stream"):
+            raise self.script[f"{self.location}:mid-stream"]
+        yield "done"
+
+
+class FakeClient:
+    def __init__(self, location, script, calls):
+        self.models = FakeModels(location, script, calls)
+
+
+def make_pool(script, locations=("us-central1", "europe-west4", "asia-southeast1"), **config):
+    pool = RegionPool("test", {"project": "test", "locations": list(locations), **config})
+    calls = []
+    pool.client = lambda location: FakeClient(location, script, calls)
+    return pool, calls
+
+
+def unavailable():
+    return genai_errors.APIError(503, {"error": {"message": "unavailable"}})
+
+
+def quota():
+    return genai_errors.APIError(429, {"error": {"message": "quota"}})
+
+
+def test_call_uses_the_first_region_without_history():
+    pool, calls = make_pool({})
+    assert pool.call(lambda client: client.models.generate_content()) == "ok from us-central1"
+    assert calls == ["us-central1"]
+
+
+def test_call_fails_over_on_retryable_errors():
+    pool, calls = make_pool({"us-central1": unavailable()})
+    assert pool.call(lambda client: client.models.generate_content()) == "ok from europe-west4"
+    assert calls == ["us-central1", "europe-west4"]
+    assert pool.ranked()[-1] == "us-central1"
+
+
+def test_call_does_not_fail_over_on_request_errors():
+    pool, calls = make_pool({"us-central1": genai_errors.APIError(400, {"error": {"message": "bad"}})})
+    with pytest.raises(genai_errors.APIError):
+        pool.call(lambda client: client.models.generate_content())
+    assert calls == ["us-central1"]
+
+
+def test_call_is_limited_to_region_failover_attempts():
+    pool, calls = make_pool({"us-central1": unavailable(), "europe-west4": unavailable()}, region_failover_attempts=2)
+    with pytest.raises(genai_errors.APIError):
+        pool.call(lambda client: client.models.generate_content())
+    assert calls == ["us-central1", "europe-west4"]
+
+
+def test_quota_errors_put_a_region_last():
+    pool, _ = make_pool({"us-central1": quota()})
+    pool.call(lambda client: client.models.generate_content())
+    assert pool.ranked()[-1] == "us-central1"
+
+
+def test_stream_fails_over_when_opening_fails():
+    pool, calls = make_pool({"us-central1": unavailable()})
+    chunks = list(pool.stream(lambda client: client.models.generate_content_stream()))
+    assert chunks == ["ok from europe-west4", "done"]
+    assert calls == ["us-central1", "europe-west4"]
+
+
+def test_stream_is_not_restarted_after_the_first_chunk():
+    pool, calls = make_pool({"us-central1:mid-stream": unavailable()})
+    stream = pool.stream(lambda client: client.models.generate_content_stream())
+    assert next(stream) == "ok from us-central1"
+    with pytest.raises(genai_errors.APIError):
+        next(stream)
+    assert calls == ["us-central1"]
+    assert pool.stats["us-central1"].error_rate > 0
@@ -0,0 +1,74 @@
+import json
+
+from app.ai_services.embeddings import HashingEmbedder
+from app.semantic_cache import SemanticCache, cacheable_question, load_faq
+
+FAQ = ["How do I book an appointment?", "How should I prepare for a blood test?"]
+
+
+def ask(question):
+    return [{"type": "user", "content": question}]
+
+
+def make_cache(**config):
+    return SemanticCache(enabled=True, threshold=0.6, faq=FAQ, **config), HashingEmbedder(256)
+
+
+def test_faq_answers_are_shared_across_patients_with_the_same_instruction():
+    cache, embedder = make_cache()
+    answer, key = cache.lookup(embedder, "You are a helpful assistant.", ask("How do I book an appointment?"))
+    assert answer is None and key is not None
+    cache.store(key, "Call the front desk.")
+    answer, _ = cache.lookup(embedder, "You are a helpful assistant.", ask("how do I book an appointment"))
+    assert answer == "Call the front desk."
+
+
+def test_answers_are_not_shared_across_instructions():
+    cache, embedder = make_cache()
+    _, key = cache.lookup(embedder, "instruction for patient 1", ask("How do I book an appointment?"))
+    cache.store(key, "Call the front desk.")
+    answer, key = cache.lookup(embedder, "instruction for patient 2", ask("How do I book an appointment?"))
+    assert answer is None and key is not None
+
+
+def test_questions_outside_the_faq_are_not_cached():
+    cache, embedder = make_cache()
+    assert cache.lookup(embedder, "", ask("My knee hurts when I climb stairs")) == (None, None)
+
+
+def test_risky_questions_are_not_cached_even_if_they_resemble_the_faq():
+    assert cacheable_question(ask("How do I book 2 appointments?")) is None
+    assert cacheable_question(ask("Should I stop my medication before a blood test?")) is None
+    assert cacheable_question(ask("How do I book an appointment?")) is not None
+
+
+def test_follow_up_turns_are_not_cached():
+    cache, embedder = make_cache()
+    messages = ask("Hi") + [{"type": "assistant", "content": "Hello"}] + ask("How do I book an appointment?")
+    assert cache.lookup(embedder, "", messages) == (None, None)
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache, embedder = make_cache(max_entries=1)
+    _, first = cache.lookup(embedder, "", ask(FAQ[0]))
+    cache.store(first, "Call the front desk.")
+    _, second = cache.lookup(embedder, "", ask(FAQ[1]))
+    cache.store(second, "Fast for eight hours.")
+    assert cache.entries() == 1
+    assert cache.lookup(embedder, "", ask(FAQ[0]))[0] is None
+
+
+def test_expired_answers_are_not_served():
+    cache, embedder = make_cache(ttl=-1)
+    _, key = cache.lookup(embedder, "", ask(FAQ[0]))
+    cache.store(key, "Call the front desk.")
+    assert cache.lookup(embedder, "", ask(FAQ[0]))[0] is None
+
+
+def test_load_faq(tmp_path):
+    path = tmp_path / "faq.json"
+    path.write_text(json.dumps([" How do I book an appointment? ", ""]))
+    assert load_faq(str(path)) == ["How do I book an appointment?"]
+    path.write_text('{"not": "a list"}')
+    assert load_faq(str(path)) == []
+    assert load_faq(None) == []
@@ -0,0 +1,177 @@
+import json
+
+import pytest
+
+from app.ai_services.profiles import GenerationProfile, build_config, get_profile, register_profile
+from app.ai_services.structured_output import (
+    StructuredOutputError, compile_schema, parse_json, structured_output
+)
+
+NOTE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "assessment": {"type": "STRING"},
+        "plan": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "severity": {"type": "STRING", "enum": ["mild", "moderate", "severe"]},
+        "temperature": {"type": "NUMBER"},
+        "heart_rate": {"type": "INTEGER", "minimum": 0, "maximum": 300, "units": ["bpm"]},
+        "notes": {"type": "STRING"}
+    },
+    "required": ["assessment", "plan", "severity"]
+}
+DIAGNOSES_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "diagnosis": {"type": "STRING"},
+            "likelihood": {"type": "STRING", "enum": ["low", "medium", "high"]}
+        },
+        "required": ["diagnosis", "likelihood"]
+    }
+}
+
+register_profile(GenerationProfile("test-note", 1, "application/json", NOTE_SCHEMA))
+register_profile(GenerationProfile("test-diagnoses", 1, "application/json", DIAGNOSES_SCHEMA))
+
+
+@pytest.mark.parametrize("text, expected, repaired", [
+    ('{"a": 1}', {"a": 1}, False),
+    ('```json\n{"a": 1}\n```', {"a": 1}, True),
+    ('```\n[1, 2]\n```', [1, 2], True),
+    ('Here is the note:\n{"a": 1}\nLet me know if you need more.', {"a": 1}, True),
+    ('```json\n{"a": 1, "b": "cut', {"a": 1}, True),
+    # A string cut off mid-value is dropped, not closed
+    ('{"a": "x", "b": "half a sent', {"a": "x"}, True),
+    ('{"a": "x", "b": "complete"', {"a": "x", "b": "complete"}, True),
+    # So is a number, which may have lost digits
+    ('{"a": "x", "b": 12', {"a": "x"}, True),
+    ('{"a": "x", "b": tru', {"a": "x"}, True),
+    ('{"a": "x", "b', {"a": "x"}, True),
+    ('{"a": "x", "b":', {"a": "x"}, True),
+    ('{"a": ["p1", "p2", "p3 trunc', {"a": ["p1", "p2"]}, True),
+    ('{"a": {"b": 1, "c": "tr', {"a": {"b": 1}}, True),
+    # Nothing complete: the member is dropped rather than left empty
+    ('{"plan": ["half', {}, True),
+    ('{"plan": "half', {}, True),
+    ('[{"d": "flu"}, {"d": "co', [{"d": "flu"}], True),
+])
+def test_parse_json(text, expected, repaired):
+    assert parse_json(text) == (expected, repaired)
+
+
+@pytest.mark.parametrize("text", [None, "", "no json here", "```\n```"])
+def test_parse_json_rejects_output_without_json(text):
+    with pytest.raises(StructuredOutputError):
+        parse_json(text)
+
+
+@pytest.mark.parametrize("schema, value, expected", [
+    ({"type": "STRING", "enum": ["mild", "severe"]}, "Severe", "severe"),
+    ({"type": "STRING", "enum": ["mild", "severe"]}, " MILD ", "mild"),
+    ({"type": "NUMBER"}, "38.5", 38.5),
+    ({"type": "NUMBER", "units": ["°C"]}, "38.5 °C", 38.5),
+    ({"type": "NUMBER"}, "75%", 75.0),
+    ({"type": "NUMBER"}, 4, 4),
+    ({"type": "INTEGER", "units": ["bpm"]}, "120 BPM", 120),
+    ({"type": "INTEGER", "units": ["years", "years old"]}, "18 years old", 18),
+    ({"type": "INTEGER"}, 7.0, 7),
+    ({"type": "INTEGER", "maximum": 300}, "450", 300),
+    ({"type": "BOOLEAN"}, "True", True),
+    ({"type": "ARRAY", "items": {"type": "STRING"}}, "rest", ["rest"]),
+])
+def test_coercion(schema, value, expected):
+    errors = []
+    assert compile_schema(schema)(value, "field", errors) == expected
+    assert errors == []
+
+
+@pytest.mark.parametrize("schema, value", [
+    # No prefix or substring matches
+    ({"type": "STRING", "enum": ["mild", "severe"]}, "mildly severe"),
+    ({"type": "STRING", "enum": ["mild", "severe"]}, "sev"),
+    # Only a whole number, optionally with a percent sign or a listed unit, is a number
+    ({"type": "NUMBER"}, "120/80"),
+    ({"type": "NUMBER"}, "38.5 °C"),
+    ({"type": "INTEGER", "units": ["years"]}, "18 months"),
+    ({"type": "NUMBER"}, "between 5 and 10"),
+    ({"type": "NUMBER"}, "about 38"),
+    ({"type": "NUMBER"}, True),
+    ({"type": "INTEGER"}, "5.7"),
+    ({"type": "BOOLEAN"}, "yes"),
+    ({"type": "STRING", "format": "date"}, "next Tuesday"),
+])
+def test_coercion_errors(schema, value):
+    errors = []
+    compile_schema(schema)(value, "field", errors)
+    assert errors and errors[0][0] == "field"
+
+
+def test_units_are_not_sent_to_the_model():
+    schema = build_config("gemini", get_profile("test-note")).response_schema
+    assert schema["properties"]["heart_rate"] == {"type": "INTEGER", "minimum": 0, "maximum": 300}
+
+
+def test_invalid_optional_property_is_dropped():
+    errors = []
+    value = compile_schema(NOTE_SCHEMA)(
+        {"assessment": "a", "plan": ["p"], "severity": "mild", "temperature": "warm"}, "", errors
+    )
+    assert errors == []
+    assert "temperature" not in value
+
+
+def test_valid_output_is_not_regenerated():
+    def regenerate(instructions, part_schema):
+        raise AssertionError("should not regenerate")
+    text = '{"assessment": "viral", "plan": ["rest"], "severity": "Mild", "heart_rate": "88 bpm"}'
+    assert structured_output("test-note", text, regenerate) == {
+        "assessment": "viral", "plan": ["rest"], "severity": "mild", "heart_rate": 88
+    }
+
+
+def test_invalid_fields_are_regenerated_and_merged():
+    requests = []
+
+    def regenerate(instructions, part_schema):
+        requests.append(part_schema)
+        return '{"severity": "moderate"}'
+    text = '{"assessment": "viral", "plan": ["rest"], "severity": "quite bad", "notes": "keep"}'
+    value = structured_output("test-note", text, regenerate)
+    assert value == {"assessment": "viral", "plan": ["rest"], "severity": "moderate", "notes": "keep"}
+    assert list(requests[0]["properties"]) == ["severity"]
+
+
+def test_required_field_lost_to_truncation_is_regenerated():
+    def regenerate(instructions, part_schema):
+        assert part_schema["required"] == ["plan"]
+        return '{"plan": ["rest", "fluids"]}'
+    text = '{"assessment": "viral", "severity": "mild", "plan": ["rest and flu'
+    value = structured_output("test-note", text, regenerate)
+    assert value == {"assessment": "viral", "severity": "mild", "plan": ["rest", "fluids"]}
+
+
+def test_invalid_items_are_regenerated_and_merged():
+    def regenerate(instructions, part_schema):
+        assert json.loads(instructions.splitlines()[1]) == [{"diagnosis": "cold", "likelihood": "maybe"}]
+        return '[{"diagnosis": "cold", "likelihood": "medium"}]'
+    text = json.dumps([
+        {"diagnosis": "flu", "likelihood": "High"},
+        {"diagnosis": "cold", "likelihood": "maybe"}
+    ])
+    assert structured_output("test-diagnoses", text, regenerate) == [
+        {"diagnosis": "flu", "likelihood": "high"},
+        {"diagnosis": "cold", "likelihood": "medium"}
+    ]
+
+
+def test_still_invalid_after_regeneration_raises():
+    text = '{"assessment": "viral", "plan": ["rest"], "severity": "quite bad"}'
+    with pytest.raises(StructuredOutputError) as raised:
+        structured_output("test-note", text, lambda instructions, part_schema: '{"severity": "very"}')
+    assert raised.value.errors == [("severity", "expected one of mild, moderate, severe")]
+
+
+def test_invalid_without_regenerate_raises():
+    with pytest.raises(StructuredOutputError):
+        structured_output("test-note", '{"assessment": "viral"}')